@@ -33,6 +33,10 @@ def create_app():
     migrate.init_app(app, db)
     jwt.init_app(app)
 
+    # คิว ingest เบื้องหลัง (หยิบงานค้างจากรอบก่อนกลับมาทำต่อ)
+    from .services import ingest_jobs
+    ingest_jobs.init_app(app)
+
     @app.errorhandler(RequestEntityTooLarge)
     def handle_file_too_large(e):
         return jsonify({
@@ -0,0 +1,193 @@
+from __future__ import annotations
+import asyncio, json, logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from flask_jwt_extended import decode_token
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+from . import create_app
+from .config import Config
+from .extensions import db
+from .services import chat_turns, ollama_async
+
+logger = logging.getLogger(__name__)
+
+# ---------- ASGI entry (uvicorn): /api/ai/chat/stream แบบ asyncio, ที่เหลือส่งต่อให้ Flask ----------
+# stream ที่เปิดค้างรอ token ใช้แค่ coroutine + connection ของ httpx (ไม่จอง worker thread)
+# งาน sync (DB, RAG/embedding) รันใน thread pool ภายใน app context แล้วคืน thread ทันที
+# รัน: uvicorn asgi:app --host 0.0.0.0 --port 8088 --loop uvloop --http httptools
+
+CHAT_STREAM_PATH = "/api/ai/chat/stream"
+
+
+class _AuthError(Exception):
+    pass
+
+
+class ChatStreamASGI:
+    def __init__(self, flask_app):
+        self.flask = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=int(getattr(Config, "ASGI_WSGI_WORKERS", 10)))
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(getattr(Config, "ASGI_THREADS", 32)), thread_name_prefix="asgi-sync"
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http" and scope["path"] == CHAT_STREAM_PATH and scope["method"] == "POST":
+            await self._chat_stream(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                await ollama_async.aclose()
+                self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # ---- helpers ----
+
+    async def _in_app(self, fn, *args):
+        """เรียกโค้ด sync (DB/RAG) ใน thread ภายใน Flask app context"""
+        def run():
+            with self.flask.app_context():
+                try:
+                    return fn(*args)
+                finally:
+                    db.session.remove()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, run)
+
+    def _identity(self, authorization: str | None):
+        # เทียบเท่า @jwt_required(optional=True): ไม่มี token → None, token เสีย/หมดอายุ → 401
+        if not authorization:
+            return None
+        scheme, _, token = authorization.partition(" ")
+        if scheme != Config.JWT_HEADER_TYPE or not token:
+            raise _AuthError("Missing 'Bearer' type in 'Authorization' header")
+        with self.flask.app_context():
+            try:
+                claims = decode_token(token)
+            except Exception as e:
+                raise _AuthError(str(e)) from e
+            return claims.get(self.flask.config.get("JWT_IDENTITY_CLAIM", "sub"))
+
+    @staticmethod
+    async def _start(send, status: int, mimetype: str, headers: dict | None = None) -> None:
+        raw = [(b"content-type", mimetype.encode("latin-1")), (b"access-control-allow-origin", b"*")]
+        raw += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+        await send({"type": "http.response.start", "status": status, "headers": raw})
+
+    @staticmethod
+    async def _write(send, text: str, more: bool = True) -> None:
+        await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": more})
+
+    async def _json(self, send, status: int, payload: dict) -> None:
+        await self._start(send, status, "application/json")
+        await self._write(send, json.dumps(payload, ensure_ascii=False), more=False)
+
+    # ---- /api/ai/chat/stream ----
+
+    async def _chat_stream(self, scope, receive, send) -> None:
+        body = b""
+        while True:
+            msg = await receive()
+            if msg["type"] == "http.disconnect":
+                return
+            body += msg.get("body", b"")
+            if not msg.get("more_body"):
+                break
+
+        try:
+            data = json.loads(body or b"{}") or {}
+        except ValueError:
+            return await self._json(send, 400, {"error": "invalid JSON body"})
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        query = parse_qs((scope.get("query_string") or b"").decode("latin-1"))
+
+        try:
+            identity = self._identity(headers.get("authorization"))
+        except _AuthError as e:
+            return await self._json(send, 401, {"msg": str(e)})
+        try:
+            turn = await self._in_app(chat_turns.start_turn, data, identity)
+        except chat_turns.ChatError as e:
+            return await self._json(send, e.status, e.payload())
+
+        fmt = chat_turns.stream_format(data, (query.get("format") or [None])[0], headers.get("accept"))
+        produce = self._produce_text if fmt == "text" else self._produce_events
+
+        # ผู้ใช้ปิดการเชื่อมต่อ → ยกเลิก coroutine ที่ stream อยู่ (ปิด connection ไป Ollama ด้วย)
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        task = asyncio.create_task(produce(send, turn, fmt))
+        watcher = asyncio.create_task(watch_disconnect())
+        done, pending = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        for t in pending:
+            t.cancel()
+        if task in done:
+            task.result()  # ให้ exception ที่หลุดมาถูก log โดย server
+
+    async def _produce_text(self, send, turn, fmt: str) -> None:
+        # โหมดเดิม (text/plain): sources/error ต้องคำนวณก่อนเพราะส่งทาง header
+        msgs, sources, rag_error = await self._in_app(turn.build_messages)
+        await self._start(send, 200, chat_turns.STREAM_MIMETYPES["text"],
+                          chat_turns.stream_headers(turn.conversation_id, sources, rag_error))
+        buffer: list[str] = []
+        try:
+            async for kind, value in ollama_async.stream_chat_events(turn.model, msgs):
+                if kind == "delta":
+                    buffer.append(value)
+                    await self._write(send, value)
+        except Exception:
+            logger.exception("Ollama stream failed")
+            await self._write(send, f"\n({chat_turns.STREAM_ERROR_TEXT})\n", more=False)
+            return
+        if buffer:
+            await self._in_app(turn.save_reply, self.flask, buffer)
+            await self._write(send, "", more=False)
+        else:
+            await self._write(send, "\n", more=False)
+
+    async def _produce_events(self, send, turn, fmt: str) -> None:
+        enc = chat_turns.encode_event
+        await self._start(send, 200, chat_turns.STREAM_MIMETYPES[fmt], chat_turns.stream_headers(turn.conversation_id))
+        await self._write(send, enc(fmt, {"type": "meta", "conversation_id": turn.conversation_id, "model": turn.model,
+                                          "stage": "retrieving" if turn.use_knowledge else "generating"}))
+        msgs, sources, rag_error = await self._in_app(turn.build_messages)
+        if rag_error:
+            await self._write(send, enc(fmt, {"type": "error", "stage": "rag", "fatal": False, "message": rag_error[:500]}))
+        if turn.use_knowledge:
+            await self._write(send, enc(fmt, {"type": "sources", "items": sources}))
+
+        buffer: list[str] = []
+        usage: dict = {}
+        try:
+            async for kind, value in ollama_async.stream_chat_events(turn.model, msgs):
+                if kind == "delta":
+                    buffer.append(value)
+                    await self._write(send, enc(fmt, {"type": "delta", "content": value}))
+                else:
+                    usage = value
+        except Exception:
+            logger.exception("Ollama stream failed")
+            await self._write(send, enc(fmt, {"type": "error", "stage": "generate", "fatal": True,
+                                              "message": chat_turns.STREAM_ERROR_TEXT}), more=False)
+            return
+
+        if usage:
+            await self._write(send, enc(fmt, {"type": "usage", **usage}))
+        await self._in_app(turn.save_reply, self.flask, buffer)
+        await self._write(send, enc(fmt, {"type": "done", "conversation_id": turn.conversation_id}), more=False)
+
+
+def create_asgi_app() -> ChatStreamASGI:
+    return ChatStreamASGI(create_app())
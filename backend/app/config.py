@@ -34,8 +34,75 @@ class Config:
     RAG_MAX_DISTANCE = float(os.getenv("RAG_MAX_DISTANCE", 0.35))  # ยิ่งต่ำยิ่งใกล้ (cosine distance)
     RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", 1100))
     RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", 200))
+    RAG_CHUNK_SENTENCES = os.getenv("RAG_CHUNK_SENTENCES", "0") == "1"  # ชิ้นที่ยาวเกิน: ตัดที่ท้ายประโยค/ช่องว่างแทนตัดกลางคำ (id ชิ้นเปลี่ยน → ingest ใหม่ทั้งหมด)
     RAG_MAX_DOC_CHARS = int(os.getenv("RAG_MAX_DOC_CHARS", 900))   # จำกัดต่อชิ้น
     RAG_MAX_CONTEXT_CHARS = int(os.getenv("RAG_MAX_CONTEXT_CHARS", 3500)) 
+    RAG_PDF_WORKERS = int(os.getenv("RAG_PDF_WORKERS", 0))                       # 0 = เท่าจำนวน CPU
+    RAG_PDF_PARALLEL_MIN_PAGES = int(os.getenv("RAG_PDF_PARALLEL_MIN_PAGES", 64))  # ต่ำกว่านี้อ่าน process เดียว
+    RAG_PER_USER_COLLECTIONS = os.getenv("RAG_PER_USER_COLLECTIONS", "0") == "1"  # ค่าเริ่มต้นของผู้ใช้: kb_u<id> + kb_default
+    # collection ที่ทุกคนค้น/อัปโหลดได้ นอกจาก kb_default และ kb_u<id> ของตัวเอง (คั่นด้วย ,)
+    RAG_SHARED_COLLECTIONS = [c.strip() for c in os.getenv("RAG_SHARED_COLLECTIONS", "").split(",") if c.strip()]
+    RAG_SEARCH_WORKERS = int(os.getenv("RAG_SEARCH_WORKERS", 4))  # ค้นหลาย collection พร้อมกัน
+    RAG_EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", 64))  # จำนวนชิ้นต่อรอบ embed → add ลง Chroma
+    # จำนวน batch ที่ embed พร้อมกัน (ให้ตรงกับ OLLAMA_NUM_PARALLEL ฝั่ง Ollama server)
+    RAG_EMBED_WORKERS = int(os.getenv("RAG_EMBED_WORKERS", os.getenv("OLLAMA_NUM_PARALLEL", 4)))
+
+    # Embedding cache (SQLite ข้าง CHROMA_DIR + LRU ในหน่วยความจำ)
+    EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE_ENABLED", "1") == "1"
+    EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(os.path.dirname(CHROMA_DIR), "embed_cache.sqlite3"))
+    EMBED_CACHE_MAX_ITEMS = int(os.getenv("EMBED_CACHE_MAX_ITEMS", 500_000))   # แถวบนดิสก์
+    EMBED_CACHE_MEM_ITEMS = int(os.getenv("EMBED_CACHE_MEM_ITEMS", 5_000))     # LRU ในหน่วยความจำ
+
+    # Hybrid retrieval: BM25 (SQLite FTS5) ข้าง CHROMA_DIR + รวมกับ dense ด้วย RRF
+    RAG_HYBRID = os.getenv("RAG_HYBRID", "1") == "1"
+    LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(os.path.dirname(CHROMA_DIR), "lexical.sqlite3"))
+    # ชิ้นที่เจอจาก BM25 อย่างเดียว (ไม่ผ่าน dense cutoff) ต้องครอบคลุมน้ำหนักคำค้นอย่างน้อยเท่านี้ (0–1) จึงนำมารวม
+    RAG_LEXICAL_MIN_SCORE = float(os.getenv("RAG_LEXICAL_MIN_SCORE", 0.25))
+    # map source → chunk id (เขียนตอน ingest) ไว้ลบเอกสารด้วย id ตรง ๆ
+    SOURCE_INDEX_PATH = os.getenv("SOURCE_INDEX_PATH", os.path.join(os.path.dirname(CHROMA_DIR), "sources.sqlite3"))
+
+    # MMR: กระจายผลลัพธ์ไม่ให้ได้ชิ้นซ้ำ ๆ จากหน้าเดียวกัน
+    RAG_MMR = os.getenv("RAG_MMR", "0") == "1"
+    RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", 0.7))    # 1 = เน้นความเกี่ยวข้องล้วน, 0 = เน้นความหลากหลาย
+    RAG_MMR_DUP_SIM = float(os.getenv("RAG_MMR_DUP_SIM", 0.95))  # คล้ายกันเกินนี้ถือว่าซ้ำ ทิ้งเลย
+
+    # งบ token ของ prompt (context window มาจาก OLLAMA_NUM_CTX/Modelfile/OLLAMA_DEFAULT_NUM_CTX ดู model_registry.context_length)
+    # tokenizer.json ของโมเดลแชท (ไฟล์ในเครื่องเท่านั้น ไม่ดาวน์โหลด) — ไม่มีไฟล์ = ประมาณจากความยาว + เตือนใน log
+    RAG_TOKENIZER = os.getenv("RAG_TOKENIZER", os.path.join(os.path.dirname(CHROMA_DIR), "tokenizer.json"))
+    RAG_ANSWER_RESERVE_TOKENS = int(os.getenv("RAG_ANSWER_RESERVE_TOKENS", 768))  # เผื่อไว้ให้คำตอบ
+    RAG_MAX_DOC_TOKENS = int(os.getenv("RAG_MAX_DOC_TOKENS", 512))                # จำกัดต่อชิ้น
+    RAG_HISTORY_MAX_SHARE = float(os.getenv("RAG_HISTORY_MAX_SHARE", 0.4))        # history ได้ไม่เกินสัดส่วนนี้ก่อนเติมบริบท
+
+    # Chat history: N ข้อความล่าสุด + สรุปแบบ rolling ของข้อความที่เก่ากว่า (เก็บใน conversations.summary)
+    CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", 20))
+    CHAT_SUMMARY_ENABLED = os.getenv("CHAT_SUMMARY_ENABLED", "0") == "1"
+    CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "")                # ว่าง = ใช้โมเดลเดียวกับแชท
+    CHAT_SUMMARY_BATCH = int(os.getenv("CHAT_SUMMARY_BATCH", 6))            # สรุปเมื่อมีข้อความหลุดหน้าต่างครบเท่านี้
+    CHAT_SUMMARY_MSG_CHARS = int(os.getenv("CHAT_SUMMARY_MSG_CHARS", 1000))  # ตัดแต่ละข้อความก่อนส่งไปสรุป
+    CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", 2000))
+
+    # Query-result cache ของ rag.search
+    RAG_QUERY_CACHE_ENABLED = os.getenv("RAG_QUERY_CACHE_ENABLED", "1") == "1"
+    RAG_QUERY_CACHE_SIZE = int(os.getenv("RAG_QUERY_CACHE_SIZE", 1024))
+    RAG_QUERY_CACHE_TTL = float(os.getenv("RAG_QUERY_CACHE_TTL", 300))  # วินาที (คุมความเก่าข้าม worker)
+
+    # Background ingest jobs
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))          # ไฟล์ที่ ingest พร้อมกันต่อ process
+    INGEST_STALE_SEC = int(os.getenv("INGEST_STALE_SEC", 120))    # job running ที่เงียบนานกว่านี้ถือว่าค้าง → ทำใหม่
+    INGEST_HEARTBEAT_SEC = int(os.getenv("INGEST_HEARTBEAT_SEC", 15))  # job running เขียน heartbeat ทุกกี่วินาที (ต้องน้อยกว่า STALE มาก)
+
+    # Model registry (cache ของ /api/tags)
+    MODEL_REGISTRY_TTL = float(os.getenv("MODEL_REGISTRY_TTL", 60))                         # วินาที → refresh เบื้องหลัง
+    MODEL_REGISTRY_MISS_REFRESH_SEC = float(os.getenv("MODEL_REGISTRY_MISS_REFRESH_SEC", 10))  # ไม่เจอโมเดล → ถามใหม่ได้ถี่สุดเท่านี้
+
+    # ASGI (uvicorn asgi:app): thread สำหรับงาน sync ของ chat stream และสำหรับ route Flask ที่เหลือ
+    ASGI_THREADS = int(os.getenv("ASGI_THREADS", 32))
+    ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", 10))
 
     MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", 50))  # ปรับได้ตามต้องการ
-    MAX_CONTENT_LENGTH = MAX_UPLOAD_MB * 1024 * 1024
\ No newline at end of file
+    MAX_CONTENT_LENGTH = MAX_UPLOAD_MB * 1024 * 1024
+
+    # อัปโหลดแบบ stream/ต่อได้ (/api/files/uploads): อ่าน body ลงดิสก์ทีละก้อน + hash ไปพร้อมกัน
+    UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", 1024 * 1024))          # ขนาดที่อ่านจาก body ต่อรอบ
+    UPLOAD_CLIENT_CHUNK_MB = int(os.getenv("UPLOAD_CLIENT_CHUNK_MB", 8))             # ขนาดก้อนที่แนะนำให้ client ส่งต่อคำขอ
+    UPLOAD_SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24))      # session ที่ไม่ขยับนานกว่านี้ถูกลบ
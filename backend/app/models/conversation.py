@@ -2,11 +2,18 @@ from app.extensions import db
 
 class Conversation(db.Model):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # รายการบทสนทนาของผู้ใช้ เรียงใหม่ → เก่า + keyset pagination ตาม id
+        db.Index("ix_conversations_user_id", "user_id", "id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(64), nullable=True)  # เผื่ออนาคตมี auth
     title = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+    # สรุปแบบ rolling ของข้อความเก่าที่หลุดหน้าต่าง history (ดู services/chat_history.py)
+    summary = db.Column(db.Text, nullable=True)
+    summary_upto_id = db.Column(db.Integer, nullable=True)  # id ของ message สุดท้ายที่รวมอยู่ใน summary แล้ว
 
     messages = db.relationship(
         "Message",
@@ -17,6 +24,10 @@ class Conversation(db.Model):
 
 class Message(db.Model):
     __tablename__ = "messages"
+    __table_args__ = (
+        # ดึง N ข้อความล่าสุดของบทสนทนาได้จาก index ตรง ๆ (ไม่ต้อง sort ทั้งบทสนทนา)
+        db.Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey("conversations.id"), index=True, nullable=False)
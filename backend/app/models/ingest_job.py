@@ -0,0 +1,56 @@
+from datetime import datetime
+import json
+from app.extensions import db
+
+class IngestJob(db.Model):
+    __tablename__ = "ingest_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)       # ชื่อเดิมที่ผู้ใช้อัปโหลด
+    stored_name = db.Column(db.String(255), nullable=False)    # ชื่อหลัง secure_filename
+    path = db.Column(db.String(1024), nullable=False)
+    sha256 = db.Column(db.String(64), index=True)              # hash ของไฟล์ ไว้กันอัปโหลดซ้ำ
+    collection = db.Column(db.String(63), nullable=False, default="kb_default")
+    uid = db.Column(db.Integer, index=True)                    # ผู้อัปโหลด (None = ไม่ได้ล็อกอิน) — เห็น/ยกเลิกได้เฉพาะเจ้าของ
+    metadata_json = db.Column(db.Text)                         # metadata ที่ส่งต่อให้ ingest_file
+    # 'queued' | 'running' | 'cancelling' | 'cancelled' | 'done' | 'failed'
+    status = db.Column(db.String(16), index=True, nullable=False, default="queued")
+    chunks_done = db.Column(db.Integer, nullable=False, default=0)
+    chunks_total = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    owner = db.Column(db.String(128))                          # "<host>:<pid>:<token>" ของ process ที่กำลังทำ (heartbeat)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def meta(self) -> dict:
+        try:
+            return json.loads(self.metadata_json or "{}")
+        except ValueError:
+            return {}
+
+    def to_dict(self):
+        elapsed = None
+        if self.started_at:
+            end = self.finished_at or datetime.utcnow()
+            elapsed = max((end - self.started_at).total_seconds(), 0.0)
+        rate = (self.chunks_done / elapsed) if elapsed else 0.0
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "stored_name": self.stored_name,
+            "collection": self.collection,
+            "sha256": self.sha256,
+            "status": self.status,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "progress": (self.chunks_done / self.chunks_total) if self.chunks_total else 0.0,
+            "chunks_per_sec": round(rate, 2),
+            "elapsed_sec": round(elapsed, 2) if elapsed is not None else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -1,33 +1,19 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.services.ollama_client import chat, embed
-from ..services import rag
+from ..services import chat_turns
 from app.models.conversation import Conversation, Message   # <<— import ตรงจากไฟล์โมดูล
-from sqlalchemy import desc, asc
+from sqlalchemy import desc, asc, func, select
 from app.extensions import db
-from app.services.ollama_client import stream_chat as _ollama_stream
+from app.services.ollama_client import stream_chat as _ollama_stream, stream_chat_events
 from flask import current_app
 import base64, json, unicodedata, re
-from ..services.ollama_client import model_available, list_models
+from ..services.ollama_client import pool_stats
+from ..services import model_registry
 from  ..utils.json import json_error
 
 ai_bp = Blueprint("ai", __name__)
 
-_ASCII_SAFE = re.compile(r"[^ -~]")  # printable ASCII 0x20-0x7E
-
-def _sources_headers(sources: list[str]) -> tuple[str, str]:
-    # header ASCII fallback เช่น "p.35 • file.pdf | p.249 • file.pdf"
-    ascii_items = []
-    for s in sources or []:
-        t = _ASCII_SAFE.sub("?", s)  # แทนตัว non-ascii ด้วย ?
-        ascii_items.append(t)
-    ascii_join = " | ".join(ascii_items)
-
-    # header B64: เก็บ JSON UTF‑8 เต็ม ๆ
-    b64_json = base64.b64encode(json.dumps(sources, ensure_ascii=False).encode("utf-8")).decode("ascii")
-    return ascii_join, b64_json
-
-
 @ai_bp.post("/chat")
 @jwt_required(optional=True)  # จะบังคับก็เปลี่ยนเป็น @jwt_required()
 def ai_chat():
@@ -47,7 +33,7 @@ def ai_embeddings():
     model = data.get("model", "nomic-embed-text")
     if not text:
         return jsonify({"message": "text is required"}), 400
-    vec = embed(model=model, text=text)
+    vec = embed(model, [text])[0]
     return jsonify({"embedding": vec})
 
 def _ascii_safelists(items):
@@ -65,166 +51,160 @@ def _ascii_safelists(items):
 @ai_bp.post("/chat/stream")
 @jwt_required(optional=True)
 def chat_stream():
+    """stream คำตอบ: text/plain (ค่าเริ่มต้น) หรือ event แบบ SSE/NDJSON (ดู chat_turns.stream_format)
+    ตัว async ที่ไม่ต้องจอง worker thread ตลอดการ generate อยู่ที่ app/asgi.py (path เดียวกัน)"""
     data = request.get_json(force=True) or {}
-    model = data.get("model", "llama3.1")
-    user_message = (data.get("message") or "").strip()
-    conversation_id = data.get("conversation_id")
-    use_knowledge = bool(data.get("use_knowledge", False))
-    topk = int(data.get("topk", 5))
-
-    # เช็คว่ามีโมเดลจริงหรือไม่
-    if not model_available(model):
-        return json_error(
-            f"ไม่พบโมเดล '{model}' บน Ollama — โปรดเลือกโมเดลที่ใช้งานได้ (ดูรายการที่ /api/ai/models)",
-            400,
-            code="MODEL_NOT_FOUND"
-        )
-
-    if not user_message:
-        return jsonify({"error": "message is required"}), 400
-
-    # --- auth (คงพฤติกรรมเดิมของคุณ) ---
-    identity = get_jwt_identity()
     try:
-        uid = int(identity)
-    except (TypeError, ValueError):
-        current_app.logger.error("Invalid JWT identity: %r", identity)
-        return jsonify({"error": "invalid identity"}), 401
-
-    # --- หา/สร้างบทสนทนาของผู้ใช้นี้ ---
-    conv = None
-    if conversation_id:
-        conv = (
-            Conversation.query
-            .filter_by(id=conversation_id, user_id=uid)
-            .first()
-        )
-        if not conv:
-            return jsonify({"error": "conversation not found"}), 404
-
-    if not conv:
-        conv = Conversation(
-            user_id=uid,
-            title=(user_message[:80] + "…") if len(user_message) > 80 else user_message
-        )
-        db.session.add(conv)
-        db.session.commit()
-
-    # --- ประวัติ N ข้อความล่าสุด (ไม่เก็บ/ไม่ใส่ system ใน DB) ---
-    N = 20
-    history = (
-        Message.query
-        .filter_by(conversation_id=conv.id)
-        .order_by(asc(Message.created_at))
-        .limit(N)
-        .all()
-    )
-    history_msgs = [{"role": m.role, "content": m.content} for m in history]
-
-    # --- บันทึก user message ลง DB ก่อนเรียกโมเดล ---
-    db.session.add(Message(conversation_id=conv.id, role="user", content=user_message))
-    db.session.commit()
+        turn = chat_turns.start_turn(data, get_jwt_identity())
+    except chat_turns.ChatError as e:
+        return json_error(e.message, e.status, **({"code": e.code} if e.code else {}))
 
-    # --- เตรียม messages สำหรับโมเดล (RAG-aware) ---
-    sources: list[str] = []
-    rag_error: str | None = None
-    msgs: list[dict]
+    app = current_app._get_current_object()
+    model = turn.model
+    fmt = chat_turns.stream_format(data, request.args.get("format"), request.headers.get("Accept"))
+    if fmt != "text":
+        return _event_stream(fmt, turn, app)
 
-    if use_knowledge:
-        try:
-            # ใช้ตัว build รุ่นใหม่ (มี threshold/trim)
-            from ..services.rag import build_augmented_messages
-            msgs_rag, sources = build_augmented_messages(user_message, topk=topk)
-            # รวม history เข้าระหว่าง system กับ user ของ msgs_rag
-            # msgs_rag = [system_msg, augmented_user]
-            if history_msgs:
-                msgs = [msgs_rag[0], *history_msgs, msgs_rag[1]]
-            else:
-                msgs = msgs_rag
-        except Exception as e:
-            current_app.logger.exception("RAG build/search failed")
-            rag_error = str(e)
-            # fallback → โหมดปกติ
-            use_knowledge = False
-            msgs = history_msgs + [{"role": "user", "content": user_message}]
-    else:
-        msgs = history_msgs + [{"role": "user", "content": user_message}]
+    # --- โหมดเดิม (text/plain): sources/error ต้องคำนวณก่อนเพราะส่งทาง header ---
+    msgs, sources, rag_error = turn.build_messages()
 
-    # --- สตรีมผลลัพธ์จากโมเดล ---
     def generate():
-        had_output = False
         buffer = []
         try:
             for chunk in _ollama_stream(model, msgs):
                 buffer.append(chunk)
-                had_output = True
                 yield chunk
         except Exception as e:
             current_app.logger.exception("Ollama stream failed")
-            yield "\n(เกิดข้อขัดข้องระหว่างเชื่อมต่อโมเดล — โปรดลองอีกครั้ง)\n"
+            yield f"\n({chat_turns.STREAM_ERROR_TEXT})\n"
             return
 
-        # เซฟ assistant หลังสตรีมจบ
-        if had_output:
-            text = "".join(buffer).strip()
-            if text:
-                db.session.add(Message(conversation_id=conv.id, role="assistant", content=text))
-                db.session.commit()
+        if buffer:
+            turn.save_reply(app, buffer)
         else:
             yield "\n"
 
-    # --- headers สำหรับ FE ---
-    headers = {
-        "Cache-Control": "no-cache, no-transform",
-        "X-Accel-Buffering": "no",
-        "X-Conversation-Id": str(conv.id),
-        "Access-Control-Expose-Headers": "X-Conversation-Id, X-Knowledge-Sources, X-Knowledge-Sources-B64, X-RAG-Error",
-    }
-    if use_knowledge and sources:
-        ascii_join, b64_json = _sources_headers(sources)
-        headers["X-Knowledge-Sources"] = ascii_join                    # ASCII-only (fallback)
-        headers["X-Knowledge-Sources-B64"] = b64_json                  # UTF-8 JSON (แนะนำให้ FE ใช้)
-
-    if rag_error:
-        headers["X-RAG-Error"] = (rag_error[:200]).replace("\n", " ")
+    return Response(
+        stream_with_context(generate()),
+        mimetype=chat_turns.STREAM_MIMETYPES["text"],
+        headers=chat_turns.stream_headers(turn.conversation_id, sources, rag_error),
+    )
+
+
+def _event_stream(fmt: str, turn, app) -> Response:
+    """โหมด event (SSE/NDJSON): ส่ง response ได้ทันที แล้วทยอยส่ง
+    meta → (sources | error ของ RAG) → delta … → usage → done  หรือ error (fatal) ถ้าโมเดลล่ม"""
+    enc = chat_turns.encode_event
+
+    def generate():
+        yield enc(fmt, {"type": "meta", "conversation_id": turn.conversation_id, "model": turn.model,
+                        "stage": "retrieving" if turn.use_knowledge else "generating"})
+        msgs, sources, rag_error = turn.build_messages()
+        if rag_error:
+            yield enc(fmt, {"type": "error", "stage": "rag", "fatal": False, "message": rag_error[:500]})
+        if turn.use_knowledge:
+            yield enc(fmt, {"type": "sources", "items": sources})
+
+        buffer: list[str] = []
+        usage: dict = {}
+        try:
+            for kind, value in stream_chat_events(turn.model, msgs):
+                if kind == "delta":
+                    buffer.append(value)
+                    yield enc(fmt, {"type": "delta", "content": value})
+                else:
+                    usage = value
+        except Exception:
+            current_app.logger.exception("Ollama stream failed")
+            yield enc(fmt, {"type": "error", "stage": "generate", "fatal": True, "message": chat_turns.STREAM_ERROR_TEXT})
+            return
+
+        if usage:
+            yield enc(fmt, {"type": "usage", **usage})
+        turn.save_reply(app, buffer)
+        yield enc(fmt, {"type": "done", "conversation_id": turn.conversation_id})
 
     return Response(
         stream_with_context(generate()),
-        mimetype="text/plain; charset=utf-8",
-        headers=headers,
+        mimetype=chat_turns.STREAM_MIMETYPES[fmt],
+        headers=chat_turns.stream_headers(turn.conversation_id),
     )
 
 
+def _encode_cursor(row_id: int) -> str:
+    raw = json.dumps([row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> int:
+    """cursor = base64url(JSON [id]) ของแถวสุดท้ายในหน้าก่อน; รูปแบบผิด → ValueError
+    (cursor รุ่นเก่า [created_at, id] ยังใช้ได้ — อ่านเฉพาะ id ตัวท้าย)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(raw)[-1])
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def _page_limit(default: int = 50, maximum: int = 200) -> int:
+    limit = request.args.get("limit", type=int) or default
+    return max(1, min(limit, maximum))
+
+
 @ai_bp.get("/conversations")
 @jwt_required()  #  ต้องล็อกอิน
 def list_conversations():
-
+    """บทสนทนาของผู้ใช้ ใหม่ → เก่า ทีละหน้า (?limit=&cursor=) — query เดียวรวม preview ข้อความล่าสุด"""
     uid = int(get_jwt_identity())
-    rows = (
-        Conversation.query
-        .filter_by(user_id=uid)             # ✅ เฉพาะของผู้ใช้นี้
-        .order_by(desc(Conversation.created_at))
-        .all()
+    limit = _page_limit()
+
+    # preview ข้อความล่าสุดเป็น correlated subquery (ใช้ index (conversation_id, created_at) ทีละแถว)
+    last_preview = (
+        select(func.substr(Message.content, 1, 120))
+        .where(Message.conversation_id == Conversation.id)
+        .order_by(desc(Message.created_at), desc(Message.id))
+        .limit(1)
+        .correlate(Conversation)
+        .scalar_subquery()
     )
-    out = []
-    for c in rows:
-        last = (
-            Message.query
-            .filter_by(conversation_id=c.id)
-            .order_by(desc(Message.created_at))
-            .first()
-        )
-        out.append({
-            "id": c.id,
-            "title": c.title,
-            "created_at": c.created_at.isoformat(),
-            "last_preview": (last.content[:120] + "…") if last else "",
-        })
-    return jsonify({"items": out})
+    q = (
+        db.session.query(Conversation.id, Conversation.title, Conversation.created_at,
+                         last_preview.label("last_preview"))
+        .filter(Conversation.user_id == uid)             # ✅ เฉพาะของผู้ใช้นี้
+    )
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            c_id = _decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "invalid cursor"}), 400
+        q = q.filter(Conversation.id < c_id)
+    # keyset ตาม id อย่างเดียว: id เพิ่มขึ้นตามลำดับการสร้างเสมอ
+    # (created_at จาก server_default เก็บเป็นวินาทีใน SQLite → เทียบกับ datetime ที่ bind มาไม่ตรงกัน หน้าไม่ขยับ)
+    rows = q.order_by(desc(Conversation.id)).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    out = [
+        {
+            "id": r.id,
+            "title": r.title,
+            "created_at": r.created_at.isoformat(),
+            "last_preview": (r.last_preview + "…") if r.last_preview is not None else "",
+        }
+        for r in rows
+    ]
+    next_cursor = _encode_cursor(rows[-1].id) if has_more else None
+    return jsonify({"items": out, "next_cursor": next_cursor})
 
 @ai_bp.get("/messages")
 @jwt_required() 
 def list_messages():
+    """ข้อความในบทสนทนาแบบ keyset ตาม id (items เรียงเก่า → ใหม่เสมอ)
+    - ไม่ระบุ: หน้าล่าสุด `limit` ข้อความ
+    - ?before=<id>: หน้าที่เก่ากว่า id นั้น (เลื่อนขึ้นไปโหลดย้อนหลัง)
+    - ?after=<id> (หรือ ?since_id=): เฉพาะข้อความที่ใหม่กว่า id นั้น (ไว้ sync โดยไม่ต้องดึงใหม่ทั้งหมด)
+    has_more = ยังมีข้อความต่อในทิศที่ดึง (เก่ากว่าสำหรับ before/ค่าเริ่มต้น, ใหม่กว่าสำหรับ after)"""
     conv_id = request.args.get("conversation_id", type=int)
     if not conv_id:
         return jsonify({"error": "conversation_id is required"}), 400
@@ -234,17 +214,34 @@ def list_messages():
     
     if not conv:
         return jsonify({"error": "conversation not found"}), 404
-    msgs = (
-        Message.query
-        .filter_by(conversation_id=conv_id)
-        .order_by(asc(Message.created_at))
-        .all()
-    )
+
+    limit = _page_limit()
+    before = request.args.get("before", type=int)
+    after = request.args.get("after", type=int)
+    if after is None:
+        after = request.args.get("since_id", type=int)
+    if before is not None and after is not None:
+        return jsonify({"error": "use either before or after, not both"}), 400
+
+    q = Message.query.filter_by(conversation_id=conv_id)
+    if after is not None:
+        msgs = q.filter(Message.id > after).order_by(asc(Message.id)).limit(limit + 1).all()
+        has_more = len(msgs) > limit
+        msgs = msgs[:limit]
+    else:
+        if before is not None:
+            q = q.filter(Message.id < before)
+        msgs = q.order_by(desc(Message.id)).limit(limit + 1).all()
+        has_more = len(msgs) > limit
+        msgs = msgs[:limit]
+        msgs.reverse()
+
     return jsonify({
         "items": [
             {"id": m.id, "role": m.role, "content": m.content, "created_at": m.created_at.isoformat()}
             for m in msgs
-        ]
+        ],
+        "has_more": has_more,
     })
 
 @ai_bp.route("/conversations/<int:conv_id>", methods=["PUT", "PATCH"])
@@ -277,7 +274,20 @@ def delete_conversation(conv_id: int):
 
 @ai_bp.get("/models")
 def models():
-    resp = list_models()
-    if resp is False:
-        return jsonify({"error": "ไม่สามารถดึงรายการโมเดลได้"}), 500
-    return resp
+    """รายชื่อโมเดลจาก model registry (cache ในหน่วยความจำ); ?detail=1 แนบ metadata + สถานะ registry"""
+    items = model_registry.models()
+    if not items and not model_registry.status()["loaded"]:
+        return jsonify({"models": [], "error": "ไม่สามารถดึงรายการโมเดลได้"}), 500
+    # เอาชื่อมาแล้ว split ที่ ":" เอาเฉพาะซ้ายสุด
+    out = {"models": list(dict.fromkeys(m["name"].split(":")[0] for m in items))}
+    if request.args.get("detail") in ("1", "true"):
+        out["items"] = items
+        out["registry"] = model_registry.status()
+    return jsonify(out)
+
+
+@ai_bp.get("/ollama/pool")
+@jwt_required()
+def ollama_pool():
+    """สถิติ connection pool ไปยัง Ollama (ไว้ปรับ OLLAMA_POOL_SIZE)"""
+    return jsonify(pool_stats())
@@ -1,10 +1,15 @@
 from __future__ import annotations
 import os
 from flask import Blueprint, request, jsonify, current_app
+from werkzeug.datastructures import FileStorage
+from werkzeug.formparser import FormDataParser
 from werkzeug.utils import secure_filename
+from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from ..config import Config
-from ..services import rag
+from ..services import rag, ingest_jobs, embed_cache, query_cache, uploads
+from ..extensions import db
+from ..models.ingest_job import IngestJob
 from ..schemas.files import SearchRequest
 
 import logging
@@ -60,43 +65,234 @@ def to_serializable(obj):
     # object อื่น ๆ แปลงเป็น string ทิ้งท้าย (กันตาย)
     return str(obj)
 
+def _current_uid() -> int | None:
+    try:
+        identity = get_jwt_identity()
+        return int(identity) if identity is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _parse_upload_form() -> tuple[dict, FileStorage | None, list]:
+    """parse multipart ของ /upload เองจาก request.stream: ส่วนที่เป็นไฟล์เขียนลง uploads.HashedSpool ตรง ๆ
+    (ไม่ให้ Werkzeug spool ทั้ง body ลง temp ของตัวเองก่อนแล้วค่อยคัดลอกซ้ำ) → (form, file, spools ทั้งหมด)"""
+    spools: list = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        spool = uploads.HashedSpool()
+        spools.append(spool)
+        return spool
+
+    parser = FormDataParser(
+        stream_factory=stream_factory,
+        max_form_memory_size=request.max_form_memory_size,
+        max_content_length=request.max_content_length,
+        max_form_parts=request.max_form_parts,
+    )
+    try:
+        _, form, files = parser.parse(request.stream, request.mimetype, request.content_length,
+                                      request.mimetype_params)
+    except BaseException:
+        for spool in spools:
+            spool.discard()
+        raise
+    return form, files.get("file"), spools
+
+
 @bp.post("/upload")
+@jwt_required(optional=True)
 def upload():
-    if "file" not in request.files:
-        return jsonify({"error": "no file"}), 400
-    f = request.files["file"]
-    if f.filename == "":
-        return jsonify({"error": "empty filename"}), 400
-    if not allowed(f.filename):
-        return jsonify({"error": f"extension not allowed: {f.filename}"}), 400
+    """multipart field "file" (+ "collection") → เข้าคิว ingest; body ถูกเขียนลงดิสก์ครั้งเดียวพร้อม hash
+    ไฟล์ใหญ่/เน็ตไม่นิ่งควรใช้ /uploads (ส่งต่อจาก offset เดิมได้)"""
+    form, f, spools = _parse_upload_form()
+    try:
+        if f is None:
+            return jsonify({"error": "no file"}), 400
+        if f.filename == "":
+            return jsonify({"error": "empty filename"}), 400
+        if not allowed(f.filename):
+            return jsonify({"error": f"extension not allowed: {f.filename}"}), 400
 
-    os.makedirs(Config.UPLOAD_DIR, exist_ok=True)
-    stored_name = secure_filename(f.filename)
-    save_path = os.path.join(Config.UPLOAD_DIR, stored_name)
-    f.save(save_path)
+        # คลังปลายทาง: ระบุ field "collection" เองได้ ไม่งั้นใช้คลังของผู้ใช้ (ถ้าเปิด per-user) / kb_default
+        try:
+            collection = rag.resolve_collections(form.get("collection"), _current_uid())[0]
+        except rag.CollectionAccessError as e:
+            return jsonify({"error": str(e)}), 403
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # เนื้อหาซ้ำกับที่มีอยู่แล้วไม่ต้อง ingest ใหม่
+        spool = f.stream
+        spool.close()
+        sha = spool.hexdigest()
+        dup = ingest_jobs.find_by_hash(sha, collection)
+        if dup:
+            return jsonify(_duplicate_payload(dup)), 409
+        os.makedirs(Config.UPLOAD_DIR, exist_ok=True)
+        stored_name = secure_filename(f.filename)
+        save_path = os.path.join(Config.UPLOAD_DIR, stored_name)
+        os.replace(spool.path, save_path)
+    finally:
+        for spool in spools:
+            spool.discard()  # ที่ย้ายไปแล้วไม่มีไฟล์ให้ลบ
+    return _enqueue_ingest(save_path, f.filename, stored_name, collection, sha, _current_uid())
+
+
+def _duplicate_payload(job: IngestJob) -> dict:
+    return {"error": "file already uploaded", "code": "DUPLICATE", "job": job.to_dict()}
 
+
+def _enqueue_ingest(save_path: str, filename: str, stored_name: str, collection: str, sha: str | None,
+                    uid: int | None):
     try:
-        #  ขอให้ ingest_file คืน summary ที่เป็น primitive เท่านั้น
-        result = rag.ingest_file(save_path, metadata={
-            "filename": f.filename,
-            "stored_name": stored_name,
-        })
-        # กันเคสที่ result มี embedding/ndarray/float32
-        safe = to_serializable(result)
-
-        # หรือจะ return แบบสั้น ๆ เองก็ได้ (แนะนำที่สุด):
-        # safe = {
-        #   "ok": True,
-        #   "filename": f.filename,
-        #   "stored_name": stored_name,
-        #   "ingested": True
-        # }
-
-        return jsonify(safe), 200
+        # ไม่ ingest ใน request แล้ว — ส่งเข้าคิวเบื้องหลัง แล้วให้ FE poll /jobs/<id>
+        job = ingest_jobs.enqueue(
+            save_path,
+            filename=filename,
+            stored_name=stored_name,
+            metadata={
+                "filename": filename,
+                "stored_name": stored_name,
+            },
+            collection=collection,
+            sha256=sha,
+            uid=uid,
+        )
+        return jsonify({"job": job.to_dict()}), 202
 
     except Exception as e:
-        logger.exception("Ingest failed for %s", stored_name)
-        return jsonify({"error": f"ingest failed: {e}", "filename": f.filename}), 500
+        logger.exception("Enqueue ingest failed for %s", stored_name)
+        return jsonify({"error": f"ingest failed: {e}", "filename": filename}), 500
+
+
+# ---------- อัปโหลดแบบ stream + ต่อได้ ----------
+# 1) POST /uploads {"filename", "size", "sha256"?, "collection"?} → {"upload": {id, offset, chunk_size}}
+#    (ส่ง sha256 มาด้วย → ไฟล์ที่มีอยู่แล้วถูกปฏิเสธทันทีก่อนส่งสักไบต์)
+# 2) PUT /uploads/<id>  header Upload-Offset: <offset>, body = ไบต์ดิบของก้อนถัดไป (ไม่ใช่ multipart)
+#    → {"upload": {...}}; ก้อนสุดท้าย → 202 {"upload", "job"} (เข้าคิว ingest เหมือน /upload)
+# 3) หลุด: GET /uploads/<id> ดู offset แล้ว PUT ต่อ; เลิก: DELETE /uploads/<id>
+
+@bp.post("/uploads")
+@jwt_required(optional=True)
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    filename = (data.get("filename") or "").strip()
+    if not filename or not secure_filename(filename):
+        return jsonify({"error": "filename is required"}), 400
+    if not allowed(filename):
+        return jsonify({"error": f"extension not allowed: {filename}"}), 400
+    try:
+        size = int(data.get("size") or 0)
+        collection = rag.resolve_collections(data.get("collection"), _current_uid())[0]
+    except rag.CollectionAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    sha = (data.get("sha256") or "").strip().lower() or None
+    if sha:
+        dup = ingest_jobs.find_by_hash(sha, collection)
+        if dup:
+            return jsonify(_duplicate_payload(dup)), 409
+    try:
+        meta = uploads.create(filename, size, collection, sha256=sha, uid=_current_uid())
+    except uploads.UploadError as e:
+        return jsonify(e.payload()), e.status
+    return jsonify({"upload": uploads.status(meta)}), 201
+
+
+@bp.get("/uploads/<upload_id>")
+@jwt_required(optional=True)
+def get_upload(upload_id: str):
+    try:
+        meta = uploads.load(upload_id, _current_uid())
+        return jsonify({"upload": uploads.status(meta)})
+    except uploads.UploadError as e:
+        return jsonify(e.payload()), e.status
+
+
+@bp.put("/uploads/<upload_id>")
+@jwt_required(optional=True)
+def put_upload_chunk(upload_id: str):
+    try:
+        meta = uploads.load(upload_id, _current_uid())
+        at = request.headers.get("Upload-Offset", request.args.get("offset"))
+        if at is None:
+            return jsonify({"error": "Upload-Offset header is required"}), 400
+        # อ่านจาก request.stream ตรง ๆ (Werkzeug ไม่ buffer body ก่อนเข้ามาที่นี่)
+        uploads.append(meta, request.stream, int(at), request.content_length)
+        state = uploads.status(meta)
+        if not state["complete"]:
+            return jsonify({"upload": state})
+
+        sha = uploads.digest(meta)
+        dup = ingest_jobs.find_by_hash(sha, meta["collection"])
+        if dup:
+            uploads.abort(meta)
+            return jsonify(_duplicate_payload(dup)), 409
+        os.makedirs(Config.UPLOAD_DIR, exist_ok=True)
+        save_path = os.path.join(Config.UPLOAD_DIR, meta["stored_name"])
+        sha = uploads.finalize(meta, save_path)
+    except uploads.UploadError as e:
+        return jsonify(e.payload()), e.status
+    except ValueError:
+        return jsonify({"error": "invalid offset"}), 400
+
+    resp, status = _enqueue_ingest(save_path, meta["filename"], meta["stored_name"], meta["collection"], sha,
+                                   meta.get("uid"))
+    body = resp.get_json()
+    body["upload"] = {**state, "sha256": sha}
+    return jsonify(body), status
+
+
+@bp.delete("/uploads/<upload_id>")
+@jwt_required(optional=True)
+def abort_upload(upload_id: str):
+    try:
+        uploads.abort(uploads.load(upload_id, _current_uid()))
+    except uploads.UploadError as e:
+        return jsonify(e.payload()), e.status
+    return jsonify({"success": True})
+
+
+def _own_job(job_id: int) -> IngestJob | None:
+    """งานของผู้เรียกเท่านั้น (งานของผู้ใช้อื่น = ไม่พบ เหมือน uploads.load)"""
+    job = db.session.get(IngestJob, job_id)
+    return job if job is not None and job.uid == _current_uid() else None
+
+
+@bp.get("/jobs")
+@jwt_required(optional=True)
+def list_jobs():
+    """GET /api/files/jobs?status=running&limit=50 — เฉพาะงานของผู้เรียก"""
+    uid = _current_uid()
+    q = IngestJob.query.filter(IngestJob.uid.is_(None) if uid is None else IngestJob.uid == uid)
+    status = request.args.get("status")
+    if status:
+        q = q.filter_by(status=status)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 500)
+    rows = q.order_by(IngestJob.id.desc()).limit(limit).all()
+    return jsonify({"items": [j.to_dict() for j in rows]})
+
+
+@bp.get("/jobs/<int:job_id>")
+@jwt_required(optional=True)
+def get_job(job_id: int):
+    job = _own_job(job_id)
+    if not job:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify({"job": job.to_dict()})
+
+
+@bp.post("/jobs/<int:job_id>/cancel")
+@jwt_required(optional=True)
+def cancel_job(job_id: int):
+    job = _own_job(job_id)
+    if not job:
+        return jsonify({"error": "job not found"}), 404
+    if job.status not in ("queued", "running"):
+        return jsonify({"error": f"job is {job.status}", "job": job.to_dict()}), 409
+    job = ingest_jobs.cancel(job)
+    return jsonify({"job": job.to_dict()}), 202
 
 @bp.get("/list")
 def list_files():
@@ -105,14 +301,37 @@ def list_files():
     return jsonify({"files": files})
 
 
+@bp.get("/stats")
+def stats():
+    """สถิติ cache ของฝั่ง RAG (hit/miss) ไว้ดูว่าคุ้มแค่ไหน"""
+    return jsonify({
+        "embed_cache": embed_cache.stats(),
+        "query_cache": query_cache.stats(),
+    })
+
+
 @bp.post("/search")
+@jwt_required(optional=True)
 def search():
     data = request.get_json(force=True)
     req = SearchRequest(**data)
-    hits = rag.search(req.query, k=req.k)
+    try:
+        collections = rag.resolve_collections(req.collections, _current_uid())
+    except rag.CollectionAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    hits = rag.search(req.query, k=req.k, collections=collections)
     return jsonify({"hits": hits})
 
+def _own_collections(uid: int | None) -> list[str]:
+    """collection ที่มีอยู่จริงและผู้เรียกมีสิทธิ์ (ของตัวเอง + kb_default + shared) — ขอบเขตการลบเมื่อไม่ระบุ"""
+    allowed = rag.allowed_collections(uid)
+    return [n for n in rag.list_collection_names() if n in allowed]
+
+
 @bp.delete("/delete")
+@jwt_required(optional=True)
 def delete_file():
     """
     DELETE /api/files?name=<filename>
@@ -136,28 +355,14 @@ def delete_file():
         logger.exception("Failed to remove file: %s", file_path)
         return jsonify({"error": f"cannot remove file: {e}"}), 500
 
-    # พยายามลบจากดัชนี RAG โดยอาศัย metadata
-    # รองรับทั้งคีย์ 'stored_name' และ 'filename' (กรณี front ส่งชื่อเดิมมา)
-    removed_from_index = False
+    # ลบชิ้นของไฟล์นี้ออกจากคลัง (source = stored_name; ใช้ source map ลบด้วย id ตรง ๆ)
+    removed = 0
     try:
-        # ถ้า service rag มีเมธอดลบตาม metadata (เช่น delete_by_metadata / delete / remove)
-        if hasattr(rag, "delete_by_metadata"):
-            # ลองด้วย stored_name ก่อน
-            cnt1 = rag.delete_by_metadata({"stored_name": safe_name})
-            # เผื่อบาง ingestion เก็บแต่ 'filename' (ชื่อเดิม)
-            cnt2 = rag.delete_by_metadata({"filename": name})
-            removed_from_index = bool((cnt1 or 0) + (cnt2 or 0))
-        elif hasattr(rag, "delete"):  # ฟอลแบ็กชื่อเมธอดอื่น
-            cnt1 = rag.delete({"stored_name": safe_name})
-            cnt2 = rag.delete({"filename": name})
-            removed_from_index = bool((cnt1 or 0) + (cnt2 or 0))
-        elif hasattr(rag, "remove"):
-            cnt1 = rag.remove({"stored_name": safe_name})
-            cnt2 = rag.remove({"filename": name})
-            removed_from_index = bool((cnt1 or 0) + (cnt2 or 0))
-        else:
-            # ถ้าไม่มีเมธอดลบ ก็ข้ามได้ (ไม่ถือเป็น error เพราะไฟล์ถูกลบไปแล้ว)
-            logger.info("RAG delete method not available; skipped index removal")
+        collections = _own_collections(_current_uid())  # ไม่แตะคลังของผู้ใช้อื่น
+        removed = rag.delete_by_metadata({"source": safe_name}, collections)
+        if not removed and name != safe_name:
+            # เผื่อ front ส่งชื่อเดิมมา (ก่อนผ่าน secure_filename)
+            removed = rag.delete_by_metadata({"filename": name}, collections)
     except Exception as e:
         # ไม่ทำให้การลบไฟล์ล้มเหลว แต่แจ้งเตือน
         logger.warning("Failed to remove from RAG index: %s", e)
@@ -165,5 +370,59 @@ def delete_file():
     return jsonify({
         "success": True,
         "deleted": name,
-        "removed_from_index": removed_from_index
+        "removed_from_index": bool(removed),
+        "removed_vectors": removed,
+    }), 200
+
+
+@bp.post("/delete-bulk")
+@jwt_required()
+def delete_files_bulk():
+    """
+    POST /api/files/delete-bulk  {"names": ["a.pdf", "b.txt"], "collections": [...] (ไม่ระบุ = ทุกคลังที่ผู้เรียกมีสิทธิ์)}
+    - ลบไฟล์ที่มีอยู่ + ลบชิ้นของทุกชื่อออกจากคลัง (แม้ไฟล์บนดิสก์จะหายไปแล้ว)
+    - ระบุคลังของผู้ใช้อื่น → 403
+    """
+    data = request.get_json(silent=True) or {}
+    names = data.get("names") or []
+    if not isinstance(names, list) or not names:
+        return jsonify({"error": "names is required"}), 400
+    uid = _current_uid()
+    try:
+        if data.get("collections"):
+            collections = rag.resolve_collections(data["collections"], uid)
+        else:
+            collections = _own_collections(uid)
+    except rag.CollectionAccessError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    safe_names = [n for n in dict.fromkeys(secure_filename(str(n)) for n in names) if n]
+    deleted, missing = [], []
+    for safe_name in safe_names:
+        file_path = os.path.join(Config.UPLOAD_DIR, safe_name)
+        if not os.path.isfile(file_path):
+            missing.append(safe_name)
+            continue
+        try:
+            os.remove(file_path)
+            deleted.append(safe_name)
+        except Exception as e:
+            logger.warning("Failed to remove file %s: %s", file_path, e)
+            missing.append(safe_name)
+
+    try:
+        result = rag.delete_sources(safe_names, collections)
+    except Exception as e:
+        logger.exception("Bulk delete from RAG index failed")
+        return jsonify({"error": f"index delete failed: {e}", "deleted": deleted, "missing": missing}), 500
+
+    return jsonify({
+        "success": True,
+        "deleted": deleted,
+        "missing": missing,
+        "removed_vectors": result["removed"],
+        "files": result["files"],
+        "collections": result["collections"],
     }), 200
\ No newline at end of file
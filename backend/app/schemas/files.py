@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class UploadResult(BaseModel):
     file: str
@@ -8,6 +8,7 @@ class UploadResult(BaseModel):
 class SearchRequest(BaseModel):
     query: str
     k: int = Field(default=5, ge=1, le=20)
+    collections: Optional[List[str]] = None
 
 class SearchHit(BaseModel):
     id: str
@@ -0,0 +1,142 @@
+from __future__ import annotations
+import logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from sqlalchemy import desc, update
+
+from ..config import Config
+from ..extensions import db
+from ..models.conversation import Conversation, Message
+from .ollama_client import chat as ollama_chat
+
+logger = logging.getLogger(__name__)
+
+# ---------- History สำหรับ prompt: N ข้อความล่าสุด + สรุปแบบ rolling ของส่วนที่เก่ากว่า ----------
+# ขนาด prompt ต่อรอบคงที่ไม่ว่าบทสนทนาจะยาวแค่ไหน: ข้อความที่หลุดหน้าต่างจะถูกพับรวมเข้า
+# Conversation.summary ทีละก้อน (เบื้องหลัง หลังตอบเสร็จ) แทนการส่งไปทั้งหมด
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_pending: set[int] = set()  # conversation ที่กำลังสรุปอยู่ (กันสั่งซ้ำ)
+
+
+def recent_messages(conversation_id: int, n: int | None = None) -> List[Message]:
+    """N ข้อความล่าสุด เรียงเก่า → ใหม่ (ใช้ index (conversation_id, created_at))"""
+    n = n or int(getattr(Config, "CHAT_HISTORY_TURNS", 20))
+    rows = (
+        Message.query
+        .filter_by(conversation_id=conversation_id)
+        .order_by(desc(Message.created_at), desc(Message.id))
+        .limit(n)
+        .all()
+    )
+    rows.reverse()
+    return rows
+
+
+def _unsummarized(conv: Conversation, window: List[Message], n: int) -> List[Message]:
+    """ข้อความที่หลุดหน้าต่างแล้วแต่ยังไม่ถูกพับเข้า summary (ยังไม่ครบ CHAT_SUMMARY_BATCH หรือกำลังสรุปอยู่)
+    ไม่ส่งไปด้วย = โมเดลไม่เห็นข้อความช่วงนี้เลย; จำกัดไว้ n ข้อความล่าสุด (งบ token ตัดต่อใน fit_history)"""
+    if not window:
+        return []
+    rows = (
+        Message.query
+        .filter(Message.conversation_id == conv.id, Message.id > (conv.summary_upto_id or 0),
+                Message.id < window[0].id)
+        .order_by(desc(Message.id))
+        .limit(n)
+        .all()
+    )
+    rows.reverse()
+    return rows
+
+
+def load_history(conv: Conversation, n: int | None = None) -> List[Dict[str, str]]:
+    """history สำหรับส่งให้โมเดล: [summary (ถ้ามี)] + ข้อความเก่าที่ยังไม่ถูกสรุป + N ข้อความล่าสุด"""
+    n = n or int(getattr(Config, "CHAT_HISTORY_TURNS", 20))
+    rows = recent_messages(conv.id, n)
+    if _summary_enabled():
+        rows = _unsummarized(conv, rows, n) + rows
+    msgs = [{"role": m.role, "content": m.content} for m in rows]
+    if conv.summary and _summary_enabled():
+        msgs.insert(0, {"role": "system", "content": f"สรุปบทสนทนาก่อนหน้า:\n{conv.summary}"})
+    return msgs
+
+
+def _summary_enabled() -> bool:
+    return bool(getattr(Config, "CHAT_SUMMARY_ENABLED", False))
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+    return _pool
+
+
+def maybe_summarize(app, conversation_id: int, model: str) -> bool:
+    """ส่งไปตรวจเบื้องหลัง: ถ้าข้อความที่หลุดหน้าต่างและยังไม่ถูกสรุปมีครบ CHAT_SUMMARY_BATCH ก็พับเข้า summary"""
+    if not _summary_enabled():
+        return False
+    with _pool_lock:
+        if conversation_id in _pending:
+            return False
+        _pending.add(conversation_id)
+    _executor().submit(_run, app, conversation_id, model)
+    return True
+
+
+def _run(app, conversation_id: int, model: str) -> None:
+    with app.app_context():
+        try:
+            _summarize(conversation_id, model)
+        except Exception:
+            logger.exception("Summarizing conversation %s failed", conversation_id)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+            with _pool_lock:
+                _pending.discard(conversation_id)
+
+
+def _summarize(conversation_id: int, model: str) -> None:
+    conv = db.session.get(Conversation, conversation_id)
+    if conv is None:
+        return
+    window = recent_messages(conversation_id)
+    if not window:
+        return
+    upto = conv.summary_upto_id or 0
+    aged = (
+        Message.query
+        .filter(Message.conversation_id == conversation_id, Message.id > upto, Message.id < window[0].id)
+        .order_by(Message.id)
+        .all()
+    )
+    if len(aged) < int(getattr(Config, "CHAT_SUMMARY_BATCH", 6)):
+        return
+
+    per_msg = int(getattr(Config, "CHAT_SUMMARY_MSG_CHARS", 1000))
+    turns = "\n".join(f"{m.role.upper()}: {m.content[:per_msg]}" for m in aged)
+    prompt = (
+        "สรุปบทสนทนาต่อไปนี้ให้กระชับเป็นภาษาไทย เก็บข้อเท็จจริง ชื่อ ตัวเลข และสิ่งที่ผู้ใช้ต้องการไว้ "
+        "ห้ามแต่งเพิ่ม ตอบเฉพาะสรุป\n\n"
+        + (f"สรุปเดิม:\n{conv.summary}\n\n" if conv.summary else "")
+        + f"ข้อความใหม่:\n{turns}"
+    )
+    summary = ollama_chat(getattr(Config, "CHAT_SUMMARY_MODEL", "") or model, prompt).strip()
+    if not summary:
+        return
+    max_chars = int(getattr(Config, "CHAT_SUMMARY_MAX_CHARS", 2000))
+    # อัปเดตแบบมีเงื่อนไข: ถ้ามีอีก process สรุปไปก่อนแล้ว ไม่ทับ
+    db.session.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id,
+               (Conversation.summary_upto_id == conv.summary_upto_id) if conv.summary_upto_id is not None
+               else Conversation.summary_upto_id.is_(None))
+        .values(summary=summary[:max_chars], summary_upto_id=aged[-1].id)
+    )
+    db.session.commit()
@@ -0,0 +1,183 @@
+from __future__ import annotations
+import base64, json, logging, re
+from typing import Dict, List
+
+from ..extensions import db
+from ..models.conversation import Conversation, Message
+from . import rag, token_budget, chat_history, model_registry
+
+logger = logging.getLogger(__name__)
+
+# ---------- หนึ่งรอบแชท (ใช้ร่วมกันระหว่าง Flask route กับ ASGI path ใน app/asgi.py) ----------
+# ส่วนที่แตะ DB/RAG เป็น sync ทั้งหมด — ฝั่ง async เรียกผ่าน thread ภายใน app context
+
+
+class ChatError(Exception):
+    """คำขอแชทไม่ถูกต้อง → ตอบเป็น JSON {"error": ..., (code)} พร้อม status"""
+
+    def __init__(self, message: str, status: int = 400, code: str | None = None):
+        super().__init__(message)
+        self.message, self.status, self.code = message, status, code
+
+    def payload(self) -> dict:
+        return {"error": self.message, **({"code": self.code} if self.code else {})}
+
+
+def _plain_messages(history_msgs: List[Dict[str, str]], user_message: str, model: str) -> List[Dict[str, str]]:
+    """โหมดไม่ใช้คลังความรู้: ตัด history เก่าทิ้งจนพอดีงบ token ของโมเดล"""
+    user_msg = {"role": "user", "content": user_message}
+    budget = token_budget.prompt_budget(model) - token_budget.message_tokens(user_msg)
+    hist, _ = token_budget.fit_history(history_msgs, budget)
+    return hist + [user_msg]
+
+
+class ChatTurn:
+    def __init__(self, data: dict, uid: int, conv: Conversation, history: List[Dict[str, str]],
+                 collections: List[str] | None = None):
+        self.data = data
+        self.uid = uid
+        self.conversation_id = conv.id
+        self.model = data.get("model", "llama3.1")
+        self.user_message = (data.get("message") or "").strip()
+        self.use_knowledge = bool(data.get("use_knowledge", False))
+        self.topk = int(data.get("topk", 5))
+        self.history = history
+        self.collections = collections
+
+    def build_messages(self) -> tuple[List[Dict[str, str]], List[str], str | None]:
+        """คืน (messages, sources, rag_error) — RAG ล่มจะ fallback เป็นโหมดปกติแล้วแจ้ง error กลับไป"""
+        if not self.use_knowledge:
+            return _plain_messages(self.history, self.user_message, self.model), [], None
+        try:
+            # history อยู่ระหว่าง system กับ augmented user และนับรวมในงบ token เดียวกับบริบท
+            msgs, sources = rag.build_augmented_messages(self.user_message, topk=self.topk, collections=self.collections,
+                                                         history=self.history, model=self.model)
+            return msgs, sources, None
+        except Exception as e:
+            logger.exception("RAG build/search failed")
+            # fallback → โหมดปกติ
+            return _plain_messages(self.history, self.user_message, self.model), [], str(e)
+
+    def save_reply(self, app, buffer: List[str]) -> None:
+        # เซฟ assistant หลังสตรีมจบ
+        text = "".join(buffer).strip()
+        if text:
+            db.session.add(Message(conversation_id=self.conversation_id, role="assistant", content=text))
+            db.session.commit()
+            chat_history.maybe_summarize(app, self.conversation_id, self.model)
+
+
+def start_turn(data: dict, identity) -> ChatTurn:
+    """ตรวจคำขอ, หา/สร้างบทสนทนา, โหลด history แล้วบันทึกข้อความผู้ใช้ (ก่อนเรียกโมเดล)"""
+    model = data.get("model", "llama3.1")
+    user_message = (data.get("message") or "").strip()
+    conversation_id = data.get("conversation_id")
+
+    # เช็คว่ามีโมเดลจริงหรือไม่
+    if not model_registry.is_available(model):
+        raise ChatError(
+            f"ไม่พบโมเดล '{model}' บน Ollama — โปรดเลือกโมเดลที่ใช้งานได้ (ดูรายการที่ /api/ai/models)",
+            400,
+            code="MODEL_NOT_FOUND",
+        )
+
+    if not user_message:
+        raise ChatError("message is required", 400)
+
+    # --- auth (คงพฤติกรรมเดิม) ---
+    try:
+        uid = int(identity)
+    except (TypeError, ValueError):
+        logger.error("Invalid JWT identity: %r", identity)
+        raise ChatError("invalid identity", 401)
+
+    # --- คลังที่จะค้น: ตรวจสิทธิ์ก่อนเริ่ม (ห้ามค้นคลังของผู้ใช้อื่น) ---
+    collections = None
+    if data.get("use_knowledge"):
+        try:
+            collections = rag.resolve_collections(data.get("collections") or data.get("collection"), uid)
+        except rag.CollectionAccessError as e:
+            raise ChatError(str(e), 403, code="COLLECTION_FORBIDDEN")
+        except ValueError as e:
+            raise ChatError(str(e), 400)
+
+    # --- หา/สร้างบทสนทนาของผู้ใช้นี้ ---
+    conv = None
+    if conversation_id:
+        conv = Conversation.query.filter_by(id=conversation_id, user_id=uid).first()
+        if not conv:
+            raise ChatError("conversation not found", 404)
+
+    if not conv:
+        conv = Conversation(
+            user_id=uid,
+            title=(user_message[:80] + "…") if len(user_message) > 80 else user_message
+        )
+        db.session.add(conv)
+        db.session.commit()
+
+    # --- ประวัติ N ข้อความล่าสุด (+ สรุปของส่วนที่เก่ากว่า ถ้าเปิด CHAT_SUMMARY_ENABLED) ---
+    history = chat_history.load_history(conv)
+
+    # --- บันทึก user message ลง DB ก่อนเรียกโมเดล ---
+    db.session.add(Message(conversation_id=conv.id, role="user", content=user_message))
+    db.session.commit()
+    return ChatTurn(data, uid, conv, history, collections)
+
+
+# ---------- รูปแบบ stream ----------
+
+STREAM_MIMETYPES = {
+    "text": "text/plain; charset=utf-8",
+    "sse": "text/event-stream; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+STREAM_ERROR_TEXT = "เกิดข้อขัดข้องระหว่างเชื่อมต่อโมเดล — โปรดลองอีกครั้ง"
+
+
+def stream_format(data: dict, query_format: str | None, accept: str | None) -> str:
+    """เลือกรูปแบบ stream: body.stream_format / ?format= / Accept header; ค่าเริ่มต้น text (แบบเดิม)"""
+    fmt = (data.get("stream_format") or query_format or "").strip().lower()
+    if fmt in STREAM_MIMETYPES:
+        return fmt
+    accept = accept or ""
+    if "text/event-stream" in accept:
+        return "sse"
+    if "application/x-ndjson" in accept:
+        return "ndjson"
+    return "text"
+
+
+def encode_event(fmt: str, event: dict) -> str:
+    payload = json.dumps(event, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+_ASCII_SAFE = re.compile(r"[^ -~]")  # printable ASCII 0x20-0x7E
+
+
+def sources_headers(sources: List[str]) -> tuple[str, str]:
+    # header ASCII fallback เช่น "p.35 • file.pdf | p.249 • file.pdf"
+    ascii_join = " | ".join(_ASCII_SAFE.sub("?", s) for s in sources or [])  # แทนตัว non-ascii ด้วย ?
+    # header B64: เก็บ JSON UTF‑8 เต็ม ๆ
+    b64_json = base64.b64encode(json.dumps(sources, ensure_ascii=False).encode("utf-8")).decode("ascii")
+    return ascii_join, b64_json
+
+
+def stream_headers(conversation_id: int, sources: List[str] | None = None, rag_error: str | None = None) -> Dict[str, str]:
+    headers = {
+        "Cache-Control": "no-cache, no-transform",
+        "X-Accel-Buffering": "no",
+        "X-Conversation-Id": str(conversation_id),
+        "Access-Control-Expose-Headers": "X-Conversation-Id, X-Knowledge-Sources, X-Knowledge-Sources-B64, X-RAG-Error",
+    }
+    if sources:
+        ascii_join, b64_json = sources_headers(sources)
+        headers["X-Knowledge-Sources"] = ascii_join                    # ASCII-only (fallback)
+        headers["X-Knowledge-Sources-B64"] = b64_json                  # UTF-8 JSON (แนะนำให้ FE ใช้)
+    if rag_error:
+        headers["X-RAG-Error"] = (rag_error[:200]).replace("\n", " ")
+    return headers
@@ -0,0 +1,222 @@
+from __future__ import annotations
+import os, hashlib, sqlite3, threading, time, unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Sequence
+
+from ..config import Config
+
+# ---------- Embedding cache: LRU ในหน่วยความจำ + SQLite บนดิสก์ ----------
+# key = sha1(model + ข้อความที่ normalize แล้ว), value = เวกเตอร์ float32
+
+
+def normalize_for_key(text: str) -> str:
+    s = unicodedata.normalize("NFC", text or "")
+    return " ".join(s.split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha1(f"{model}\x1f{normalize_for_key(text)}".encode("utf-8", "ignore")).hexdigest()
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_items: int, mem_items: int):
+        self.path = path
+        self.max_items = max(0, max_items)
+        self.mem_items = max(0, mem_items)
+        self._mem: OrderedDict[str, List[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._writes_since_trim = 0
+        self.mem_hits = self.disk_hits = self.misses = self.writes = self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+                " vec BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings(last_used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connection ต่อ thread (และสร้างใหม่หลัง fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._pid = os.getpid()
+        return conn
+
+    # ---- memory LRU ----
+
+    def _mem_get(self, key: str) -> List[float] | None:
+        with self._lock:
+            v = self._mem.get(key)
+            if v is not None:
+                self._mem.move_to_end(key)
+            return v
+
+    def _mem_put(self, key: str, vec: List[float]) -> None:
+        if not self.mem_items:
+            return
+        with self._lock:
+            self._mem[key] = vec
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_items:
+                self._mem.popitem(last=False)
+
+    # ---- public ----
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[List[float] | None]:
+        keys = [cache_key(model, t) for t in texts]
+        out: List[List[float] | None] = [None] * len(keys)
+        need: dict[str, List[int]] = {}
+        mem_hits = disk_hits = misses = 0
+        for i, k in enumerate(keys):
+            v = self._mem_get(k)
+            if v is not None:
+                out[i] = v
+                mem_hits += 1
+            else:
+                need.setdefault(k, []).append(i)
+
+        if need:
+            conn = self._conn()
+            found: dict[str, List[float]] = {}
+            key_list = list(need)
+            for j in range(0, len(key_list), 500):  # จำกัดจำนวน parameter ต่อ query ของ sqlite
+                part = key_list[j:j+500]
+                rows = conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for k, blob in rows:
+                    found[k] = _unpack(blob)
+            if found:
+                now = time.time()
+                with conn:
+                    conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, k) for k in found])
+            for k, idxs in need.items():
+                v = found.get(k)
+                if v is None:
+                    misses += len(idxs)
+                    continue
+                disk_hits += len(idxs)
+                self._mem_put(k, v)
+                for i in idxs:
+                    out[i] = v
+        # ตัวนับใช้ร่วมกันหลาย thread → รวมทีเดียวใต้ lock
+        with self._lock:
+            self.mem_hits += mem_hits
+            self.disk_hits += disk_hits
+            self.misses += misses
+        return out
+
+    def put_many(self, model: str, texts: Sequence[str], vecs: Sequence[List[float] | None]) -> None:
+        now = time.time()
+        rows = []
+        for t, v in zip(texts, vecs):
+            if not v:
+                continue
+            k = cache_key(model, t)
+            self._mem_put(k, list(v))
+            rows.append((k, model, len(v), _pack(v), now))
+        if not rows:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO embeddings(key, model, dim, vec, last_used) VALUES (?,?,?,?,?)", rows)
+        # เช็คขนาดเป็นระยะ ไม่ต้องนับทุกครั้งที่เขียน
+        with self._lock:
+            self.writes += len(rows)
+            self._writes_since_trim += len(rows)
+            due = bool(self.max_items) and self._writes_since_trim >= max(100, self.max_items // 100)
+            if due:
+                self._writes_since_trim = 0
+        if due:
+            self.trim()
+
+    def trim(self) -> int:
+        """ลบแถวที่ใช้ล่าสุดนานที่สุดจนเหลือ ~90% ของ max_items"""
+        if not self.max_items:
+            return 0
+        conn = self._conn()
+        (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.max_items:
+            return 0
+        drop = count - int(self.max_items * 0.9)
+        with conn:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (drop,),
+            )
+        with self._lock:
+            self.evictions += drop
+        return drop
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM embeddings")
+
+    def stats(self) -> dict:
+        with self._lock:
+            mem_hits, disk_hits, misses = self.mem_hits, self.disk_hits, self.misses
+            writes, evictions, mem_items = self.writes, self.evictions, len(self._mem)
+        lookups = mem_hits + disk_hits + misses
+        try:
+            (rows,) = self._conn().execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        except sqlite3.Error:
+            rows = None
+        return {
+            "path": self.path,
+            "mem_items": mem_items,
+            "mem_capacity": self.mem_items,
+            "disk_items": rows,
+            "disk_capacity": self.max_items,
+            "mem_hits": mem_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_ratio": round((mem_hits + disk_hits) / lookups, 4) if lookups else 0.0,
+            "writes": writes,
+            "evictions": evictions,
+        }
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> EmbeddingCache | None:
+    """คืน cache ระดับ process (None ถ้าปิดด้วย EMBED_CACHE_ENABLED=0)"""
+    global _cache
+    if not getattr(Config, "EMBED_CACHE_ENABLED", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    path=Config.EMBED_CACHE_PATH,
+                    max_items=int(Config.EMBED_CACHE_MAX_ITEMS),
+                    mem_items=int(Config.EMBED_CACHE_MEM_ITEMS),
+                )
+    return _cache
+
+
+def stats() -> dict:
+    c = get_cache()
+    return c.stats() if c else {"enabled": False}
@@ -0,0 +1,268 @@
+from __future__ import annotations
+import os, json, uuid, socket, logging, threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, update
+from sqlalchemy.orm import aliased
+
+from ..config import Config
+from ..extensions import db
+from ..models.ingest_job import IngestJob
+from . import rag
+
+logger = logging.getLogger(__name__)
+
+# ---------- Background ingest queue (thread pool ภายใน process, สถานะเก็บใน DB) ----------
+
+_app = None
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+ACTIVE = ("queued", "running", "cancelling")
+
+# เจ้าของงาน running: host + pid + token ต่อ process (pid เดิมใน container ที่ restart ไม่ถูกนับว่ายังอยู่)
+_HOST = socket.gethostname()
+_TOKEN = uuid.uuid4().hex[:8]
+
+
+def _owner() -> str:
+    return f"{_HOST}:{os.getpid()}:{_TOKEN}"
+
+
+def _owner_gone(owner: str | None) -> bool:
+    """process เจ้าของงานตายแล้วแน่ ๆ (เช็คได้เฉพาะเครื่องเดียวกัน; เครื่องอื่นดูจาก heartbeat ที่หยุดไปแทน)"""
+    try:
+        host, pid, token = (owner or "").rsplit(":", 2)
+        pid = int(pid)
+    except ValueError:
+        return False
+    if host != _HOST:
+        return False
+    if pid == os.getpid():
+        return token != _TOKEN
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def init_app(app) -> None:
+    """ผูกกับ Flask app แล้วหยิบงานที่ค้างจากรอบก่อน (restart/crash) กลับมาทำต่อ"""
+    global _app
+    _app = app
+    with app.app_context():
+        try:
+            resume_pending()
+        except Exception as e:
+            # เช่นตอนรัน `flask db upgrade` ครั้งแรกที่ยังไม่มีตาราง
+            logger.warning("Ingest job resume skipped: %s", e)
+            db.session.rollback()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = max(1, int(getattr(Config, "INGEST_WORKERS", 1)))
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-job")
+    return _pool
+
+
+def enqueue(path: str, filename: str, stored_name: str, metadata: dict | None = None,
+            collection: str = rag.DEFAULT_COLLECTION, sha256: str | None = None,
+            uid: int | None = None) -> IngestJob:
+    job = IngestJob(
+        filename=filename,
+        stored_name=stored_name,
+        path=path,
+        sha256=sha256,
+        uid=uid,
+        collection=rag.validate_collection(collection),
+        metadata_json=json.dumps(metadata or {}, ensure_ascii=False),
+        status="queued",
+    )
+    db.session.add(job)
+    db.session.commit()
+    _executor().submit(_run, job.id)
+    return job
+
+
+def find_by_hash(sha256: str, collection: str) -> IngestJob | None:
+    """งานของไฟล์เนื้อหาเดียวกันในคลังนี้ที่ยังใช้อยู่ (ค้างคิว/กำลังทำ/เสร็จแล้วและไฟล์ยังไม่ถูกลบ)
+    งาน done ที่มีงานใหม่กว่าบน path เดียวกัน (อัปโหลดชื่อเดิมทับ) ไม่นับ: เนื้อหาในคลังเป็นของงานใหม่แล้ว"""
+    newer = aliased(IngestJob)
+    superseded = exists().where(newer.path == IngestJob.path, newer.collection == IngestJob.collection,
+                                newer.id > IngestJob.id, newer.status.in_(ACTIVE + ("done",)))
+    rows = (IngestJob.query
+            .filter(IngestJob.sha256 == sha256, IngestJob.collection == collection,
+                    IngestJob.status.in_(ACTIVE + ("done",)),
+                    (IngestJob.status != "done") | ~superseded)
+            .order_by(IngestJob.id.desc())
+            .all())
+    for job in rows:
+        if job.status != "done" or os.path.exists(job.path):
+            return job
+    return None
+
+
+def cancel(job: IngestJob) -> IngestJob:
+    """queued → cancelled ทันที; running → cancelling (worker จะเห็นตอน heartbeat/รายงาน progress ครั้งถัดไป)"""
+    if job.status == "queued":
+        job.status = "cancelled"
+        job.finished_at = datetime.utcnow()
+    elif job.status == "running":
+        job.status = "cancelling"
+    db.session.commit()
+    return job
+
+
+def resume_pending() -> int:
+    """คืนงาน running ที่เจ้าของไม่อยู่แล้วให้เป็น queued แล้วส่งเข้าคิวใหม่
+    เจ้าของไม่อยู่ = process บนเครื่องเดียวกันที่ตายไปแล้ว หรือ heartbeat เงียบนานเกิน INGEST_STALE_SEC
+    (งานที่ยังทำอยู่ใน worker อื่นเขียน heartbeat ทุก INGEST_HEARTBEAT_SEC จึงไม่ถูกหยิบซ้ำ)"""
+    stale = datetime.utcnow() - timedelta(seconds=int(getattr(Config, "INGEST_STALE_SEC", 120)))
+    orphaned = [
+        (j.id, j.status, j.owner)
+        for j in IngestJob.query.filter(IngestJob.status.in_(("running", "cancelling"))).all()
+        if (j.updated_at is not None and j.updated_at < stale) or _owner_gone(j.owner)
+    ]
+    for job_id, status, owner in orphaned:
+        # เงื่อนไข owner เดิม: ถ้ามี process อื่นหยิบ/อัปเดตไปก่อนแล้วจะไม่ทับ
+        values = ({"status": "queued", "chunks_done": 0, "started_at": None, "owner": None} if status == "running"
+                  else {"status": "cancelled", "finished_at": datetime.utcnow()})
+        same_owner = IngestJob.owner.is_(None) if owner is None else IngestJob.owner == owner
+        db.session.execute(
+            update(IngestJob)
+            .where(IngestJob.id == job_id, IngestJob.status == status, same_owner)
+            .values(**values)
+        )
+    db.session.commit()
+    ids = [j.id for j in IngestJob.query.filter_by(status="queued").order_by(IngestJob.id).all()]
+    for job_id in ids:
+        _executor().submit(_run, job_id)
+    if ids:
+        logger.info("Resumed %d ingest job(s)", len(ids))
+    return len(ids)
+
+
+def _claim(job_id: int) -> bool:
+    # อัปเดตแบบมีเงื่อนไข กันสอง process หยิบงานเดียวกัน
+    res = db.session.execute(
+        update(IngestJob)
+        .where(IngestJob.id == job_id, IngestJob.status == "queued")
+        .values(status="running", owner=_owner(), started_at=datetime.utcnow(),
+                updated_at=datetime.utcnow(), error=None)
+    )
+    db.session.commit()
+    return res.rowcount == 1
+
+
+def _finish(job_id: int, status: str, error: str | None = None, chunks_done: int | None = None,
+            expect: tuple[str, ...] = ("running",)) -> bool:
+    """ปิดงานเฉพาะเมื่อสถานะยังเป็น expect และยังเป็นเจ้าของอยู่ (ไม่ทับ cancelling/งานที่ถูกหยิบไปแล้ว)"""
+    values = {"status": status, "finished_at": datetime.utcnow(), "updated_at": datetime.utcnow()}
+    if error is not None:
+        values["error"] = error[:2000]
+    if chunks_done is not None:
+        values["chunks_done"] = chunks_done
+    res = db.session.execute(
+        update(IngestJob)
+        .where(IngestJob.id == job_id, IngestJob.status.in_(expect), IngestJob.owner == _owner())
+        .values(**values)
+    )
+    db.session.commit()
+    return res.rowcount == 1
+
+
+class _Heartbeat(threading.Thread):
+    """เขียน updated_at ของงานทุก INGEST_HEARTBEAT_SEC ตลอดการ ingest (รวมช่วงอ่าน PDF/embed ก้อนแรกที่ยังไม่มี progress)
+    และตั้ง cancelled เมื่อสถานะไม่ใช่ running แล้ว (ถูกยกเลิก หรือ process อื่นหยิบไป)"""
+
+    def __init__(self, job_id: int, cancelled: threading.Event):
+        super().__init__(name=f"ingest-heartbeat-{job_id}", daemon=True)
+        self.job_id, self.cancelled = job_id, cancelled
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        interval = max(1, int(getattr(Config, "INGEST_HEARTBEAT_SEC", 15)))
+        with _app.app_context():
+            try:
+                while not self.stopped.wait(interval):
+                    res = db.session.execute(
+                        update(IngestJob)
+                        .where(IngestJob.id == self.job_id, IngestJob.status == "running",
+                               IngestJob.owner == _owner())
+                        .values(updated_at=datetime.utcnow())
+                    )
+                    db.session.commit()
+                    if res.rowcount != 1:
+                        self.cancelled.set()
+            except Exception:
+                logger.exception("Heartbeat for ingest job %s failed", self.job_id)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.join()
+
+
+def _run(job_id: int) -> None:
+    if _app is None:
+        logger.error("ingest_jobs.init_app() was not called; job %s not run", job_id)
+        return
+    with _app.app_context():
+        try:
+            _run_in_context(job_id)
+        except Exception:
+            logger.exception("Ingest job %s crashed", job_id)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def _run_in_context(job_id: int) -> None:
+    if not _claim(job_id):
+        return  # ถูกยกเลิก/มีคนอื่นหยิบไปแล้ว
+    job = db.session.get(IngestJob, job_id)
+    path, meta, collection = job.path, job.meta, job.collection
+    cancelled = threading.Event()
+
+    def progress(done: int, total: int) -> None:
+        # เขียน progress + ตรวจการยกเลิก (status เปลี่ยนจาก running); heartbeat หลักอยู่ใน _Heartbeat
+        res = db.session.execute(
+            update(IngestJob)
+            .where(IngestJob.id == job_id, IngestJob.status == "running", IngestJob.owner == _owner())
+            .values(chunks_done=done, chunks_total=total, updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+        if res.rowcount != 1:
+            cancelled.set()
+
+    heartbeat = _Heartbeat(job_id, cancelled)
+    heartbeat.start()
+    try:
+        result = rag.ingest_file(path, metadata=meta, progress=progress,
+                                 should_cancel=cancelled.is_set, collection=collection)
+    except rag.IngestCancelled:
+        _finish(job_id, "cancelled", expect=("running", "cancelling"))
+        return
+    except Exception as e:
+        logger.exception("Ingest failed for job %s (%s)", job_id, path)
+        db.session.rollback()
+        _finish(job_id, "failed", error=str(e), expect=("running", "cancelling"))
+        return
+    finally:
+        heartbeat.stop()
+    if not _finish(job_id, "done"):
+        # ถูกสั่งยกเลิกหลังก้อนสุดท้าย → เคารพคำสั่งยกเลิก (ชิ้นที่เขียนแล้วคงอยู่เหมือนยกเลิกกลางทาง)
+        _finish(job_id, "cancelled", expect=("cancelling",))
+        logger.info("Ingest job %s finished after cancel request: %s", job_id, result)
+        return
+    logger.info("Ingest job %s done: %s", job_id, result)
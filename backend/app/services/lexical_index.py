@@ -0,0 +1,311 @@
+from __future__ import annotations
+import os, re, math, sqlite3, threading, unicodedata
+from typing import Dict, List, Sequence
+
+from ..config import Config
+
+# ---------- Lexical (BM25) index ข้าง CHROMA_DIR ----------
+# ใช้ SQLite FTS5 (มี bm25() ในตัว) เก็บ token ที่ตัดเองแล้วคั่นด้วยช่องว่าง:
+# - ภาษาไทยไม่มีช่องว่างระหว่างคำ → ใช้ character bigram ของแต่ละช่วงอักษรไทย
+# - อักษรอื่น/ตัวเลข → ทั้งคำ (ตัวพิมพ์เล็ก) และคงรหัสอย่าง "AB-1200", "5.2.1" ไว้เป็น token เดียว + แยกส่วนย่อยด้วย
+# คำค้น: ช่วงอักษรไทยเป็น phrase ของ bigram ที่ติดกัน (ต้องเจอเป็นสตริงย่อยเดียวกัน ไม่ใช่ bigram ลอย ๆ ตัวไหนก็ได้)
+# collection ที่มีข้อมูลก่อนมี index จะถูก backfill จาก Chroma เบื้องหลังครั้งแรกที่ค้น (ดู ensure_backfilled)
+
+_THAI = r"\u0E00-\u0E7F"
+_TOKEN_RE = re.compile(rf"[{_THAI}]+|[^\W_{_THAI}]+(?:[-._/][^\W_{_THAI}]+)*")
+_SEP_RE = re.compile(r"[-._/]")
+_CODE_RE = re.compile(r"^(?=.*\d)[^\W_]+(?:[-._/][^\W_]+)*$")  # มีตัวเลข เช่น รหัสสินค้า/เลขข้อ
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFC", text or "").lower()
+    out: List[str] = []
+    for m in _TOKEN_RE.finditer(text):
+        t = m.group()
+        if "\u0e00" <= t[0] <= "\u0e7f":
+            if len(t) == 1:
+                out.append(t)
+            else:
+                out.extend(t[i:i+2] for i in range(len(t) - 1))
+        else:
+            out.append(t)
+            if _SEP_RE.search(t):
+                out.extend(p for p in _SEP_RE.split(t) if p)
+    return out
+
+
+def looks_like_code(query: str) -> bool:
+    """คำค้นที่เป็นรหัส/เลขข้อล้วน ๆ (เช่น 'AB-1200', '5.2.1') → ค้นแบบ lexical อย่างเดียวก็พอ"""
+    parts = (query or "").split()
+    return 0 < len(parts) <= 3 and all(_CODE_RE.match(p) for p in parts)
+
+
+_THAI_PHRASE_CHARS = 4  # ช่วงไทยที่ยาวกว่านี้ → หลาย phrase ยาว 4 ตัวอักษร (ขยับทีละ 2)
+_AND_MAX_TERMS = 3      # คำค้นสั้น (คีย์เวิร์ด/รหัส) ต้องเจอครบทุก term; ยาวกว่านี้ OR แล้วให้ bm25 + score floor คัด
+
+
+def _phrase(tokens: Sequence[str]) -> str:
+    return '"' + " ".join(tokens).replace('"', '""') + '"'
+
+
+def _thai_terms(run: str) -> List[str]:
+    if len(run) <= _THAI_PHRASE_CHARS:
+        return [_phrase([run] if len(run) == 1 else [run[i:i+2] for i in range(len(run) - 1)])]
+    starts = list(range(0, len(run) - _THAI_PHRASE_CHARS + 1, 2))
+    if starts[-1] != len(run) - _THAI_PHRASE_CHARS:
+        starts.append(len(run) - _THAI_PHRASE_CHARS)
+    return [_thai_terms(run[i:i+_THAI_PHRASE_CHARS])[0] for i in starts]
+
+
+def _query_terms(query: str) -> List[str]:
+    text = unicodedata.normalize("NFC", query or "").lower()
+    terms: List[str] = []
+    for m in _TOKEN_RE.finditer(text):
+        t = m.group()
+        if "\u0e00" <= t[0] <= "\u0e7f":
+            terms.extend(_thai_terms(t))
+        else:
+            terms.append(_phrase([t]))
+    return list(dict.fromkeys(terms))
+
+
+def _match_expr(terms: Sequence[str]) -> str:
+    return (" AND " if len(terms) <= _AND_MAX_TERMS else " OR ").join(terms)
+
+
+_DF_CACHE_MAX = 4096  # จำนวน term ที่จำ document frequency ไว้ (ล้างทั้งก้อนเมื่อเต็ม)
+
+
+class LexicalIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        # document frequency ต่อ term ของ generation ล่าสุด (gen ขยับทุกครั้งที่ index ถูกเขียน จากทุก process)
+        self._df: Dict[str, int] = {}
+        self._df_gen: int | None = None
+        self._df_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " id INTEGER PRIMARY KEY, collection TEXT NOT NULL, chunk_id TEXT NOT NULL, source TEXT,"
+                " UNIQUE(collection, chunk_id))"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS ix_docs_source ON docs(collection, source)")
+            # ascii tokenizer: ตัวอักษร non-ASCII เป็นส่วนหนึ่งของ token เสมอ → bigram ไทยไม่ถูกแยกซ้ำ
+            c.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5("
+                " tokens, tokenize=\"ascii tokenchars '-._/'\")"
+            )
+            # collection ที่ index ครบแล้ว (ว่างตอนเริ่ม ingest หรือ backfill แล้ว)
+            c.execute("CREATE TABLE IF NOT EXISTS complete (collection TEXT PRIMARY KEY)")
+            # สถิติสำหรับ IDF: docs = จำนวนแถวใน chunks (ไม่ต้อง COUNT(*) ทุกคำค้น), gen = รุ่นของ index
+            c.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            c.execute("INSERT OR IGNORE INTO stats(key, value) SELECT 'docs', COUNT(*) FROM docs")
+            c.execute("INSERT OR IGNORE INTO stats(key, value) VALUES ('gen', 0)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _changed(conn: sqlite3.Connection, delta: int) -> None:
+        """อัปเดตจำนวนแถวและขยับ gen (อยู่ใน transaction เดียวกับการเขียน)"""
+        conn.execute("UPDATE stats SET value = value + ? WHERE key='docs'", (delta,))
+        conn.execute("UPDATE stats SET value = value + 1 WHERE key='gen'")
+
+    def add(self, collection: str, ids: Sequence[str], docs: Sequence[str], metas: Sequence[dict]) -> None:
+        conn = self._conn()
+        with conn:
+            self._delete(conn, collection, ids)
+            added = 0
+            for cid, doc, md in zip(ids, docs, metas):
+                cur = conn.execute(
+                    "INSERT INTO docs(collection, chunk_id, source) VALUES (?,?,?)",
+                    (collection, cid, (md or {}).get("source")),
+                )
+                conn.execute("INSERT INTO chunks(rowid, tokens) VALUES (?,?)", (cur.lastrowid, " ".join(tokenize(doc))))
+                added += 1
+            self._changed(conn, added)
+
+    def _delete(self, conn: sqlite3.Connection, collection: str, ids: Sequence[str]) -> int:
+        removed = 0
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            part = ids[i:i+500]
+            marks = ",".join("?" * len(part))
+            rows = [r for (r,) in conn.execute(
+                f"SELECT id FROM docs WHERE collection=? AND chunk_id IN ({marks})", (collection, *part)
+            )]
+            if not rows:
+                continue
+            rmarks = ",".join("?" * len(rows))
+            conn.execute(f"DELETE FROM chunks WHERE rowid IN ({rmarks})", rows)
+            conn.execute(f"DELETE FROM docs WHERE id IN ({rmarks})", rows)
+            removed += len(rows)
+        if removed:
+            self._changed(conn, -removed)
+        return removed
+
+    def delete(self, collection: str, ids: Sequence[str]) -> int:
+        conn = self._conn()
+        with conn:
+            return self._delete(conn, collection, ids)
+
+    def drop_collection(self, collection: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE rowid IN (SELECT id FROM docs WHERE collection=?)", (collection,))
+            removed = conn.execute("DELETE FROM docs WHERE collection=?", (collection,)).rowcount
+            conn.execute("DELETE FROM complete WHERE collection=?", (collection,))
+            if removed:
+                self._changed(conn, -removed)
+
+    def mark_complete(self, collection: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO complete(collection) VALUES (?)", (collection,))
+
+    def is_complete(self, collection: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM complete WHERE collection=?", (collection,)).fetchone() is not None
+
+    def _idf_mass(self, conn: sqlite3.Connection, terms: Sequence[str]) -> float:
+        """ผลรวม IDF ของทุก term แบบเดียวกับ bm25() ของ FTS5 (สถิติทั้งตาราง) ≈ คะแนนของชิ้นที่เจอครบทุก term ครั้งเดียว
+        จำนวนแถวอ่านจาก stats; document frequency ต่อ term จำไว้จน index ถูกเขียนครั้งถัดไป (gen เปลี่ยน)"""
+        stats = dict(conn.execute("SELECT key, value FROM stats WHERE key IN ('docs', 'gen')"))
+        total, gen = stats["docs"], stats["gen"]
+        with self._df_lock:
+            if self._df_gen != gen or len(self._df) > _DF_CACHE_MAX:
+                self._df, self._df_gen = {}, gen
+            df = {t: self._df[t] for t in terms if t in self._df}
+        missing = [t for t in terms if t not in df]
+        for t in missing:
+            (df[t],) = conn.execute("SELECT COUNT(*) FROM chunks WHERE chunks MATCH ?", (t,)).fetchone()
+        if missing:
+            with self._df_lock:
+                if self._df_gen == gen:
+                    self._df.update((t, df[t]) for t in missing)
+        mass = 0.0
+        for t in terms:
+            idf = math.log((total - df[t] + 0.5) / (df[t] + 0.5))
+            mass += idf if idf > 0 else 1e-6
+        return mass
+
+    def search(self, query: str, collections: Sequence[str], n: int) -> List[tuple[str, str, float]]:
+        """คืน [(collection, chunk_id, score)] เรียงจากตรงสุด
+        score = bm25 / ผลรวม IDF ของคำค้น ≈ สัดส่วนน้ำหนักคำค้นที่ชิ้นนั้นมี (~1 = เจอครบ, เกิน 1 ได้ถ้าเจอหลายครั้ง)
+        → เทียบข้ามคำค้นได้ ใช้เป็น score floor (RAG_LEXICAL_MIN_SCORE) ได้โดยไม่ขึ้นกับขนาดคลัง"""
+        terms = _query_terms(query)
+        if not terms or not collections:
+            return []
+        conn = self._conn()
+        marks = ",".join("?" * len(collections))
+        rows = conn.execute(
+            "SELECT d.collection, d.chunk_id, bm25(chunks) AS s FROM chunks JOIN docs d ON d.id = chunks.rowid"
+            f" WHERE chunks MATCH ? AND d.collection IN ({marks}) ORDER BY s LIMIT ?",
+            (_match_expr(terms), *collections, n),
+        ).fetchall()
+        if not rows:
+            return []
+        mass = self._idf_mass(conn, terms)
+        return [(c, cid, -float(s) / mass) for c, cid, s in rows]  # bm25() ของ FTS5 ยิ่งติดลบยิ่งตรง
+
+    def count(self, collection: str | None = None) -> int:
+        if collection is None:
+            (n,) = self._conn().execute("SELECT COUNT(*) FROM docs").fetchone()
+        else:
+            (n,) = self._conn().execute("SELECT COUNT(*) FROM docs WHERE collection=?", (collection,)).fetchone()
+        return n
+
+
+_index: LexicalIndex | None = None
+_index_error: str | None = None  # เปิด index ไม่ได้ (เช่น sqlite ไม่มี FTS5) → ปิดเฉพาะใน process นี้
+_index_lock = threading.Lock()
+
+
+def get_index() -> LexicalIndex | None:
+    """คืน index ระดับ process (None ถ้าปิด RAG_HYBRID หรือ sqlite ไม่มี FTS5)"""
+    global _index, _index_error
+    if not getattr(Config, "RAG_HYBRID", True) or _index_error:
+        return None
+    if _index is None:
+        with _index_lock:
+            if _index is None and not _index_error:
+                try:
+                    _index = LexicalIndex(Config.LEXICAL_INDEX_PATH)
+                except sqlite3.OperationalError as e:
+                    _index_error = str(e)
+                    print(f"[RAG] lexical index disabled: {e}")
+    return _index
+
+
+def rrf(rankings: Sequence[Sequence[str]], k: int = 60) -> List[str]:
+    """Reciprocal-rank fusion: รวมหลายอันดับเป็นอันดับเดียว (key ที่อยู่สูงในหลายรายการได้คะแนนมาก)"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for r, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + r + 1)
+    return sorted(scores, key=lambda key: scores[key], reverse=True)
+
+
+def rebuild(col) -> int:
+    """สร้าง lexical index ของ collection ใหม่จากเอกสารใน Chroma (ใช้กับข้อมูลที่ ingest ก่อนมี index) แล้วถือว่าครบ"""
+    idx = get_index()
+    if idx is None:
+        return 0
+    idx.drop_collection(col.name)
+    total, offset, page = 0, 0, 1000
+    while True:
+        got = col.get(include=["documents", "metadatas"], limit=page, offset=offset)
+        ids = got.get("ids") or []
+        if not ids:
+            break
+        idx.add(col.name, ids, got.get("documents") or [""] * len(ids), got.get("metadatas") or [{}] * len(ids))
+        total += len(ids)
+        offset += len(ids)
+    idx.mark_complete(col.name)
+    return total
+
+
+_backfilling: set[str] = set()
+
+
+def ensure_backfilled(names: Sequence[str], get_collection) -> List[str]:
+    """คืนชื่อ collection ที่ index ครบแล้ว; ที่ยังไม่ครบ → เริ่ม rebuild ใน thread เบื้องหลัง (ครั้งเดียวต่อ process)
+    ระหว่างนั้นผู้เรียกควรค้นแบบ dense อย่างเดียวสำหรับ collection นั้น (index ยังมีไม่ครบ)"""
+    idx = get_index()
+    if idx is None:
+        return []
+    ready: List[str] = []
+    for name in names:
+        if idx.is_complete(name):
+            ready.append(name)
+            continue
+        with _index_lock:
+            if name in _backfilling:
+                continue
+            _backfilling.add(name)
+
+        def run(name=name):
+            try:
+                try:
+                    col = get_collection(name, create=False)
+                except Exception:
+                    return  # ยังไม่มี collection นี้ → ingest แรกจะ mark เอง
+                n = rebuild(col)
+                print(f"[RAG] lexical index backfilled {n} chunks for {name}")
+            except Exception as e:
+                print(f"[RAG] lexical backfill failed for {name}: {e}")
+            finally:
+                with _index_lock:
+                    _backfilling.discard(name)
+
+        threading.Thread(target=run, name=f"lexical-backfill-{name}", daemon=True).start()
+    return ready
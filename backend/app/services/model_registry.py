@@ -0,0 +1,151 @@
+from __future__ import annotations
+import logging, threading, time
+from typing import Dict, List
+
+from ..config import Config
+from . import ollama_client
+from .ollama_client import _get, _model_context
+
+logger = logging.getLogger(__name__)
+
+# ---------- Model registry: cache รายการโมเดลจาก /api/tags ในหน่วยความจำ ----------
+# - เช็คว่ามีโมเดลไหมจาก memory (ไม่ยิง /api/tags ทุกคำขอ)
+# - หมด TTL → refresh เบื้องหลัง (คำขอปัจจุบันใช้รายการเดิมไปก่อน)
+# - Ollama ล่มชั่วคราว → ใช้รายการล่าสุดที่รู้จักต่อ
+# - metadata ต่อโมเดล: family, parameter_size, quantization, size, context_length/num_ctx (ถาม /api/show เมื่อใช้ครั้งแรก)
+# - ที่เดียวที่รู้ context window ของโมเดล: งบ token (token_budget) และ num_ctx ที่ส่งให้ Ollama อ่านจาก context_length()
+
+_lock = threading.Lock()
+_models: Dict[str, dict] = {}
+_loaded_at = 0.0          # monotonic ของ refresh ที่สำเร็จล่าสุด (0 = ยังไม่เคย)
+_attempted_at = 0.0       # monotonic ของความพยายามล่าสุด (สำเร็จหรือไม่ก็ตาม)
+_last_error: str | None = None
+_refreshing = False
+
+
+def _ttl() -> float:
+    return float(getattr(Config, "MODEL_REGISTRY_TTL", 60))
+
+
+def _entry(m: dict, old: dict | None) -> dict:
+    details = m.get("details") or {}
+    keep = old if old and old.get("digest") == m.get("digest") else {}
+    return {
+        "name": m["name"],
+        "family": details.get("family"),
+        "families": details.get("families"),
+        "parameter_size": details.get("parameter_size"),
+        "quantization": details.get("quantization_level"),
+        "format": details.get("format"),
+        "size": m.get("size"),
+        "digest": m.get("digest"),
+        "modified_at": m.get("modified_at"),
+        # ถามแยก (/api/show) → เก็บค่าเดิมไว้ถ้า digest ไม่เปลี่ยน
+        "context_length": keep.get("context_length"),  # ความยาวสูงสุดที่โมเดลรองรับ
+        "num_ctx": keep.get("num_ctx"),                # num_ctx ที่ Modelfile ตั้งไว้
+    }
+
+
+def refresh() -> bool:
+    """ดึง /api/tags ใหม่ (blocking); ล้มเหลว → คงรายการเดิมไว้และจำ error"""
+    global _models, _loaded_at, _attempted_at, _last_error
+    _attempted_at = time.monotonic()
+    try:
+        r = _get("/api/tags", "tags")
+        r.raise_for_status()
+        data = r.json() or {}
+        raw = [m for m in data.get("models", []) if isinstance(m, dict) and m.get("name")]
+    except Exception as e:
+        _last_error = str(e)
+        logger.warning("Model registry refresh failed (keeping %d known models): %s", len(_models), e)
+        return False
+    with _lock:
+        _models = {m["name"]: _entry(m, _models.get(m["name"])) for m in raw}
+        _loaded_at = time.monotonic()
+        _last_error = None
+    return True
+
+
+def _refresh_bg() -> None:
+    global _refreshing
+    try:
+        refresh()
+    finally:
+        _refreshing = False
+
+
+def _ensure_fresh() -> None:
+    global _refreshing
+    if not _loaded_at and not _attempted_at:
+        refresh()  # ครั้งแรกของ process: ต้องรอ
+        return
+    if time.monotonic() - _attempted_at < _ttl():
+        return
+    with _lock:
+        if _refreshing:
+            return
+        _refreshing = True
+    threading.Thread(target=_refresh_bg, name="model-registry", daemon=True).start()
+
+
+def _match(name: str) -> dict | None:
+    m = _models.get(name)
+    if m is not None:
+        return m
+    # "llama3.1" ตรงกับ "llama3.1:latest", "llama3.1:8b" ...
+    for key, m in _models.items():
+        if key.startswith(f"{name}:"):
+            return m
+    return None
+
+
+def is_available(name: str) -> bool:
+    """มีโมเดลนี้ใน Ollama ไหม (จาก memory); ไม่เจอ → refresh ทันทีได้ไม่เกิน 1 ครั้งต่อ MODEL_REGISTRY_MISS_REFRESH_SEC
+    เผื่อเพิ่ง `ollama pull` มา"""
+    _ensure_fresh()
+    if _match(name) is not None:
+        return True
+    if time.monotonic() - _attempted_at >= float(getattr(Config, "MODEL_REGISTRY_MISS_REFRESH_SEC", 10)):
+        refresh()
+        return _match(name) is not None
+    return False
+
+
+def get(name: str) -> dict | None:
+    """metadata ของโมเดล (รวม context_length/num_ctx ซึ่งจะถาม /api/show ครั้งแรกที่เรียก)"""
+    _ensure_fresh()
+    m = _match(name)
+    if m is None:
+        return None
+    if m.get("context_length") is None and m.get("num_ctx") is None:
+        try:
+            m["context_length"], m["num_ctx"] = _model_context(m["name"])
+        except Exception as e:
+            logger.warning("Cannot read context length of %s: %s", m["name"], e)  # ไม่จำ: ไว้ลองใหม่รอบหน้า
+    return dict(m)
+
+
+def context_length(name: str | None) -> int:
+    """context window ที่โมเดลจะใช้จริงกับคำขอของเรา:
+    OLLAMA_NUM_CTX (ถ้าตั้ง) → num_ctx ของ Modelfile → OLLAMA_DEFAULT_NUM_CTX; ไม่เกินความยาวสูงสุดของโมเดล"""
+    m = get(name) if name else None
+    n = ollama_client.OLLAMA_NUM_CTX or (m or {}).get("num_ctx") or ollama_client.OLLAMA_DEFAULT_NUM_CTX
+    limit = (m or {}).get("context_length")
+    return min(n, limit) if limit else n
+
+
+def models() -> List[dict]:
+    _ensure_fresh()
+    return [dict(m) for _, m in sorted(_models.items())]
+
+
+def status() -> dict:
+    now = time.monotonic()
+    return {
+        "count": len(_models),
+        "loaded": bool(_loaded_at),
+        "age_sec": round(now - _loaded_at, 1) if _loaded_at else None,
+        "stale": not _loaded_at or now - _loaded_at > _ttl(),
+        "ttl_sec": _ttl(),
+        "last_error": _last_error,
+    }
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import asyncio, os
+from typing import AsyncIterator, List, Union
+
+import httpx
+
+from .ollama_client import (
+    OLLAMA_HOST, OLLAMA_CONNECT_TIMEOUT, ChatMessage, _join_prompt, chat_options, parse_stream_line, timeout_for,
+)
+
+# ---------- Async Ollama client (httpx) สำหรับ ASGI path ----------
+# stream หนึ่งเส้น = coroutine หนึ่งตัว + connection หนึ่งเส้นใน pool (ไม่จอง thread ระหว่างรอ token)
+
+OLLAMA_ASYNC_MAX_CONNECTIONS = int(os.getenv("OLLAMA_ASYNC_MAX_CONNECTIONS", 1024))
+OLLAMA_ASYNC_KEEPALIVE = int(os.getenv("OLLAMA_ASYNC_KEEPALIVE", 64))
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """AsyncClient ร่วมกันทั้ง event loop (สร้างตอนใช้ครั้งแรก, ปิดด้วย aclose() ตอน shutdown)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _, read = timeout_for("stream")
+        _client = httpx.AsyncClient(
+            base_url=OLLAMA_HOST,
+            timeout=httpx.Timeout(connect=OLLAMA_CONNECT_TIMEOUT, read=read, write=30.0, pool=None),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_ASYNC_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def stream_chat_events(model: str, messages: Union[str, List[ChatMessage]]) -> AsyncIterator[tuple[str, Union[str, dict]]]:
+    """async คู่กับ ollama_client.stream_chat_events: ("delta", ข้อความ) ... แล้ว ("usage", dict)
+    พยายามใช้ /api/chat; ถ้า 404 ให้ fallback ไป /api/generate"""
+    if isinstance(messages, str):
+        normalized: List[ChatMessage] = [{"role": "user", "content": messages}]
+    else:
+        normalized = messages
+
+    # num_ctx (ถ้าตั้ง OLLAMA_NUM_CTX) อาจต้องถาม /api/show (sync, cache ต่อโมเดล) → ทำใน thread ครั้งแรก
+    options = await asyncio.to_thread(chat_options, model)
+    client = get_client()
+
+    # ---------- ทางหลัก: /api/chat ----------
+    payload = {"model": model, "messages": normalized, "stream": True, "options": options}
+    async with client.stream("POST", "/api/chat", json=payload) as r:
+        if r.status_code != 404:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                chunk, final = parse_stream_line(line)
+                if chunk:
+                    yield "delta", chunk
+                if final is not None:
+                    yield "usage", final
+                    break
+            return
+
+    # ---------- Fallback: /api/generate ----------
+    payload = {"model": model, "prompt": _join_prompt(normalized), "stream": True, "options": options}
+    async with client.stream("POST", "/api/generate", json=payload) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            chunk, final = parse_stream_line(line)
+            if chunk:
+                yield "delta", chunk
+            if final is not None:
+                yield "usage", final
+                break
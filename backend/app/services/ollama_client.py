@@ -1,69 +1,353 @@
-import os, requests, json
+import os, requests, json, threading, time
 from typing import Iterator, List, Dict, Union, TypedDict
-from flask import jsonify
+from requests.adapters import HTTPAdapter
 
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 
-def model_available(name: str) -> bool:
-    try:
-        r = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
-        r.raise_for_status()
-        data = r.json() or {}
-        models = [m.get("name") for m in data.get("models", []) if isinstance(m, dict)]
-        
-        return any(m == name or m.startswith(f"{name}:") for m in models)
-        # print(f"Available models: {names}")  # Debugging line
-    except Exception:
-        return False
-    
-def list_models():
-    try:
-        r = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
-        r.raise_for_status()
-        # print(f"Response from {OLLAMA_HOST}/api/tags: {r.text}")  # Debugging line
-        data = r.json() or {}
+# ---------- Pooled HTTP session ----------
+
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", 16))
+OLLAMA_POOL_BLOCK = os.getenv("OLLAMA_POOL_BLOCK", "1") == "1"  # เต็มแล้วให้รอ แทนการเปิด connection ทิ้งขว้าง
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 3.05))
+
+
+def _read_timeout(env: str, default: float | None) -> float | None:
+    raw = os.getenv(env)
+    if raw is None:
+        return default
+    raw = raw.strip().lower()
+    if raw in ("", "none", "0"):
+        return None  # ไม่จำกัดเวลาอ่าน (เช่น stream ยาว ๆ)
+    return float(raw)
+
+
+# (connect, read) ต่อ endpoint — read=None คือรอได้ไม่จำกัด
+_TIMEOUTS: Dict[str, tuple[float, float | None]] = {
+    "tags":       (OLLAMA_CONNECT_TIMEOUT, _read_timeout("OLLAMA_TIMEOUT_TAGS", 5)),
+    "show":       (OLLAMA_CONNECT_TIMEOUT, _read_timeout("OLLAMA_TIMEOUT_SHOW", 10)),
+    "chat":       (OLLAMA_CONNECT_TIMEOUT, _read_timeout("OLLAMA_TIMEOUT_CHAT", 120)),
+    "embeddings": (OLLAMA_CONNECT_TIMEOUT, _read_timeout("OLLAMA_TIMEOUT_EMBED", 120)),
+    "stream":     (OLLAMA_CONNECT_TIMEOUT, _read_timeout("OLLAMA_TIMEOUT_STREAM", None)),
+}
+
+
+def timeout_for(endpoint: str) -> tuple[float, float | None]:
+    return _TIMEOUTS.get(endpoint, (OLLAMA_CONNECT_TIMEOUT, 120))
+
 
-        models = []
-        for m in data.get("models", []):
-            if isinstance(m, dict) and "name" in m:
-                # เอาชื่อมาแล้ว split ที่ ":" เอาเฉพาะซ้ายสุด
-                clean_name = m["name"].split(":")[0]
-                models.append(clean_name)
+class _OllamaSession:
+    """requests.Session ที่ใช้ร่วมกันทั้ง process: keep-alive + connection pool จำกัดขนาด
+
+    สร้างใหม่อัตโนมัติเมื่อ pid เปลี่ยน (เช่น gunicorn fork worker) เพื่อไม่ให้ใช้ socket ร่วมกับ parent
+    """
+
+    def __init__(self, pool_size: int = OLLAMA_POOL_SIZE, block: bool = OLLAMA_POOL_BLOCK):
+        self.pool_size = max(1, pool_size)
+        self.block = block
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+        self._session: requests.Session | None = None
+        self._adapter: HTTPAdapter | None = None
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._gen = 0  # รุ่นของ session: response ของ session ที่ถูกแทนแล้ว (fork/close) ไม่ลดตัวนับของรุ่นใหม่
+
+    def _build(self) -> None:
+        s = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,           # จำนวน host ที่เก็บ pool ไว้ (ปกติมี host เดียว)
+            pool_maxsize=self.pool_size,  # connection ต่อ host
+            pool_block=self.block,
+            max_retries=0,
+        )
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        self._session, self._adapter, self._pid = s, adapter, os.getpid()
+        self._in_flight = 0
+        self._gen += 1
+
+    def session(self) -> requests.Session:
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._build()
+        return self._session
+
+    def request(self, method: str, url: str, endpoint: str, **kw) -> requests.Response:
+        kw.setdefault("timeout", timeout_for(endpoint))
+        s = self.session()
+        with self._lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            gen = self._gen
+        try:
+            r = s.request(method, url, **kw)
+        except BaseException:
+            self._release(gen)
+            raise
+        if not kw.get("stream"):
+            self._release(gen)  # อ่าน body ครบแล้ว connection กลับเข้า pool แล้ว
+            return r
+        # stream=True: connection ยังถูกใช้จนกว่าจะปิด response (with ... / r.close()) → นับจนถึงตอนนั้น
+        close, closed = r.close, []
+
+        def _close() -> None:
+            try:
+                close()
+            finally:
+                with self._lock:
+                    first = not closed
+                    closed.append(True)
+                if first:
+                    self._release(gen)
+
+        r.close = _close
+        return r
+
+    def _release(self, gen: int) -> None:
+        with self._lock:
+            if gen == self._gen:
+                self._in_flight -= 1
+
+    def stats(self) -> dict:
+        """สถิติ pool: opened = connection ที่เปิดใหม่, reused = request ที่ใช้ connection เดิม"""
+        opened = requests_total = idle = 0
+        hosts = []
+        adapter = self._adapter
+        if adapter is not None and self._pid == os.getpid():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                n_conn = getattr(pool, "num_connections", 0)
+                n_req = getattr(pool, "num_requests", 0)
+                q = getattr(pool, "pool", None)
+                n_idle = q.qsize() if q is not None else 0
+                opened += n_conn
+                requests_total += n_req
+                idle += n_idle
+                hosts.append({
+                    "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                    "opened": n_conn,
+                    "requests": n_req,
+                    "idle": n_idle,
+                })
+        with self._lock:
+            in_flight = self._in_flight
+            peak = self._peak_in_flight
+        return {
+            "pool_size": self.pool_size,
+            "block": self.block,
+            "opened": opened,
+            "reused": max(0, requests_total - opened),
+            "requests": requests_total,
+            "idle": idle,
+            "in_flight": in_flight,
+            "waiting": max(0, in_flight - self.pool_size) if self.block else 0,
+            "peak_in_flight": peak,
+            "hosts": hosts,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = self._adapter = self._pid = None
+
+
+_http = _OllamaSession()
+
+
+def _get(path: str, endpoint: str, **kw) -> requests.Response:
+    return _http.request("GET", f"{OLLAMA_HOST}{path}", endpoint, **kw)
+
+
+def _post(path: str, endpoint: str, **kw) -> requests.Response:
+    return _http.request("POST", f"{OLLAMA_HOST}{path}", endpoint, **kw)
+
+
+def pool_stats() -> dict:
+    return _http.stats()
+
+
+def close_pool() -> None:
+    _http.close()
+
+
+# ---------- Context window ----------
+
+# num_ctx ที่ส่งให้ Ollama: ส่งเฉพาะเมื่อตั้ง OLLAMA_NUM_CTX เอง (0 = ไม่ส่ง → ใช้ num_ctx ของ Modelfile/ค่าเริ่มต้นของ server)
+# ถ้าตั้งไว้จะใช้ค่าเดียวกันทุกคำขอ (ไม่ต้อง reload โมเดลเพราะ num_ctx เปลี่ยน) แต่ไม่เกินที่โมเดลรองรับ
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", 0))
+# context window ของ server เมื่อไม่ได้ส่ง num_ctx และ Modelfile ไม่ได้ตั้ง (ให้ตรงกับ OLLAMA_CONTEXT_LENGTH ฝั่ง server)
+OLLAMA_DEFAULT_NUM_CTX = int(os.getenv("OLLAMA_DEFAULT_NUM_CTX", 4096))
+
+
+def _model_context(model: str) -> tuple[int | None, int | None]:
+    """(context length สูงสุดของโมเดล, num_ctx ที่ Modelfile ตั้งไว้) จาก /api/show"""
+    r = _post("/api/show", "show", json={"model": model})
+    r.raise_for_status()
+    data = r.json() or {}
+    limit = next((val for key, val in (data.get("model_info") or {}).items()
+                  if key.endswith(".context_length") and isinstance(val, int)), None)
+    num_ctx = None
+    for line in (data.get("parameters") or "").splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] == "num_ctx" and parts[1].isdigit():
+            num_ctx = int(parts[1])
+    return limit, num_ctx
+
+
+def chat_options(model: str) -> dict:
+    """options ของคำขอ chat/generate: มี num_ctx เฉพาะเมื่อตั้ง OLLAMA_NUM_CTX (ไม่งั้นไม่ทับค่าของ Modelfile)"""
+    if not OLLAMA_NUM_CTX:
+        return {}
+    from .model_registry import context_length  # model_registry import โมดูลนี้
+    return {"num_ctx": context_length(model)}
 
-        return jsonify({"models": models})
-    except Exception:
-        return jsonify({"models": []}), 500
 
 def chat(model: str, message: str) -> str:
-    r = requests.post(f"{OLLAMA_HOST}/api/chat", json={
+    r = _post("/api/chat", "chat", json={
         "model": model,
         "messages": [{"role": "user", "content": message}],
         "stream": False
-    }, timeout=120)
+    })
     r.raise_for_status()
     data = r.json()
     return data["message"]["content"]
 
-def embed(model: str, texts: list[str]) -> list[list[float]]:
-    """Batch embedding ด้วย Ollama /api/embeddings (ทีละชิ้นก็ได้)"""
+# ---------- Embeddings ----------
+
+OLLAMA_EMBED_BATCH = int(os.getenv("OLLAMA_EMBED_BATCH", 64))  # จำนวน input สูงสุดต่อคำขอ /api/embed
+
+# None = ยังไม่รู้, True = server รองรับ /api/embed, False = server รุ่นเก่า ใช้ /api/embeddings
+_embed_batch_supported: bool | None = None
+
+
+def _embed_error(model: str, r: requests.Response) -> RuntimeError:
+    # เติมข้อความแนะนำให้ชัด
+    detail = r.text.strip()
+    return RuntimeError(
+        f"Embeddings request failed ({r.status_code}) for model '{model}'. "
+        f"Check OLLAMA_HOST={OLLAMA_HOST} and ensure model is pulled: `ollama pull {model}`. "
+        f"Response: {detail[:300]}"
+    )
+
+
+def _embed_single(model: str, texts: list[str]) -> list[list[float]]:
+    """endpoint เดิม /api/embeddings: ทีละข้อความ"""
     out: list[list[float]] = []
     for t in texts:
-        r = requests.post(f"{OLLAMA_HOST}/api/embeddings", json={
+        r = _post("/api/embeddings", "embeddings", json={
             "model": model,
             "prompt": t,
-        }, timeout=120)
+        })
         if r.status_code >= 400:
-            # เติมข้อความแนะนำให้ชัด
-            detail = r.text.strip()
-            raise RuntimeError(
-                f"Embeddings request failed ({r.status_code}) for model '{model}'. "
-                f"Check OLLAMA_HOST={OLLAMA_HOST} and ensure model is pulled: `ollama pull {model}`. "
-                f"Response: {detail[:300]}"
-            )
+            raise _embed_error(model, r)
         data = r.json()
         out.append(data.get("embedding", []))
     return out
 
+
+def _embed_many(model: str, texts: list[str]) -> list[list[float]] | None:
+    """endpoint ใหม่ /api/embed: ส่งหลายข้อความในคำขอเดียว; คืน None ถ้า server ไม่รองรับ"""
+    r = _post("/api/embed", "embeddings", json={
+        "model": model,
+        "input": texts,
+    })
+    if r.status_code in (404, 405):
+        return None
+    if r.status_code >= 400:
+        raise _embed_error(model, r)
+    vecs = (r.json() or {}).get("embeddings")
+    if not isinstance(vecs, list) or len(vecs) != len(texts):
+        raise RuntimeError(
+            f"Embeddings batch returned {len(vecs) if isinstance(vecs, list) else 'no'} vectors "
+            f"for {len(texts)} inputs (model '{model}')"
+        )
+    return vecs
+
+
+class _EmbedMeter:
+    """นับคำขอ embed ที่ยิงไป Ollama: busy = เวลาที่มีคำขอค้างอย่างน้อย 1, request_sec = เวลารวมทุกคำขอ
+    (request_sec / ช่วงเวลา = จำนวนคำขอที่ค้างพร้อมกันโดยเฉลี่ย เทียบกับ OLLAMA_NUM_PARALLEL ได้)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = self.texts = self._inflight = 0
+            self.busy_sec = self.request_sec = 0.0
+            self._busy_since = 0.0
+
+    def start(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            if self._inflight == 0:
+                self._busy_since = now
+            self._inflight += 1
+        return now
+
+    def stop(self, t0: float, n: int) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._inflight -= 1
+            if self._inflight == 0:
+                self.busy_sec += now - self._busy_since
+            self.calls += 1
+            self.texts += n
+            self.request_sec += now - t0
+
+    def stats(self) -> dict:
+        with self._lock:
+            busy = self.busy_sec + (time.monotonic() - self._busy_since if self._inflight else 0.0)
+            return {"calls": self.calls, "texts": self.texts, "inflight": self._inflight,
+                    "busy_sec": round(busy, 3), "request_sec": round(self.request_sec, 3)}
+
+
+_embed_meter = _EmbedMeter()
+
+
+def embed_stats() -> dict:
+    return _embed_meter.stats()
+
+
+def reset_embed_stats() -> None:
+    _embed_meter.reset()
+
+
+def embed(model: str, texts: Union[str, list[str]], batch_size: int | None = None) -> list[list[float]]:
+    """Batch embedding: ใช้ /api/embed ทีละก้อน (ไม่เกิน batch_size) ถ้า server รองรับ
+    ไม่งั้น fallback ไป /api/embeddings ทีละชิ้น — คืนรายการเวกเตอร์ตามลำดับ input เสมอ
+    (ส่ง str เดี่ยวมาก็ได้ จะได้รายการที่มีเวกเตอร์เดียว)"""
+    global _embed_batch_supported
+    if isinstance(texts, str):
+        texts = [texts]
+    if not texts:
+        return []
+    size = max(1, batch_size or OLLAMA_EMBED_BATCH)
+
+    out: list[list[float]] = []
+    for i in range(0, len(texts), size):
+        part = texts[i:i+size]
+        t0 = _embed_meter.start()
+        try:
+            if _embed_batch_supported is not False:
+                vecs = _embed_many(model, part)
+                if vecs is not None:
+                    _embed_batch_supported = True
+                    out.extend(vecs)
+                    continue
+                _embed_batch_supported = False
+                print(f"[OLLAMA] /api/embed not available on {OLLAMA_HOST} — using /api/embeddings")
+            out.extend(_embed_single(model, part))
+        finally:
+            _embed_meter.stop(t0, len(part))
+    return out
+
 class ChatMessage(TypedDict):
     role: str   # 'system' | 'user' | 'assistant'
     content: str
@@ -77,42 +361,61 @@ def _join_prompt(messages: list[dict]) -> str:
     parts.append("ASSISTANT:\n")
     return "\n".join(parts)
 
-def stream_chat(model: str, messages: Union[str, List[ChatMessage]]) -> Iterator[str]:
-    """พยายามใช้ /api/chat; ถ้า 404 ให้ fallback ไป /api/generate"""
+_USAGE_KEYS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration",
+               "load_duration", "total_duration", "done_reason")
+
+
+def _usage(obj: dict) -> dict:
+    """ตัวเลขเวลา/จำนวน token จากบรรทัดสุดท้าย (done=true) ของ Ollama (duration เป็น ns)"""
+    out = {k: obj[k] for k in _USAGE_KEYS if k in obj}
+    if obj.get("eval_count") and obj.get("eval_duration"):
+        out["tokens_per_sec"] = round(obj["eval_count"] / (obj["eval_duration"] / 1e9), 2)
+    return out
+
+
+def parse_stream_line(line: str | None) -> tuple[str, dict | None]:
+    """แปลงหนึ่งบรรทัด NDJSON ของ /api/chat หรือ /api/generate → (ข้อความ, usage ถ้าเป็นบรรทัดสุดท้าย)"""
+    if not line:
+        return "", None
+    try:
+        obj = json.loads(line)
+    except json.JSONDecodeError:
+        return "", None
+    if not isinstance(obj, dict):
+        return "", None
+
+    chunk = ""
+    # chat รูปแบบใหม่
+    if "message" in obj and isinstance(obj["message"], dict):
+        chunk = obj["message"].get("content", "")
+    # generate (และเผื่อบางเวอร์ชันของ chat ที่ส่ง field response มา)
+    elif "response" in obj:
+        chunk = obj.get("response", "")
+    return chunk, (_usage(obj) if obj.get("done") else None)
+
+
+def stream_chat_events(model: str, messages: Union[str, List[ChatMessage]]) -> Iterator[tuple[str, Union[str, dict]]]:
+    """เหมือน stream_chat แต่ yield เป็น event: ("delta", ข้อความ) ... แล้วปิดด้วย ("usage", dict)
+    พยายามใช้ /api/chat; ถ้า 404 ให้ fallback ไป /api/generate"""
     if isinstance(messages, str):
         normalized: List[ChatMessage] = [{"role": "user", "content": messages}]
     else:
         normalized = messages
 
     # ---------- ทางหลัก: /api/chat ----------
-    chat_url = f"{OLLAMA_HOST}/api/chat"
-    payload = {"model": model, "messages": normalized, "stream": True}
+    options = chat_options(model)
+    payload = {"model": model, "messages": normalized, "stream": True, "options": options}
     try:
-        with requests.post(chat_url, json=payload, stream=True, timeout=None) as r:
+        with _post("/api/chat", "stream", json=payload, stream=True) as r:
             if r.status_code == 404:
                 raise FileNotFoundError("ollama /api/chat not found")
             r.raise_for_status()
             for line in r.iter_lines(decode_unicode=True):
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-
-                chunk = ""
-                if isinstance(obj, dict):
-                    # chat รูปแบบใหม่
-                    if "message" in obj and isinstance(obj["message"], dict):
-                        chunk = obj["message"].get("content", "")
-                    # เผื่อบางเวอร์ชันส่ง field response มา
-                    elif "response" in obj:
-                        chunk = obj.get("response", "")
-
+                chunk, final = parse_stream_line(line)
                 if chunk:
-                    yield chunk
-
-                if isinstance(obj, dict) and obj.get("done"):
+                    yield "delta", chunk
+                if final is not None:
+                    yield "usage", final
                     break
             return
     except FileNotFoundError:
@@ -124,24 +427,20 @@ def stream_chat(model: str, messages: Union[str, List[ChatMessage]]) -> Iterator
             raise
 
     # ---------- Fallback: /api/generate ----------
-    gen_url = f"{OLLAMA_HOST}/api/generate"
     prompt = _join_prompt(normalized)
-    with requests.post(gen_url, json={"model": model, "prompt": prompt, "stream": True}, stream=True, timeout=None) as r:
+    with _post("/api/generate", "stream", json={"model": model, "prompt": prompt, "stream": True, "options": options}, stream=True) as r:
         r.raise_for_status()
         for line in r.iter_lines(decode_unicode=True):
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            delta = ""
-            # รูปแบบ generate เดิม
-            if isinstance(obj, dict):
-                delta = obj.get("response", "")
-            if delta:
-                yield delta
-
-            if isinstance(obj, dict) and obj.get("done"):
-                break
\ No newline at end of file
+            chunk, final = parse_stream_line(line)
+            if chunk:
+                yield "delta", chunk
+            if final is not None:
+                yield "usage", final
+                break
+
+
+def stream_chat(model: str, messages: Union[str, List[ChatMessage]]) -> Iterator[str]:
+    """stream เฉพาะข้อความ (ทิ้ง usage)"""
+    for kind, value in stream_chat_events(model, messages):
+        if kind == "delta":
+            yield value
@@ -0,0 +1,98 @@
+from __future__ import annotations
+import copy, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence
+
+from ..config import Config
+
+# ---------- Query-result cache ของ rag.search (TTL + LRU) ----------
+# invalidate ด้วย version ต่อ collection: ทุกครั้งที่ ingest/ลบแก้ collection จะ bump version
+# ผลที่ cache ไว้กับ version เก่าจะถือว่าหมดอายุทันที
+# (version อยู่ใน process นี้ — worker อื่นจะเห็นข้อมูลใหม่ภายใน TTL)
+
+_lock = threading.Lock()
+_versions: Dict[str, int] = {}
+_entries: "OrderedDict[tuple, tuple[float, tuple, List[Dict[str, Any]]]]" = OrderedDict()
+_counters = {"hits": 0, "misses": 0, "stale": 0, "expired": 0}
+
+
+def _enabled() -> bool:
+    return bool(getattr(Config, "RAG_QUERY_CACHE_ENABLED", True)) and int(getattr(Config, "RAG_QUERY_CACHE_SIZE", 0)) > 0
+
+
+def version(name: str) -> int:
+    return _versions.get(name, 0)
+
+
+def bump_version(name: str) -> int:
+    with _lock:
+        _versions[name] = _versions.get(name, 0) + 1
+        return _versions[name]
+
+
+def _versions_of(names: Sequence[str]) -> tuple:
+    return tuple(_versions.get(n, 0) for n in names)
+
+
+def get(query: str, k: int, names: Sequence[str]) -> List[Dict[str, Any]] | None:
+    if not _enabled():
+        return None
+    key = (query, k, tuple(names))
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _counters["misses"] += 1
+            return None
+        expires, vers, hits = entry
+        if expires < now:
+            _entries.pop(key, None)
+            _counters["expired"] += 1
+            _counters["misses"] += 1
+            return None
+        if vers != _versions_of(names):
+            _entries.pop(key, None)
+            _counters["stale"] += 1
+            _counters["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _counters["hits"] += 1
+    return copy.deepcopy(hits)  # กันผู้เรียกแก้ dict ใน cache
+
+
+def put(query: str, k: int, names: Sequence[str], hits: List[Dict[str, Any]], vers: tuple | None = None) -> None:
+    """vers = version ตอนเริ่มค้น (ถ้ามี ingest เข้ามาระหว่างค้น ผลนี้จะถูกมองว่า stale ในครั้งถัดไป)"""
+    if not _enabled():
+        return
+    key = (query, k, tuple(names))
+    ttl = float(getattr(Config, "RAG_QUERY_CACHE_TTL", 300))
+    size = int(getattr(Config, "RAG_QUERY_CACHE_SIZE", 1024))
+    with _lock:
+        _entries[key] = (time.monotonic() + ttl, vers if vers is not None else _versions_of(names), copy.deepcopy(hits))
+        _entries.move_to_end(key)
+        while len(_entries) > size:
+            _entries.popitem(last=False)
+
+
+def snapshot(names: Sequence[str]) -> tuple:
+    with _lock:
+        return _versions_of(names)
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
+
+
+def stats() -> dict:
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        return {
+            "enabled": _enabled(),
+            "items": len(_entries),
+            "capacity": int(getattr(Config, "RAG_QUERY_CACHE_SIZE", 0)),
+            "ttl_sec": float(getattr(Config, "RAG_QUERY_CACHE_TTL", 300)),
+            **_counters,
+            "hit_ratio": round(_counters["hits"] / lookups, 4) if lookups else 0.0,
+            "versions": dict(_versions),
+        }
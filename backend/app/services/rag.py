@@ -1,6 +1,7 @@
 from __future__ import annotations
-import os, re, uuid, unicodedata
-from typing import Iterable, List, Dict, Any
+import os, re, math, time, bisect, atexit, hashlib, threading, unicodedata
+import numpy as np
+from typing import Iterable, Iterator, List, Dict, Any, Callable
 
 from chromadb import PersistentClient
 from pypdf import PdfReader
@@ -8,29 +9,49 @@ from docx import Document as Docx
 
 from ..config import Config
 from .ollama_client import embed as ollama_embed
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import embed_cache, query_cache, lexical_index, source_index, token_budget
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+from collections import deque
+from itertools import islice
+import queue
 
 
 # ---------- Sanitize ----------
 
 _SURROGATE_RE = re.compile(r"[\uD800-\uDFFF]")  # ตัด surrogate ที่ผิดรูป
-_NULL_RE = re.compile(r"\x00")                  # กัน null byte
+_BAD_CHARS_RE = re.compile(r"[\x00\uD800-\uDFFF]")  # null byte + surrogate
 
 def sanitize_text(s: str) -> str:
+    """ตัด null/surrogate → NFC → ยุบ space/tab → ตัด whitespace ท้ายบรรทัดและบรรทัดว่าง → strip
+    ใช้ method ของ str (ทำงานในระดับ C) แทน regex หลายรอบ; แต่ละขั้นข้ามได้ถ้าข้อความปกติอยู่แล้ว"""
     if not s:
         return ""
-    # ตัด null และ surrogate ออก
-    s = _NULL_RE.sub("", s)
-    s = _SURROGATE_RE.sub("", s)
-    # จัดรูปแบบ unicode ให้ปกติ (เช่น สระ/วรรณยุกต์)
+    if _BAD_CHARS_RE.search(s):
+        s = _BAD_CHARS_RE.sub("", s)
+    # จัดรูปแบบ unicode ให้ปกติ (เช่น สระ/วรรณยุกต์) — เช็คก่อน เร็วกว่า normalize ทั้งก้อนมาก
     try:
-        s = unicodedata.normalize("NFC", s)
+        if not unicodedata.is_normalized("NFC", s):
+            s = unicodedata.normalize("NFC", s)
     except Exception:
         pass
-    # เกลา white-space เล็กน้อย
-    s = re.sub(r"[ \t]+", " ", s)
-    s = re.sub(r"\s+\n", "\n", s)
-    return s.strip()
+    # [ \t]+ → " "
+    if "\t" in s:
+        s = s.replace("\t", " ")
+    while "  " in s:
+        s = s.replace("  ", " ")
+    if "\n" not in s:
+        return s.strip()
+    # \s+\n → "\n": ตัด whitespace ท้ายทุกบรรทัด และบรรทัดที่ว่าง (ยกเว้นบรรทัดแรก/บรรทัดสุดท้าย) ทิ้ง
+    lines = s.split("\n")
+    last = lines.pop()
+    out = [lines[0].rstrip()]
+    for line in islice(lines, 1, None):
+        line = line.rstrip()
+        if line:
+            out.append(line)
+    out.append(last)
+    return "\n".join(out).strip()
 
 # ---------- Text loaders ----------
 
@@ -46,233 +67,764 @@ def load_text_from_file(path: str) -> str:
         return "\n\n".join(paras)
     raise ValueError(f"Unsupported extension: {ext}")
 
+def iter_text_blocks(path: str, block_chars: int | None = None) -> Iterator[str]:
+    """เหมือน load_text_from_file แต่คืนทีละก้อน (~block_chars) ตัดที่รอยต่อย่อหน้า
+    ไฟล์ txt/md อ่านจากดิสก์ทีละส่วน ไม่โหลดทั้งไฟล์เข้าหน่วยความจำ"""
+    block_chars = block_chars or int(getattr(Config, "RAG_STREAM_BLOCK_CHARS", 256_000))
+    ext = os.path.splitext(path)[1].lower()
+    if ext in [".txt", ".md"]:
+        buf = ""
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            while True:
+                part = f.read(block_chars)
+                if not part:
+                    break
+                buf += part
+                cut = buf.rfind("\n\n")
+                if cut <= 0:
+                    if len(buf) < block_chars * 4:
+                        continue  # ยังไม่เจอรอยต่อย่อหน้า อ่านต่ออีกหน่อย
+                    cut = len(buf)
+                block, buf = buf[:cut], buf[cut:]
+                block = sanitize_text(block)
+                if block:
+                    yield block
+        buf = sanitize_text(buf)
+        if buf:
+            yield buf
+        return
+    if ext == ".docx":
+        doc = Docx(path)
+        group: List[str] = []
+        size = 0
+        for para in doc.paragraphs:
+            t = sanitize_text(para.text or "")
+            if not t:
+                continue
+            group.append(t)
+            size += len(t) + 2
+            if size >= block_chars:
+                yield "\n\n".join(group)
+                group, size = [], 0
+        if group:
+            yield "\n\n".join(group)
+        return
+    raise ValueError(f"Unsupported extension: {ext}")
+
 # ---------- Chunking (paragraph-aware) ----------
 
 _parabreak = re.compile(r"\n{2,}")  # เว้นวรรค >=2 บรรทัด = ย่อหน้าใหม่
-_whitespace = re.compile(r"\s+")
 
 def _clean(s: str) -> str:
-    return _whitespace.sub(" ", s).strip()
+    return " ".join(s.split())  # ยุบ whitespace ทุกชนิดเป็นช่องว่างเดียว + strip
 
 def _split_paragraphs(s: str) -> List[str]:
+    if "\n\n" not in s:  # ข้อความที่ผ่าน sanitize_text แล้วไม่มีบรรทัดว่าง → ย่อหน้าเดียว
+        s = s.strip()
+        return [s] if s else []
     parts = [p.strip() for p in _parabreak.split(s)]
     return [p for p in parts if p]
 
+def _wrap_spans(text: str, max_chars: int, overlap: int, sentences: bool = False) -> List[tuple[int, int]]:
+    """ช่วง [start, end) ของแต่ละชิ้นเมื่อข้อความยาวเกิน max_chars
+    sentences=False: ตัดทุก max_chars ตรง ๆ (เลื่อนทีละ max_chars - overlap)
+    sentences=True: ถอยไปตัดที่ท้ายประโยค/ช่องว่างในครึ่งหลังของหน้าต่าง (ภาษาไทยเว้นวรรคระหว่างประโยค)
+    และเริ่มชิ้นถัดไปหลังช่องว่าง → ไม่ตัดกลางคำ"""
+    n = len(text)
+    if not sentences:
+        step = max(max_chars - overlap, 1)
+        return [(i, min(i + max_chars, n)) for i in range(0, n, step)]
+    spans: List[tuple[int, int]] = []
+    start = 0
+    while start < n:
+        end = min(start + max_chars, n)
+        if end < n:
+            lo = start + max_chars // 2
+            cut = max(text.rfind(". ", lo, end), text.rfind("? ", lo, end), text.rfind("! ", lo, end))
+            if cut >= 0:
+                end = cut + 1
+            else:
+                cut = text.rfind(" ", lo, end)
+                if cut > start:
+                    end = cut
+        spans.append((start, end))
+        if end >= n:
+            break
+        nxt = max(end - overlap, start + 1)
+        sp = text.find(" ", nxt, end)
+        start = sp + 1 if sp >= 0 else nxt
+    return spans
+
 def chunk_text(s: str,
                max_chars: int | None = None,
-               overlap: int | None = None) -> List[str]:
-    """ตัดเป็นย่อหน้า แล้ว pack ให้ใกล้เคียง max_chars พร้อม overlap"""
+               overlap: int | None = None,
+               sentences: bool | None = None) -> List[str]:
+    """ตัดเป็นย่อหน้า แล้ว pack ให้ใกล้เคียง max_chars พร้อม overlap
+    สะสมย่อหน้าเป็น list + ความยาวรวม แล้ว join ครั้งเดียวตอนปิดชิ้น (ไม่ต่อ string ซ้ำ ๆ)"""
     max_chars = max_chars or Config.RAG_CHUNK_CHARS
     overlap = overlap or Config.RAG_CHUNK_OVERLAP
-    paras = [_clean(p) for p in _split_paragraphs(s)]
+    if sentences is None:
+        sentences = bool(getattr(Config, "RAG_CHUNK_SENTENCES", False))
     chunks: List[str] = []
-    buf = ""
+    parts: List[str] = []
+    size = 0  # == len("\n\n".join(parts))
 
-    for p in paras:
-        if not buf:
-            buf = p
+    for p in map(_clean, _split_paragraphs(s)):
+        if not parts:
+            parts, size = [p], len(p)
             continue
-        if len(buf) + 2 + len(p) <= max_chars:
-            buf = f"{buf}\n\n{p}"
+        if size + 2 + len(p) <= max_chars:
+            parts.append(p)
+            size += 2 + len(p)
         else:
+            buf = "\n\n".join(parts)
             chunks.append(buf)
             # overlap ท้ายจาก buf มาเริ่มต้นชิ้นใหม่เพื่อคงความต่อเนื่อง
-            if overlap > 0 and len(buf) > overlap:
-                buf_tail = buf[-overlap:]
-                buf = f"{buf_tail}\n\n{p}"
+            if overlap > 0 and size > overlap:
+                parts, size = [buf[-overlap:], p], overlap + 2 + len(p)
             else:
-                buf = p
-    if buf:
-        chunks.append(buf)
+                parts, size = [p], len(p)
+    if parts:
+        chunks.append("\n\n".join(parts))
 
-    # กันชิ้นยักษ์: ตัดแบบ hard wrap ด้วยความยาว max_chars
+    # กันชิ้นยักษ์: ตัดตามช่วงจาก _wrap_spans
     out: List[str] = []
     for c in chunks:
         if len(c) <= max_chars:
             out.append(c)
         else:
-            i = 0
-            step = max(max_chars - overlap, 1)
-            while i < len(c):
-                out.append(c[i:i+max_chars])
-                i += step
+            out.extend(c[i:j] for i, j in _wrap_spans(c, max_chars, overlap, sentences))
     return [c for c in out if c.strip()]
 
+def _finish_chunk(c: str) -> str:
+    """ชิ้นจาก chunk_text ของข้อความที่ sanitize แล้ว: ได้ผลเท่ากับ sanitize_text(c)
+    (ภายในชิ้นมีแค่ช่องว่างเดี่ยวกับ "\n\n" คั่นย่อหน้า) โดยไม่ต้องไล่ทุกขั้นซ้ำ"""
+    if "\n\n" in c:
+        c = c.replace("\n\n", "\n")
+    return c.strip()
+
+# ---------- Collections (แยกคลังตามผู้ใช้ / workspace) ----------
+
+DEFAULT_COLLECTION = "kb_default"
+_COLLECTION_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{1,61}[A-Za-z0-9]$")  # ข้อกำหนดชื่อของ Chroma
+
+def user_collection(uid: int | str) -> str:
+    return f"kb_u{uid}"
+
+def validate_collection(name: str) -> str:
+    name = (name or "").strip()
+    if not _COLLECTION_RE.match(name):
+        raise ValueError(f"invalid collection name: {name!r}")
+    return name
+
+class CollectionAccessError(PermissionError):
+    """ผู้เรียกไม่มีสิทธิ์ใช้ collection นี้ → 403"""
+
+
+def allowed_collections(uid: int | str | None = None) -> set[str]:
+    """collection ที่ผู้เรียกใช้ได้: kb_default + RAG_SHARED_COLLECTIONS + kb_u<uid> ของตัวเอง (ถ้าล็อกอิน)"""
+    names = {DEFAULT_COLLECTION, *getattr(Config, "RAG_SHARED_COLLECTIONS", [])}
+    if uid is not None:
+        names.add(user_collection(uid))
+    return names
+
+def resolve_collections(requested: str | List[str] | None = None, uid: int | str | None = None) -> List[str]:
+    """เลือก collection ที่จะค้น/เขียน:
+    - ระบุมาเอง (str หรือ list) → ใช้ตามนั้น (ตรวจชื่อ + สิทธิ์: ต้องอยู่ใน allowed_collections(uid))
+    - ไม่ระบุ + RAG_PER_USER_COLLECTIONS + รู้ uid → [ของผู้ใช้, kb_default]
+    - นอกนั้น → [kb_default]
+    ชื่อผิดรูปแบบ → ValueError; ไม่มีสิทธิ์ → CollectionAccessError
+    """
+    if isinstance(requested, str):
+        requested = [p for p in requested.split(",") if p.strip()]
+    if requested:
+        names = list(dict.fromkeys(validate_collection(n) for n in requested))
+        allowed = allowed_collections(uid)
+        denied = [n for n in names if n not in allowed]
+        if denied:
+            raise CollectionAccessError(f"collection not allowed: {', '.join(denied)}")
+        return names
+    if uid is not None and getattr(Config, "RAG_PER_USER_COLLECTIONS", False):
+        return [user_collection(uid), DEFAULT_COLLECTION]
+    return [DEFAULT_COLLECTION]
+
 # ---------- Chroma client ----------
+# client/collection สร้างครั้งเดียวต่อ process แล้วใช้ซ้ำทุก request
+# (เช็ค pid ทุกครั้ง: หลัง fork เช่น gunicorn --preload ต้องเปิดใหม่ ห้ามใช้ handle ของ parent)
+
+_client = None
+_client_pid: int | None = None
+_collections: Dict[str, Any] = {}
+_client_lock = threading.RLock()
+
 
 def get_client():
-    os.makedirs(Config.CHROMA_DIR, exist_ok=True)
-    return PersistentClient(path=Config.CHROMA_DIR)
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                os.makedirs(Config.CHROMA_DIR, exist_ok=True)
+                _collections.clear()
+                _client = PersistentClient(path=Config.CHROMA_DIR)
+                _client_pid = pid
+    return _client
+
+# scripts/rag_compact.py สลับ collection ที่ rebuild แล้วเข้าแทนที่ชื่อเดิม แล้วแตะไฟล์นี้
+# → ทุก process ทิ้ง handle ที่ cache ไว้ (ซึ่งยังชี้ collection เก่าตาม id) ภายใน ~1 วินาที
+_SWAP_MARKER = ".collections-swapped"
+_swap_seen: int | None = None
+_swap_checked = 0.0
+
+
+def _swap_marker_path() -> str:
+    return os.path.join(Config.CHROMA_DIR, _SWAP_MARKER)
+
+
+def mark_collections_swapped() -> None:
+    path = _swap_marker_path()
+    with open(path, "a"):
+        pass
+    os.utime(path, None)
 
-def get_collection(name: str = "kb_default"):
+
+def _check_swapped() -> None:
+    global _swap_seen, _swap_checked
+    now = time.monotonic()
+    if now - _swap_checked < 1.0:
+        return
+    _swap_checked = now
+    try:
+        stamp = os.stat(_swap_marker_path()).st_mtime_ns
+    except OSError:
+        stamp = 0
+    if _swap_seen is not None and stamp != _swap_seen:
+        with _client_lock:
+            names = list(_collections)
+            _collections.clear()
+        for n in names:
+            query_cache.bump_version(n)
+        print(f"[RAG] collections swapped on disk → reopen {names}")
+    _swap_seen = stamp
+
+
+def get_collection(name: str = DEFAULT_COLLECTION, create: bool = True):
+    """create=False: ไม่สร้างใหม่ถ้ายังไม่มี (โยน exception ของ chromadb แทน)"""
     client = get_client()
-    return client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+    _check_swapped()
+    col = _collections.get(name)
+    if col is None:
+        with _client_lock:
+            col = _collections.get(name)
+            if col is None:
+                if create:
+                    col = client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+                else:
+                    col = client.get_collection(name=name)
+                _collections[name] = col
+    return col
+
+def forget_collection(name: str) -> None:
+    """ทิ้ง handle ที่ cache ไว้ (เช่นหลังลบ/สร้าง collection ใหม่)"""
+    with _client_lock:
+        _collections.pop(name, None)
+
+def close_client() -> None:
+    """ปิด client ของ process นี้ (เรียกตอน shutdown หรือเมื่ออยากเปิดใหม่)"""
+    global _client, _client_pid
+    with _client_lock:
+        client, same_proc = _client, _client_pid == os.getpid()
+        _client, _client_pid = None, None
+        _collections.clear()
+    if client is not None and same_proc:
+        try:
+            client.clear_system_cache()
+        except Exception as e:
+            print(f"[RAG] close chroma client failed: {e}")
+
+atexit.register(close_client)
 
 # ---- PDF loader (page-by-page) ----
 
-def load_pdf_pages(path: str) -> list[tuple[int, str]]:
+def _extract_pdf_range(path: str, start: int, end: int) -> list[tuple[int, str]]:
+    """ดึงข้อความหน้า [start, end) (0-based) — ใช้ได้ทั้งใน process หลักและใน worker process"""
     reader = PdfReader(path)
     out = []
-    for i, p in enumerate(reader.pages, start=1):  # 1-based
-        txt = (p.extract_text() or "")
+    for i in range(start, end):
+        txt = (reader.pages[i].extract_text() or "")
         txt = sanitize_text(txt)
         if txt:
-            out.append((i, txt))
+            out.append((i + 1, txt))  # 1-based
     return out
 
-# ---- Embedding helper (safe for single-text embed API) ----
+def _pdf_workers(n_pages: int, workers: int | None) -> int:
+    if workers is None:
+        workers = int(getattr(Config, "RAG_PDF_WORKERS", 0)) or (os.cpu_count() or 1)
+    if n_pages < int(getattr(Config, "RAG_PDF_PARALLEL_MIN_PAGES", 64)):
+        return 1  # ไฟล์เล็ก: ค่า spawn process แพงกว่างานจริง
+    return max(1, min(workers, n_pages))
+
+def iter_pdf_pages(path: str, workers: int | None = None) -> Iterator[tuple[int, str]]:
+    """ไล่คืน (page_no, text) ตามลำดับหน้าทีละหน้า; PDF ใหญ่จะแบ่งช่วงหน้าไปทำใน process pool
+    (extract_text ของ pypdf เป็น pure Python → ติด GIL ใช้ thread ไม่ช่วย)
+    ส่งงานล่วงหน้าไม่เกิน workers*2 ช่วง หน่วยความจำจึงไม่โตตามจำนวนหน้า"""
+    n_pages = len(PdfReader(path).pages)
+    workers = _pdf_workers(n_pages, workers)
+    if workers <= 1:
+        reader = PdfReader(path)
+        for i, p in enumerate(reader.pages, start=1):  # 1-based
+            txt = sanitize_text(p.extract_text() or "")
+            if txt:
+                yield i, txt
+        return
+
+    # แบ่งเป็นช่วงเล็กกว่าจำนวน worker (x4) เพื่อเกลี่ยงานเมื่อบางหน้าหนักกว่าหน้าอื่น
+    step = max(1, -(-n_pages // (workers * 4)))
+    ranges = iter([(i, min(i + step, n_pages)) for i in range(0, n_pages, step)])
+    ctx = multiprocessing.get_context("spawn")  # ไม่ fork จาก process ที่มี thread ของ Flask/Chroma อยู่
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+    window: deque = deque()
+    try:
+        for start, end in islice(ranges, workers * 2):
+            window.append(pool.submit(_extract_pdf_range, path, start, end))
+        while window:
+            part = window.popleft().result()  # รอตามลำดับ → หน้าเรียงถูกต้อง
+            nxt = next(ranges, None)
+            if nxt is not None:
+                window.append(pool.submit(_extract_pdf_range, path, *nxt))
+            yield from part
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
 
-def embed_batch(texts: List[str]) -> List[List[float]]:
-    """เรียก embed ทีละชิ้น, log ขนาดเวกเตอร์, กันเคสเวกเตอร์ว่าง"""
-    vecs: List[List[float]] = []
-    for idx, t in enumerate(texts, start=1):
-        try:
-            v = ollama_embed(Config.EMBEDDING_MODEL, t)
-            if not isinstance(v, list) or not v:
-                raise ValueError(f"empty/invalid embedding at chunk {idx}")
-            vecs.append(v)
-        except Exception as e:
-            # log แล้วข้ามชิ้นนี้
-            print(f"[RAG] embed error at chunk {idx}: {e}")
-            # จะตัดชิ้นนี้ออกโดยไม่ push vecs/docs/ids ให้ขนาดตรงกัน
-            vecs.append(None)  # ใส่ placeholder ไว้ก่อน เดี๋ยวกรองทิ้งตอน pack
-    return vecs
+def load_pdf_pages(path: str, workers: int | None = None) -> list[tuple[int, str]]:
+    return list(iter_pdf_pages(path, workers))
+
+# ---- Embedding helper ----
+
+def embed_batch(texts: List[str]) -> List[List[float] | None]:
+    """embed ทั้งรายการ (batch จริงผ่าน /api/embed), กันเคสเวกเตอร์ว่างด้วย None"""
+    return _embed_batch_or_single(texts)
 
 
 # ---------- Ingest ----------
 
+def _embed_one(text: str) -> List[float] | None:
+    try:
+        vecs = ollama_embed(Config.EMBEDDING_MODEL, [text])
+        v = vecs[0] if vecs else None
+        return v if isinstance(v, list) and v else None
+    except Exception as e:
+        print(f"[RAG] embed(single) error: {e}")
+        return None
+
+
+def _embed_uncached(texts: List[str]) -> List[List[float] | None]:
+    try:
+        vecs = ollama_embed(Config.EMBEDDING_MODEL, texts)
+        if isinstance(vecs, list) and len(vecs) == len(texts):
+            return [v if isinstance(v, list) and v else None for v in vecs]
+        print(f"[RAG] embed(batch) returned {len(vecs)} vectors for {len(texts)} texts — falling back to single mode")
+    except Exception as e:
+        print(f"[RAG] embed(batch) error: {e} — falling back to single mode")
+    return [_embed_one(t) for t in texts]
+
+
 def _embed_batch_or_single(texts: List[str]) -> List[List[float] | None]:
     """
-    เรียก ollama_embed แบบ batch (รายการข้อความ) ตามสัญญาเดิมของคุณ:
+    เรียก ollama_embed แบบ batch (ส่งหลายข้อความต่อคำขอ):
       embed(model, texts: List[str]) -> List[List[float]]
-    ถ้าในระบบปัจจุบัน embed คืนเวกเตอร์เดี่ยว (list[float]) ก็ fallback ให้
+    ข้อความที่เคย embed แล้วดึงจาก embed_cache ไม่ต้องยิง network;
+    ถ้าทั้งก้อนล้ม (เช่นมีชิ้นเดียวที่ยาวเกิน context) → ลองทีละชิ้น แล้วใส่ None ให้ชิ้นที่ล้ม
     """
     if not texts:
         return []
 
+    cache = embed_cache.get_cache()
+    if cache is None:
+        return _embed_uncached(texts)
+
+    out = cache.get_many(Config.EMBEDDING_MODEL, texts)
+    miss = [i for i, v in enumerate(out) if v is None]
+    if miss:
+        miss_texts = [texts[i] for i in miss]
+        vecs = _embed_uncached(miss_texts)
+        cache.put_many(Config.EMBEDDING_MODEL, miss_texts, vecs)
+        for i, v in zip(miss, vecs):
+            out[i] = v
+    return out
+
+
+def chunk_id(source: str, page: int | None, text: str) -> str:
+    """id ของชิ้นแบบ deterministic: hash(source, page, เนื้อหา) → ingest ซ้ำได้ id เดิม"""
+    h = hashlib.sha1()
+    h.update(str(source).encode("utf-8"))
+    h.update(b"\x1f")
+    h.update(str(page if page is not None else "").encode("utf-8"))
+    h.update(b"\x1f")
+    h.update(text.encode("utf-8", "ignore"))
+    return h.hexdigest()
+
+
+def _existing_chunks(col, source: str) -> Dict[str, dict]:
+    """ชิ้นที่มีอยู่แล้วของ source นี้ → {id: metadata}"""
     try:
-        vecs = ollama_embed(Config.EMBEDDING_MODEL, texts)  # ✅ คาดหวังคืนรายการเวกเตอร์
-        # ปกติควรเป็น list[list[float]] ขนาดเท่ากับ texts
-        if isinstance(vecs, list) and len(vecs) == len(texts) and isinstance(vecs[0], list):
-            return vecs
-        # Fallback: embed อาจคืนเวกเตอร์เดี่ยวเมื่อส่งสตริง → ลองทีละชิ้น (ช้า แต่ไม่ค้าง)
-        out: List[List[float] | None] = []
-        for t in texts:
-            try:
-                v = ollama_embed(Config.EMBEDDING_MODEL, t)
-                out.append(v if isinstance(v, list) and v else None)
-            except Exception as e:
-                print(f"[RAG] embed(single) error: {e}")
-                out.append(None)
-        return out
+        got = col.get(where={"source": source}, include=["metadatas"])
     except Exception as e:
-        print(f"[RAG] embed(batch) error: {e} — falling back to single mode")
-        out: List[List[float] | None] = []
-        for t in texts:
-            try:
-                v = ollama_embed(Config.EMBEDDING_MODEL, t)
-                out.append(v if isinstance(v, list) and v else None)
-            except Exception as e2:
-                print(f"[RAG] embed(single) error: {e2}")
-                out.append(None)
-        return out
+        print(f"[RAG] lookup existing chunks failed for {source}: {e}")
+        return {}
+    ids = got.get("ids") or []
+    metas = got.get("metadatas") or [None] * len(ids)
+    return {cid: dict(m or {}) for cid, m in zip(ids, metas)}
 
 
-def ingest_file(file_path: str, metadata: dict | None = None) -> dict:
-    ext = os.path.splitext(file_path)[1].lower()
-    base = os.path.basename(file_path)
-    metabase = metadata or {}
+def _refresh_metadata(col, pairs: List[tuple[str, dict]]) -> None:
+    """ชิ้นเนื้อหาเดิมแต่ metadata เปลี่ยน (เช่น page_offset) → อัปเดตโดยไม่ต้อง embed ใหม่"""
+    for i in range(0, len(pairs), 256):
+        part = pairs[i:i+256]
+        col.update(ids=[cid for cid, _ in part], metadatas=[m for _, m in part])
+    if pairs:
+        query_cache.bump_version(col.name)
 
-    abs_dir = os.path.abspath(Config.CHROMA_DIR)
-    os.makedirs(abs_dir, exist_ok=True)
-    if not os.access(abs_dir, os.W_OK):
-        raise RuntimeError(f"CHROMA_DIR not writable: {abs_dir}")
 
-    col = get_collection()
+def _embed_workers() -> int:
+    """จำนวน batch ที่ embed พร้อมกัน — ควรเท่ากับ OLLAMA_NUM_PARALLEL ของ server"""
+    return max(1, int(getattr(Config, "RAG_EMBED_WORKERS", 1) or 1))
 
-    BATCH = int(getattr(Config, "RAG_EMBED_BATCH", 64))   # ✅ ก้อนใหญ่ขึ้นเล็กน้อย
-    MIN_CHARS = int(getattr(Config, "RAG_MIN_CHARS", 1))
 
-    # queue
-    q_texts: List[str] = []
-    q_metas: List[dict] = []
+class IngestCancelled(Exception):
+    """ถูกยกเลิกระหว่าง ingest (ชิ้นที่ add ไปแล้วยังอยู่ใน collection)"""
 
-    def queue(text: str, meta: dict):
-        text = sanitize_text(text)
-        if not text or len(text) < MIN_CHARS:
-            return
-        q_texts.append(text)
-        q_metas.append(meta)
 
-    # เตรียมคิวจากไฟล์
+def _iter_chunks(file_path: str, base: str, metabase: dict) -> Iterator[tuple[str, dict]]:
+    """load → sanitize → chunk แบบ lazy: คืน (text, meta) ทีละชิ้น"""
+    ext = os.path.splitext(file_path)[1].lower()
+    MIN_CHARS = int(getattr(Config, "RAG_MIN_CHARS", 1))
+
     if ext == ".pdf":
-        pages = load_pdf_pages(file_path)
-        print(f"[RAG] ingest PDF: {base}, pages with text: {len(pages)}")
-        for page_no, page_text in pages:
-            chunks = [c for c in chunk_text(page_text) if c.strip()]
-            try:
-                page_offset = int(metabase.get("page_offset", 0) or 0)
-            except Exception:
-                page_offset = 0
-            meta = {
+        try:
+            page_offset = int(metabase.get("page_offset", 0) or 0)
+        except Exception:
+            page_offset = 0
+        extra = {k: v for k, v in metabase.items() if k != "page_offset"}
+        print(f"[RAG] ingest PDF: {base}")
+        blocks = (
+            (page_text, {
                 "source": base,
-                "title": os.path.splitext(base)[0],
+                "title": os.path.splitext(os.path.basename(base))[0],
                 "ext": "pdf",
                 "page": page_no,
                 "p": page_no,
                 "page_display": page_no + page_offset,
-                **{k: v for k, v in metabase.items() if k != "page_offset"},
-            }
-            for c in chunks:
-                queue(c, meta)
+                **extra,
+            })
+            for page_no, page_text in iter_pdf_pages(file_path)
+        )
     else:
-        text = load_text_from_file(file_path)
-        chunks = [c for c in chunk_text(text) if c.strip()]
-        print(f"[RAG] ingest TEXT: {base}, chunks: {len(chunks)}")
+        print(f"[RAG] ingest TEXT: {base}")
         meta = {
             "source": base,
-            "title": os.path.splitext(base)[0],
+            "title": os.path.splitext(os.path.basename(base))[0],
             "ext": ext.lstrip("."),
             **metabase
         }
-        for c in chunks:
-            queue(c, meta)
+        blocks = ((block, meta) for block in iter_text_blocks(file_path))
+
+    for block, meta in blocks:
+        for c in chunk_text(block):
+            c = _finish_chunk(c)  # block ผ่าน sanitize_text มาแล้ว
+            if c and len(c) >= MIN_CHARS:
+                yield c, meta
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
 
-    total_added = 0
-    total_queued = len(q_texts)
 
-    # ทำงานเป็นก้อน
-    for i in range(0, total_queued, BATCH):
-        texts = q_texts[i:i+BATCH]
-        metas = q_metas[i:i+BATCH]
-        print(f"[RAG] embedding batch {i//BATCH + 1} — size {len(texts)}")
+class _Prefetch:
+    """รัน generator ใน thread แยก ส่งผลผ่าน queue ที่จำกัดขนาด (backpressure ระหว่าง stage)"""
 
-        vecs = _embed_batch_or_single(texts)
+    _DONE = object()
 
+    def __init__(self, gen: Iterable, maxsize: int, name: str = "rag-prefetch"):
+        self._q: queue.Queue = queue.Queue(maxsize=max(1, maxsize))
+        self._stop = threading.Event()
+        self._finished = False
+        self._t = threading.Thread(target=self._run, args=(gen,), name=name, daemon=True)
+        self._t.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self, gen: Iterable) -> None:
+        try:
+            for item in gen:
+                if not self._put((item, None)):
+                    return
+            self._put((self._DONE, None))
+        except BaseException as e:  # ส่ง error ไปโยนต่อฝั่งผู้อ่าน
+            self._put((self._DONE, e))
+        finally:
+            close = getattr(gen, "close", None)
+            if close:
+                close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item, err = self._q.get()
+        if item is self._DONE:
+            self._finished = True
+            self._stop.set()
+            if err is not None:
+                raise err
+            raise StopIteration
+        return item
+
+    def close(self) -> None:
+        self._stop.set()
+        self._t.join(timeout=5)
+
+
+def ingest_file(file_path: str,
+                metadata: dict | None = None,
+                progress: Callable[[int, int], None] | None = None,
+                should_cancel: Callable[[], bool] | None = None,
+                collection: str = DEFAULT_COLLECTION,
+                source: str | None = None) -> dict:
+    """อ่านไฟล์ → ตัดชิ้น → embed → add ลง Chroma แบบ streaming
+
+    แต่ละ stage ต่อกันด้วย queue จำกัดขนาด: อ่าน/ตัดชิ้นใน thread แยก, embed ใน pool,
+    เขียนลง Chroma ทีละก้อนตามลำดับ → หน่วยความจำคงที่ และค้นเจอชิ้นแรก ๆ ได้ระหว่าง ingest
+    progress(done, total) ถูกเรียกหลังเขียนแต่ละก้อน (total = ชิ้นที่พบแล้ว จะนิ่งเมื่อจบไฟล์);
+    should_cancel() คืน True เมื่อไรจะหยุดและโยน IngestCancelled
+    source: ชื่อ source ใน metadata (ค่าเริ่มต้น = ชื่อไฟล์) — ingest ทั้งโฟลเดอร์ควรใช้ path สัมพัทธ์กันชื่อซ้ำ
+    """
+    base = source or os.path.basename(file_path)
+    metabase = metadata or {}
+
+    abs_dir = os.path.abspath(Config.CHROMA_DIR)
+    os.makedirs(abs_dir, exist_ok=True)
+    if not os.access(abs_dir, os.W_OK):
+        raise RuntimeError(f"CHROMA_DIR not writable: {abs_dir}")
+
+    col = get_collection(validate_collection(collection))
+
+    BATCH = int(getattr(Config, "RAG_EMBED_BATCH", 64))   # ✅ ก้อนใหญ่ขึ้นเล็กน้อย
+    workers = _embed_workers()
+    lex_index = lexical_index.get_index()
+    src_index = source_index.get_index()
+    lex_new = lex_index is not None and not lex_index.is_complete(col.name)
+    if (lex_new or not src_index.is_complete(col.name)) and col.count() == 0:
+        # collection ใหม่ → map/lexical index ครบตั้งแต่ชิ้นแรก (ไม่ต้อง backfill)
+        src_index.mark_complete(col.name)
+        if lex_new:
+            lex_index.mark_complete(col.name)
+
+    # -------- Incremental: เทียบกับชิ้นเดิมของไฟล์นี้ใน collection ----------
+    existing = _existing_chunks(col, base)
+    seen: set[str] = set()
+    meta_updates: List[tuple[str, dict]] = []
+    counts = {"queued": 0, "unchanged": 0}
+
+    def new_chunks() -> Iterator[tuple[str, str, dict]]:
+        for text, meta in _iter_chunks(file_path, base, metabase):
+            cid = chunk_id(meta.get("source", base), meta.get("page"), text)
+            if cid in seen:  # ชิ้นซ้ำเป๊ะในหน้าเดียวกัน ไม่ต้องเก็บสองรอบ
+                continue
+            seen.add(cid)
+            if cid in existing:
+                counts["unchanged"] += 1
+                if existing[cid] != meta:
+                    meta_updates.append((cid, meta))
+                continue
+            counts["queued"] += 1
+            yield cid, text, meta
+
+    total_added = 0
+    done = 0
+    if progress:
+        progress(0, 0)
+
+    def add_batch(batch: List[tuple[str, str, dict]], vecs: List[List[float] | None]) -> int:
         ids, docs, embs, out_metas = [], [], [], []
-        for t, m, v in zip(texts, metas, vecs):
+        for (cid, t, m), v in zip(batch, vecs):
             if v is None:
                 continue
-            ids.append(str(uuid.uuid4()))
+            ids.append(cid)
             docs.append(t)
             embs.append(v)
             out_metas.append(m)
 
         if not ids:
             print("[RAG] skip empty batch (all embeds failed)")
-            continue
+            return 0
 
         try:
-            col.add(ids=ids, documents=docs, embeddings=embs, metadatas=out_metas)
+            col.upsert(ids=ids, documents=docs, embeddings=embs, metadatas=out_metas)
         except UnicodeEncodeError:
             docs2 = [_SURROGATE_RE.sub("", d).replace("\x00", "") for d in docs]
-            col.add(ids=ids, documents=docs2, embeddings=embs, metadatas=out_metas)
+            col.upsert(ids=ids, documents=docs2, embeddings=embs, metadatas=out_metas)
+        if lex_index is not None:
+            lex_index.add(col.name, ids, docs, out_metas)
+        src_index.add(col.name, ids, out_metas)
+        query_cache.bump_version(col.name)
+        return len(ids)
+
+    # embed พร้อมกันไม่เกิน workers ก้อน แต่เขียนลง Chroma ตามลำดับ
+    # (หน้าต่างจำกัดไว้ที่ workers*2 เพื่อไม่ให้เวกเตอร์ค้างในหน่วยความจำมากเกินไป)
+    batches = _Prefetch(_batched(new_chunks(), BATCH), maxsize=workers * 2, name="rag-chunker")
+    pending: deque = deque()
+    n_batch = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-embed") as pool:
+            def submit_next() -> bool:
+                nonlocal n_batch
+                batch = next(batches, None)
+                if batch is None:
+                    return False
+                n_batch += 1
+                print(f"[RAG] embedding batch {n_batch} — size {len(batch)}")
+                pending.append((batch, pool.submit(_embed_batch_or_single, [t for _, t, _ in batch])))
+                return True
+
+            while len(pending) < workers * 2 and submit_next():
+                pass
+            while pending:
+                if should_cancel and should_cancel():
+                    for _, f in pending:
+                        f.cancel()
+                    print(f"[RAG] CANCELLED -> {base} after {total_added}/{counts['queued']} chunks")
+                    raise IngestCancelled(base)
+                batch, fut = pending.popleft()
+                vecs = fut.result()
+                added = add_batch(batch, vecs)
+                total_added += added
+                done += len(batch)
+                if added:
+                    print(f"[RAG] added {added} chunks (total {total_added}/{counts['queued']}+)")
+                if progress:
+                    progress(done, max(done, counts["queued"]))
+                submit_next()
+    finally:
+        batches.close()
+
+    _refresh_metadata(col, meta_updates)
+    if meta_updates:
+        src_index.add(col.name, [cid for cid, _ in meta_updates], [m for _, m in meta_updates])
+
+    # ลบชิ้นที่หายไปจากเอกสารฉบับใหม่ (ทำหลัง add ครบ เพื่อไม่ให้ค้นหาเจอช่องว่างระหว่างทาง)
+    stale_ids = [cid for cid in existing if cid not in seen]
+    for i in range(0, len(stale_ids), BATCH):
+        col.delete(ids=stale_ids[i:i+BATCH])
+    if stale_ids and lex_index is not None:
+        lex_index.delete(col.name, stale_ids)
+    if stale_ids:
+        src_index.delete(col.name, stale_ids)
+    if stale_ids:
+        query_cache.bump_version(col.name)
+    if existing:
+        print(f"[RAG] re-ingest {base}: {counts['queued']} new/changed, {counts['unchanged']} unchanged, {len(stale_ids)} stale")
+
+    if progress:
+        progress(done, done)
+    print(f"[RAG] DONE -> added {total_added} chunks to {abs_dir} ({col.name})")
+    return {"file": base, "collection": col.name, "chunks": total_added,
+            "unchanged": counts["unchanged"], "removed": len(stale_ids)}
+
+
+# ---------- Delete ----------
+
+def list_collection_names() -> List[str]:
+    return [getattr(c, "name", c) for c in get_client().list_collections()]
+
+
+def _chroma_where(where: dict) -> dict:
+    if len(where) == 1:
+        return dict(where)
+    return {"$and": [{k: v} for k, v in where.items()]}
+
+
+def _delete_ids(col, ids: List[str]) -> int:
+    """ลบตาม id จาก Chroma + lexical index + source map; คืนจำนวนเวกเตอร์ที่ลบจริง"""
+    removed = 0
+    for i in range(0, len(ids), 500):
+        part = ids[i:i+500]
+        present = col.get(ids=part, include=[]).get("ids") or []  # map อาจมี id ที่ไม่อยู่แล้ว → นับเฉพาะที่มีจริง
+        if present:
+            col.delete(ids=present)
+            removed += len(present)
+    lex_index = lexical_index.get_index()
+    if lex_index is not None:
+        lex_index.delete(col.name, ids)
+    source_index.get_index().delete(col.name, ids)
+    if removed:
+        query_cache.bump_version(col.name)
+    return removed
+
+
+def _delete_matching(where: dict, collections: List[str] | None = None) -> Dict[str, int]:
+    """ลบทุกชิ้นที่ metadata ตรงกับ where → {collection: จำนวนที่ลบ}
+    คีย์ source/filename/stored_name ใช้ source map (ลบด้วย id ตรง ๆ); คีย์อื่น scan ด้วย where ของ Chroma"""
+    if not where:
+        raise ValueError("where is required")
+    names = [validate_collection(c) for c in collections] if collections is not None else list_collection_names()
+    src_index = source_index.get_index()
+    mapped = all(k in source_index.MAPPED_KEYS for k in where)
+    out: Dict[str, int] = {}
+    for name in names:
+        try:
+            col = get_collection(name, create=False)
+        except Exception:
+            continue
+        if mapped:
+            if not src_index.is_complete(name):
+                n = source_index.backfill(col)
+                print(f"[RAG] source map backfilled {n} chunks for {name}")
+            ids = [cid for _, src in src_index.find_sources(where, [name])
+                   for cid in src_index.ids_for_source(name, src)]
+        else:
+            ids = col.get(where=_chroma_where(where), include=[]).get("ids") or []
+        if ids:
+            out[name] = _delete_ids(col, ids)
+    return out
 
-        total_added += len(ids)
-        print(f"[RAG] added {len(ids)} chunks (total {total_added}/{total_queued})")
 
-    print(f"[RAG] DONE -> added {total_added} chunks to {abs_dir}")
-    return {"file": base, "chunks": total_added}
+def delete_by_metadata(where: dict, collections: List[str] | None = None) -> int:
+    """ลบเอกสารตาม metadata (เช่น {"stored_name": "a.pdf"}) จากทุก collection (None) หรือเฉพาะที่ระบุ; คืนจำนวนเวกเตอร์ที่ลบ"""
+    removed = sum(_delete_matching(where, collections).values())
+    if removed:
+        print(f"[RAG] deleted {removed} chunks where {where}")
+    return removed
+
+
+def delete_sources(names: Iterable[str], collections: List[str] | None = None, key: str = "source") -> dict:
+    """ลบหลายไฟล์ในครั้งเดียว → {"removed": รวม, "files": {ชื่อ: จำนวน}, "collections": {collection: จำนวน}}"""
+    files: Dict[str, int] = {}
+    per_col: Dict[str, int] = {}
+    if collections is None:
+        collections = list_collection_names()
+    for name in dict.fromkeys(names):
+        counts = _delete_matching({key: name}, collections)
+        files[name] = sum(counts.values())
+        for c, n in counts.items():
+            per_col[c] = per_col.get(c, 0) + n
+    total = sum(files.values())
+    print(f"[RAG] deleted {total} chunks of {len(files)} files")
+    return {"removed": total, "files": files, "collections": per_col}
 
 
 # ---------- Search (with threshold + context control) ----------
@@ -298,79 +850,239 @@ def _normalize_vec(v):
     raise ValueError(f"[RAG] cannot normalize embedding shape: {type(v)}")
 
 
-def search(query: str, k: int | None = None) -> List[Dict[str, Any]]:
-    """คืนผลลัพธ์ที่ใกล้พอด้วย adaptive threshold; ถ้าเคร่งเกินจนว่าง ให้ fallback เป็น top-k"""
-    query = sanitize_text(query)
-    k = k or Config.RAG_TOPK_DEFAULT
+_search_pool: ThreadPoolExecutor | None = None
+_search_pool_pid: int | None = None
 
-    qvec_raw = ollama_embed(Config.EMBEDDING_MODEL, query)
-    qvec = _normalize_vec(qvec_raw)
+def _search_executor() -> ThreadPoolExecutor:
+    global _search_pool, _search_pool_pid
+    if _search_pool is None or _search_pool_pid != os.getpid():
+        with _client_lock:
+            if _search_pool is None or _search_pool_pid != os.getpid():
+                workers = max(1, int(getattr(Config, "RAG_SEARCH_WORKERS", 4)))
+                _search_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-search")
+                _search_pool_pid = os.getpid()
+    return _search_pool
 
-    col = get_collection()
-    # ดึงเยอะกว่าที่ต้องใช้ เพื่อประเมิน distribution ได้
-    n_pull = max(k * 4, 40)
+
+def _query_collection(name: str, qvec: List[float], n_pull: int,
+                      with_embeddings: bool = False) -> List[tuple[float, str, dict, str, Any]]:
+    """คืน [(distance, document, metadata, id, embedding|None)]"""
+    try:
+        col = get_collection(name, create=False)
+    except Exception:
+        return []  # ยังไม่มี collection นี้ (ผู้ใช้ยังไม่เคยอัปโหลด)
+    include = ["documents", "metadatas", "distances"]
+    if with_embeddings:
+        include.append("embeddings")  # ใช้กับ MMR เท่านั้น (ข้อมูลเยอะขึ้น)
     res = col.query(
         query_embeddings=[qvec],
         n_results=n_pull,
-        include=["documents", "metadatas", "distances"],
+        include=include,
     )
 
+    ids = res.get("ids", [[]])[0] or []
     distances = res.get("distances", [[]])[0] or []
     documents = res.get("documents", [[]])[0] or []
     metadatas = res.get("metadatas", [[]])[0] or []
+    embs = res.get("embeddings")  # อาจเป็น numpy array → ห้ามใช้ `or`
+    embeddings = embs[0] if embs is not None and len(embs) else None
+    if embeddings is None:
+        embeddings = [None] * len(ids)
 
-    # แพ็ก + กรอง none
-    items = []
-    for d, doc, md in zip(distances, documents, metadatas):
+    out = []
+    for cid, d, doc, md, emb in zip(ids, distances, documents, metadatas, embeddings):
         if d is None or not doc:
             continue
-        items.append((float(d), doc, dict(md or {})))
+        out.append((float(d), doc, {**(md or {}), "collection": name}, cid, emb))
+    return out
 
-    if not items:
-        return []
 
-    # เรียงจากใกล้สุด → ไกลสุด (สำหรับ cosine/L2 ใช้ระยะน้อยดีกว่า)
-    items.sort(key=lambda x: x[0])
+def _fetch_chunks(keys: List[tuple[str, str]]) -> Dict[tuple[str, str], tuple[str, dict]]:
+    """ดึงเนื้อหา+metadata ของ (collection, chunk_id) ที่เจอจาก lexical แต่ไม่อยู่ในผล dense"""
+    by_col: Dict[str, List[str]] = {}
+    for name, cid in keys:
+        by_col.setdefault(name, []).append(cid)
+    out: Dict[tuple[str, str], tuple[str, dict]] = {}
+    for name, ids in by_col.items():
+        try:
+            got = get_collection(name, create=False).get(ids=ids, include=["documents", "metadatas"])
+        except Exception:
+            continue
+        metas = got.get("metadatas") or [None] * len(got.get("ids") or [])
+        for cid, doc, md in zip(got.get("ids") or [], got.get("documents") or [], metas):
+            if doc:
+                out[(name, cid)] = (doc, {**(md or {}), "collection": name})
+    return out
+
 
-    # -------- Adaptive cutoff ----------
-    ds = [d for d, _, _ in items]
-    # เพอร์เซ็นไทล์ 85 สำหรับตัดหาง และคุมเพดานเบา ๆ เผื่อคอลเลกชันใช้ space ต่างกัน
-    import math
-    def pct(arr, p):
-        i = max(0, min(len(arr)-1, int(math.ceil(p * len(arr)) - 1)))
-        return sorted(arr)[i]
+def _lexical_items(lex: List[tuple[str, str, float]]) -> List[tuple[float | None, str, dict, str, None]]:
+    found = _fetch_chunks([(name, cid) for name, cid, _ in lex])
+    return [(None, *found[(name, cid)], cid, None) for name, cid, _ in lex if (name, cid) in found]
 
-    p85 = pct(ds, 0.85)
 
-    # ถ้าเคยตั้ง Config.RAG_MAX_DISTANCE ให้ใช้ min ระหว่าง p85 กับค่านั้น; ถ้าไม่ได้ตั้งให้ใช้ p85 ไปเลย
-    hard = getattr(Config, "RAG_MAX_DISTANCE", None)
-    cutoff = min(p85, hard) if isinstance(hard, (int, float)) and hard > 0 else p85
+def _lexical_floor(lex: List[tuple[str, str, float]]) -> List[tuple[str, str, float]]:
+    floor = float(getattr(Config, "RAG_LEXICAL_MIN_SCORE", 0.25))
+    return [hit for hit in lex if hit[2] >= floor]
 
-    # กรองตาม cutoff
-    filtered = [(d, doc, md) for (d, doc, md) in items if d <= cutoff]
 
-    # ถ้ากรองแล้วน้อย/ว่าง → fallback: ใช้ top-k ตรง ๆ
-    chosen = filtered if len(filtered) >= max(1, k) else items[:max(1, k)]
+def _fuse(dense: List[tuple], lex: List[tuple[str, str, float]]) -> List[tuple]:
+    """รวมอันดับ dense (ผ่าน cutoff แล้ว) กับ BM25 ด้วย reciprocal-rank fusion
+    ชิ้นที่เจอจาก BM25 อย่างเดียวต้องผ่าน RAG_LEXICAL_MIN_SCORE (ไม่งั้นคำค้นไทยที่มีคำพื้น ๆ จะดึงชิ้นมั่ว ๆ มาแทนที่ cutoff)"""
+    by_key = {(it[2].get("collection"), it[3]): it for it in dense}
+    ranking_dense = list(by_key)
+    strong = {(name, cid) for name, cid, _ in _lexical_floor(lex)}
+    ranking_lex = [key for key in ((name, cid) for name, cid, _ in lex) if key in by_key or key in strong]
+    missing = [key for key in ranking_lex if key not in by_key]
+    for key, (doc, md) in _fetch_chunks(missing).items():
+        by_key[key] = (None, doc, md, key[1], None)
+    fused = lexical_index.rrf([ranking_dense, [key for key in ranking_lex if key in by_key]])
+    return [by_key[key] for key in fused]
+
 
-    # -------- Trim per-doc & whole-context ----------
+def search(query: str, k: int | None = None, collections: List[str] | None = None,
+           trim: bool = True) -> List[Dict[str, Any]]:
+    """คืนผลลัพธ์ที่ใกล้พอด้วย adaptive threshold; ถ้าเคร่งเกินจนว่าง ให้ fallback เป็น top-k
+    ค้นหลาย collection พร้อมกันได้ แล้วรวมผลตามระยะ (ทุก collection ใช้ cosine space เดียวกัน)
+    ถ้าเปิด RAG_HYBRID จะค้น BM25 คู่กันแล้วรวมด้วย RRF; คำค้นที่เป็นรหัสล้วนและเจอ lexical แล้วจะไม่ embed เลย
+    trim=False คืนเนื้อหาเต็มของแต่ละชิ้น (ให้ผู้เรียกจัดงบ token เอง เช่น build_augmented_messages)"""
+    query = sanitize_text(query)
+    k = k or Config.RAG_TOPK_DEFAULT
+    names = collections or [DEFAULT_COLLECTION]
+
+    cached = query_cache.get(query, k, names)
+    if cached is not None:
+        return _trim_chars(cached) if trim else cached
+    versions = query_cache.snapshot(names)
+
+    # ดึงเยอะกว่าที่ต้องใช้ เพื่อประเมิน distribution ได้
+    n_pull = max(k * 4, 40)
+
+    lex: List[tuple[str, str, float]] = []
+    index = lexical_index.get_index()
+    if index is not None:
+        try:
+            # collection ที่ index ยังไม่ครบ (ข้อมูลก่อนมี index) → backfill เบื้องหลัง ระหว่างนั้นค้น dense อย่างเดียว
+            lex_names = lexical_index.ensure_backfilled(names, get_collection)
+            if lex_names:
+                lex = index.search(query, lex_names, n_pull)
+        except Exception as e:
+            print(f"[RAG] lexical search failed: {e}")
+
+    exact = _lexical_floor(lex) if lex and lexical_index.looks_like_code(query) else []
+    if exact:
+        # exact-match (รหัสสินค้า/เลขข้อ): BM25 แม่นกว่า dense อยู่แล้ว ข้ามการ embed ไปเลย
+        chosen = _lexical_items(exact[:k])
+    else:
+        qvec_raw = _embed_batch_or_single([query])[0]
+        if qvec_raw is None:
+            raise RuntimeError(f"cannot embed query with model '{Config.EMBEDDING_MODEL}'")
+        qvec = _normalize_vec(qvec_raw)
+
+        use_mmr = bool(getattr(Config, "RAG_MMR", False))
+        if len(names) == 1:
+            items = _query_collection(names[0], qvec, n_pull, use_mmr)
+        else:
+            futs = [_search_executor().submit(_query_collection, n, qvec, n_pull, use_mmr) for n in names]
+            items = [it for f in futs for it in f.result()]
+
+        chosen = _adaptive_cutoff(items, k) if items else []
+        if use_mmr and len(chosen) > 1:
+            chosen = _mmr(chosen, qvec, k)
+        if lex:
+            chosen = _fuse(chosen, lex)
+
+    if not chosen:
+        query_cache.put(query, k, names, [], versions)
+        return []
+
+    # ตัดเหลือ k ชิ้น (cache เนื้อหาเต็ม แล้วค่อย trim ตามผู้เรียก)
+    hits: List[Dict[str, Any]] = [
+        {"id": cid, "document": doc or "", "metadata": md, "distance": d}
+        for d, doc, md, cid, _ in chosen[:k]
+    ]
+    query_cache.put(query, k, names, hits, versions)
+    return _trim_chars(hits) if trim else hits
+
+
+def _trim_chars(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """จำกัดความยาวต่อชิ้น & รวมทั้งหมดด้วยจำนวนตัวอักษร (สำหรับ /search)
+    ชิ้นที่ไม่พอดีจะถูกข้าม แล้วลองชิ้นถัดไปต่อ แทนการหยุดที่ชิ้นแรกที่เกิน"""
     max_per = getattr(Config, "RAG_MAX_DOC_CHARS", 1200)
     max_all = getattr(Config, "RAG_MAX_CONTEXT_CHARS", 4000)
-
-    hits: List[Dict[str, Any]] = []
+    out: List[Dict[str, Any]] = []
     total = 0
-    for d, doc, md in chosen:
-        snippet = (doc or "")[:max_per]
+    for h in hits:
+        snippet = h["document"][:max_per]
         if total + len(snippet) > max_all:
-            break
-        hits.append({
-            "document": snippet,
-            "metadata": md,
-            "distance": d,
-        })
+            continue
+        out.append({**h, "document": snippet})
         total += len(snippet)
+    return out
+
+
+# ต่ำกว่านี้ sort ของ Python เร็วกว่า NumPy (ค่าแปลงเป็น array ไม่คุ้ม): วัดด้วย scripts/bench_rank.py
+# 40 ชิ้น ≈ 9 vs 18 µs, 200 ≈ 29 vs 37 µs, 1000 ≈ 190 vs 170 µs — ปกติ n_pull ต่อคลังแค่ 40–160
+_NUMPY_CUTOFF_MIN = 1000
+
+
+def _adaptive_cutoff(items: List[tuple], k: int) -> List[tuple]:
+    """เรียงตามระยะ แล้วตัดหางด้วย min(p85, RAG_MAX_DISTANCE); ถ้าเหลือน้อยกว่า k ใช้ top-k ตรง ๆ"""
+    # เรียงจากใกล้สุด → ไกลสุด (stable: ระยะเท่ากันคงลำดับเดิม)
+    if len(items) >= _NUMPY_CUTOFF_MIN:
+        ds = np.fromiter((it[0] for it in items), dtype=np.float64, count=len(items))
+        order = np.argsort(ds, kind="stable")
+        ds_sorted = ds[order]
+        items = [items[i] for i in order]
+    else:
+        items = sorted(items, key=lambda x: x[0])
+        ds_sorted = [it[0] for it in items]
+
+    # -------- Adaptive cutoff ----------
+    # เพอร์เซ็นไทล์ 85 สำหรับตัดหาง และคุมเพดานเบา ๆ เผื่อคอลเลกชันใช้ space ต่างกัน
+    n = len(ds_sorted)
+    p85 = ds_sorted[max(0, min(n - 1, int(math.ceil(0.85 * n)) - 1))]
+
+    # ถ้าเคยตั้ง Config.RAG_MAX_DISTANCE ให้ใช้ min ระหว่าง p85 กับค่านั้น; ถ้าไม่ได้ตั้งให้ใช้ p85 ไปเลย
+    hard = getattr(Config, "RAG_MAX_DISTANCE", None)
+    cutoff = min(p85, hard) if isinstance(hard, (int, float)) and hard > 0 else p85
 
-    # ตัดเหลือ k ชิ้น
-    return hits[:k]
+    # กรองตาม cutoff (ds_sorted เรียงแล้ว → หาจุดตัดด้วย binary search)
+    n_keep = bisect.bisect_right(ds_sorted, cutoff)
+
+    # ถ้ากรองแล้วน้อย/ว่าง → fallback: ใช้ top-k ตรง ๆ
+    return items[:max(n_keep, 1, k)]
+
+
+def _mmr(items: List[tuple], qvec: List[float], k: int) -> List[tuple]:
+    """Maximal marginal relevance: เลือกชิ้นที่ใกล้คำถามแต่ไม่ซ้ำกับที่เลือกไปแล้ว
+    ชิ้นที่คล้ายชิ้นที่เลือกแล้วเกิน RAG_MMR_DUP_SIM จะถูกทิ้ง (เช่น chunk overlap หน้าเดียวกัน)
+    ชิ้นที่ไม่มี embedding เทียบความซ้ำไม่ได้ → เก็บไว้ต่อท้ายตามลำดับเดิม"""
+    with_emb = [it for it in items if it[4] is not None]
+    no_emb = [it for it in items if it[4] is None]
+    if len(with_emb) < 2:
+        return with_emb + no_emb
+    lam = float(getattr(Config, "RAG_MMR_LAMBDA", 0.7))
+    dup = float(getattr(Config, "RAG_MMR_DUP_SIM", 0.95))
+
+    E = np.asarray([it[4] for it in with_emb], dtype=np.float32)
+    E /= np.maximum(np.linalg.norm(E, axis=1, keepdims=True), 1e-12)
+    q = np.asarray(qvec, dtype=np.float32)
+    q /= max(float(np.linalg.norm(q)), 1e-12)
+    rel = E @ q
+
+    n = len(with_emb)
+    selected: List[int] = []
+    max_sim = np.full(n, -np.inf, dtype=np.float32)  # ความคล้ายสูงสุดกับชิ้นที่เลือกแล้ว
+    alive = np.ones(n, dtype=bool)
+    while len(selected) < min(k, n) and alive.any():
+        score = lam * rel - (1.0 - lam) * np.where(np.isfinite(max_sim), max_sim, 0.0)
+        score[~alive] = -np.inf
+        j = int(np.argmax(score))
+        selected.append(j)
+        alive[j] = False
+        max_sim = np.maximum(max_sim, E @ E[j])
+        alive &= max_sim < dup
+    return [with_emb[j] for j in selected] + no_emb
 
 
 # ---------- Compose augmented messages ----------
@@ -403,10 +1115,18 @@ def _display_page(md: dict) -> int | None:
         offset = 0
     return page + offset
 
-def build_augmented_messages(user_message: str, topk: int | None = None) -> tuple[list[dict], list[str]]:
-    """สร้าง messages + คืน sources เพื่อเอาไปแสดง citation ได้"""
+def build_augmented_messages(user_message: str,
+                             topk: int | None = None,
+                             collections: List[str] | None = None,
+                             history: List[Dict[str, str]] | None = None,
+                             model: str | None = None) -> tuple[list[dict], list[str]]:
+    """สร้าง messages + คืน sources เพื่อเอาไปแสดง citation ได้
+    จัดบริบทตามงบ token ของโมเดล (context window − ที่เผื่อคำตอบ) โดยนับ history ในงบเดียวกัน:
+    history ล่าสุดได้ไม่เกิน RAG_HISTORY_MAX_SHARE ของงบ, ชิ้นความรู้เติมแบบ greedy, เหลือเท่าไหร่คืนให้ history"""
     topk = topk or Config.RAG_TOPK_DEFAULT
-    hits = search(user_message, k=topk)
+    history = list(history or [])
+    hits = search(user_message, k=topk, collections=collections, trim=False)
+    budget = token_budget.prompt_budget(model)
 
     # ถ้าไม่มีชิ้นไหน 'ใกล้พอ' ให้บอกผู้ใช้ตรงๆ
     if not hits:
@@ -414,15 +1134,16 @@ def build_augmented_messages(user_message: str, topk: int | None = None) -> tupl
             "คุณคือผู้ช่วยที่ตอบจากคลังความรู้เท่านั้น แต่ตอนนี้ไม่พบชิ้นข้อมูลที่เกี่ยวข้องมากพอ "
             "ตอบว่า 'ไม่พบข้อมูลในคลังความรู้ — โปรดลองอัปโหลดเอกสารเพิ่มเติม' โดยไม่เดา"
         )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"คำถาม:\n{user_message}"},
-        ]
-        return messages, []
-
-    context_blocks: List[str] = []
-    sources: list[str] = []
-    for i, h in enumerate(hits):
+        system_msg = {"role": "system", "content": system_prompt}
+        user_msg = {"role": "user", "content": f"คำถาม:\n{user_message}"}
+        fixed = token_budget.message_tokens(system_msg) + token_budget.message_tokens(user_msg)
+        hist, _ = token_budget.fit_history(history, budget - fixed)
+        return [system_msg, *hist, user_msg], []
+
+    max_doc_tokens = int(getattr(Config, "RAG_MAX_DOC_TOKENS", 512))
+    tags: List[str] = []
+    bodies: List[str] = []
+    for h in hits:
         md = h["metadata"] or {}
         src = md.get("source") or md.get("file") or "document"
         page_disp = _display_page(md)
@@ -437,23 +1158,40 @@ def build_augmented_messages(user_message: str, topk: int | None = None) -> tupl
         else:
             tag = short_src
 
-        sources.append(tag)
-        context_blocks.append(f"[DOC {i+1} • {tag}]\n{h['document']}")
-
-    context = "\n\n".join(context_blocks)
+        tags.append(tag)
+        bodies.append(token_budget.truncate(h["document"], max_doc_tokens))
 
     system_prompt = (
         "คุณคือผู้ช่วยที่ตอบจาก 'บริบทความรู้' ที่ให้เท่านั้น "
         "ห้ามเดาคำตอบนอกเหนือจากบริบท หากไม่พอ ให้บอกว่าไม่พบข้อมูลในคลังความรู้ "
         "ให้ตอบไทย กระชับ และอ้างอิงชื่อไฟล์ที่ใช้ประกอบคำตอบ"
     )
+    system_msg = {"role": "system", "content": system_prompt}
+
+    # -------- งบ token: system + คำถาม (คงที่) → history (มีเพดาน) → บริบท → history ส่วนที่เหลือ ----------
+    fixed = (
+        token_budget.message_tokens(system_msg)
+        + token_budget.count_tokens(f"บริบทความรู้:\n\n\nคำถาม:\n{user_message}")
+        + token_budget.MSG_OVERHEAD
+    )
+    free = max(0, budget - fixed)
+    share = float(getattr(Config, "RAG_HISTORY_MAX_SHARE", 0.4))
+    _, hist_used = token_budget.fit_history(history, int(free * share))
+
+    # เลข DOC ใช้ตำแหน่งในผลค้น (header ยาวเท่ากันก่อน/หลังเลือก จึงนับ token ได้ตรง)
+    blocks = [f"[DOC {i+1} • {tag}]\n{body}" for i, (tag, body) in enumerate(zip(tags, bodies))]
+    picked, ctx_used = token_budget.pack_blocks(blocks, free - hist_used)
+    hist, _ = token_budget.fit_history(history, free - ctx_used)
+
+    context = "\n\n".join(blocks[i] for i in picked)
     user_prompt = f"บริบทความรู้:\n{context}\n\nคำถาม:\n{user_message}"
 
     messages = [
-        {"role": "system", "content": system_prompt},
+        system_msg,
+        *hist,
         {"role": "user", "content": user_prompt},
     ]
 
     # ลบซ้ำ: รักษาลำดับไว้
-    dedup_sources = list(dict.fromkeys(sources))
+    dedup_sources = list(dict.fromkeys(tags[i] for i in picked))
     return messages, dedup_sources
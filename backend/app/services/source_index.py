@@ -0,0 +1,168 @@
+from __future__ import annotations
+import os, sqlite3, threading, time
+from typing import Dict, Iterable, List, Sequence
+
+from ..config import Config
+
+# ---------- Source → chunk-id map (SQLite ข้าง CHROMA_DIR) ----------
+# เขียนระหว่าง ingest_file: รู้ว่าไฟล์หนึ่งมีชิ้นไหนบ้างใน collection ไหน
+# → ลบเอกสารด้วย col.delete(ids=...) ตรง ๆ ไม่ต้อง scan metadata ทั้ง collection
+# collection ที่มีข้อมูลก่อนมี map จะถูก backfill จาก Chroma ครั้งแรกที่ลบ (ดู rag.delete_by_metadata)
+
+# คีย์ metadata ที่ map รู้จัก (คีย์อื่นต้อง scan ใน Chroma แทน)
+MAPPED_KEYS = ("source", "filename", "stored_name")
+
+
+class SourceIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as c:
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " collection TEXT NOT NULL, chunk_id TEXT NOT NULL, source TEXT NOT NULL,"
+                " PRIMARY KEY(collection, chunk_id))"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS ix_chunks_source ON chunks(collection, source)")
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS sources ("
+                " collection TEXT NOT NULL, source TEXT NOT NULL, filename TEXT, stored_name TEXT,"
+                " updated_at REAL NOT NULL, PRIMARY KEY(collection, source))"
+            )
+            c.execute("CREATE INDEX IF NOT EXISTS ix_sources_filename ON sources(filename)")
+            c.execute("CREATE INDEX IF NOT EXISTS ix_sources_stored_name ON sources(stored_name)")
+            # collection ที่ map ครบแล้ว (ว่างตอนเริ่ม ingest หรือ backfill แล้ว)
+            c.execute("CREATE TABLE IF NOT EXISTS complete (collection TEXT PRIMARY KEY)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._pid = os.getpid()
+        return conn
+
+    # ---- เขียน ----
+
+    def add(self, collection: str, ids: Sequence[str], metas: Sequence[dict]) -> None:
+        conn = self._conn()
+        now = time.time()
+        seen: Dict[str, dict] = {}
+        rows = []
+        for cid, md in zip(ids, metas):
+            md = md or {}
+            src = md.get("source")
+            if not src:
+                continue
+            rows.append((collection, cid, src))
+            seen.setdefault(src, md)
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO chunks(collection, chunk_id, source) VALUES (?,?,?)", rows)
+            conn.executemany(
+                "INSERT INTO sources(collection, source, filename, stored_name, updated_at) VALUES (?,?,?,?,?)"
+                " ON CONFLICT(collection, source) DO UPDATE SET"
+                " filename=excluded.filename, stored_name=excluded.stored_name, updated_at=excluded.updated_at",
+                [(collection, src, md.get("filename"), md.get("stored_name"), now) for src, md in seen.items()],
+            )
+
+    def delete(self, collection: str, ids: Sequence[str]) -> None:
+        """ลบ chunk id ออกจาก map (source ที่ไม่เหลือชิ้นแล้วจะถูกลบตาม)"""
+        conn = self._conn()
+        ids = list(ids)
+        with conn:
+            touched: set[str] = set()
+            for i in range(0, len(ids), 500):
+                part = ids[i:i+500]
+                marks = ",".join("?" * len(part))
+                touched.update(s for (s,) in conn.execute(
+                    f"SELECT DISTINCT source FROM chunks WHERE collection=? AND chunk_id IN ({marks})",
+                    (collection, *part),
+                ))
+                conn.execute(f"DELETE FROM chunks WHERE collection=? AND chunk_id IN ({marks})", (collection, *part))
+            for src in touched:
+                conn.execute(
+                    "DELETE FROM sources WHERE collection=? AND source=?"
+                    " AND NOT EXISTS (SELECT 1 FROM chunks WHERE collection=? AND source=?)",
+                    (collection, src, collection, src),
+                )
+
+    def drop_sources(self, collection: str, sources: Iterable[str]) -> None:
+        conn = self._conn()
+        with conn:
+            for src in sources:
+                conn.execute("DELETE FROM chunks WHERE collection=? AND source=?", (collection, src))
+                conn.execute("DELETE FROM sources WHERE collection=? AND source=?", (collection, src))
+
+    def drop_collection(self, collection: str) -> None:
+        conn = self._conn()
+        with conn:
+            for table in ("chunks", "sources", "complete"):
+                conn.execute(f"DELETE FROM {table} WHERE collection=?", (collection,))
+
+    def mark_complete(self, collection: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO complete(collection) VALUES (?)", (collection,))
+
+    # ---- อ่าน ----
+
+    def is_complete(self, collection: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM complete WHERE collection=?", (collection,)).fetchone() is not None
+
+    def find_sources(self, where: Dict[str, object], collections: Sequence[str] | None = None) -> List[tuple[str, str]]:
+        """[(collection, source)] ที่ตรงกับ where (ทุกคีย์ต้องอยู่ใน MAPPED_KEYS)"""
+        if not where or any(k not in MAPPED_KEYS for k in where):
+            raise ValueError(f"source index supports only {MAPPED_KEYS}")
+        clauses = [f"{k}=?" for k in where]
+        params: list = list(where.values())
+        if collections:
+            clauses.append(f"collection IN ({','.join('?' * len(collections))})")
+            params.extend(collections)
+        return [(c, s) for c, s in self._conn().execute(
+            f"SELECT collection, source FROM sources WHERE {' AND '.join(clauses)}", params
+        )]
+
+    def ids_for_source(self, collection: str, source: str) -> List[str]:
+        return [cid for (cid,) in self._conn().execute(
+            "SELECT chunk_id FROM chunks WHERE collection=? AND source=?", (collection, source)
+        )]
+
+    def count(self, collection: str | None = None) -> int:
+        if collection is None:
+            (n,) = self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()
+        else:
+            (n,) = self._conn().execute("SELECT COUNT(*) FROM chunks WHERE collection=?", (collection,)).fetchone()
+        return n
+
+
+_index: SourceIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SourceIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SourceIndex(Config.SOURCE_INDEX_PATH)
+    return _index
+
+
+def backfill(col) -> int:
+    """เติม map ของ collection จากเอกสารใน Chroma (ข้อมูลที่ ingest ก่อนมี map) แล้วถือว่าครบ"""
+    idx = get_index()
+    total, offset, page = 0, 0, 1000
+    while True:
+        got = col.get(include=["metadatas"], limit=page, offset=offset)
+        ids = got.get("ids") or []
+        if not ids:
+            break
+        idx.add(col.name, ids, got.get("metadatas") or [{}] * len(ids))
+        total += len(ids)
+        offset += len(ids)
+    idx.mark_complete(col.name)
+    return total
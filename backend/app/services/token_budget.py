@@ -0,0 +1,122 @@
+from __future__ import annotations
+import logging, math, os, threading
+from typing import Dict, List, Sequence
+
+from ..config import Config
+
+# ---------- นับ token สำหรับจัดบริบทให้พอดี context window ----------
+# ใช้ tokenizer ของ HF `tokenizers` จากไฟล์ในเครื่อง (RAG_TOKENIZER = path ของ tokenizer.json ของโมเดลแชท)
+# ไม่ดาวน์โหลดจาก hub ตอนรับคำขอ; ไม่มีไฟล์/โหลดไม่ได้ → เตือนครั้งเดียวแล้วใช้ค่าประมาณแบบเผื่อไว้:
+# ASCII ~4 ตัว/token, อักษรอื่น (เช่นไทย) ~2 ตัว/token
+
+logger = logging.getLogger(__name__)
+
+MSG_OVERHEAD = 4  # token ของ role/ตัวคั่นต่อ message ใน chat template
+
+_tok = None
+_tok_loaded = False
+_tok_lock = threading.Lock()
+
+
+def _tokenizer():
+    global _tok, _tok_loaded
+    if _tok_loaded:
+        return _tok
+    with _tok_lock:
+        if _tok_loaded:
+            return _tok
+        path = (getattr(Config, "RAG_TOKENIZER", "") or "").strip()
+        if not path or not os.path.isfile(path):
+            logger.warning("RAG_TOKENIZER file not found (%r) — token counts are length estimates; "
+                           "put the chat model's tokenizer.json there for exact budgets", path)
+        else:
+            try:
+                from tokenizers import Tokenizer
+                _tok = Tokenizer.from_file(path)
+            except Exception as e:
+                logger.error("Cannot load tokenizer %s (%s) — token counts are length estimates", path, e)
+                _tok = None
+        _tok_loaded = True
+    return _tok
+
+
+def _estimate(text: str) -> int:
+    n_ascii = sum(1 for ch in text if ch < "\x80")
+    return math.ceil(n_ascii / 4 + (len(text) - n_ascii) / 2)
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tok = _tokenizer()
+    if tok is None:
+        return _estimate(text)
+    return len(tok.encode(text, add_special_tokens=False).ids)
+
+
+def count_many(texts: Sequence[str]) -> List[int]:
+    tok = _tokenizer()
+    if tok is None:
+        return [_estimate(t) for t in texts]
+    return [len(e.ids) for e in tok.encode_batch(list(texts), add_special_tokens=False)]
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """ตัดข้อความให้เหลือไม่เกิน max_tokens (ตัดตรงขอบ token ตาม offset ของ tokenizer)"""
+    if max_tokens <= 0:
+        return ""
+    tok = _tokenizer()
+    if tok is None:
+        if _estimate(text) <= max_tokens:
+            return text
+        # ค้นแบบ binary หาความยาวตัวอักษรที่ประมาณแล้วไม่เกินงบ
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _estimate(text[:mid]) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:lo]
+    enc = tok.encode(text, add_special_tokens=False)
+    if len(enc.ids) <= max_tokens:
+        return text
+    return text[:enc.offsets[max_tokens - 1][1]]
+
+
+def message_tokens(msg: Dict[str, str]) -> int:
+    return count_tokens(msg.get("content") or "") + MSG_OVERHEAD
+
+
+def prompt_budget(model: str | None) -> int:
+    """งบ token ของ prompt ทั้งหมด = context window ของโมเดล − ที่เผื่อไว้ให้คำตอบ"""
+    from .model_registry import context_length
+    window = context_length(model)
+    reserve = int(getattr(Config, "RAG_ANSWER_RESERVE_TOKENS", 768))
+    return max(256, window - reserve)
+
+
+def fit_history(history: Sequence[Dict[str, str]], budget: int) -> tuple[List[Dict[str, str]], int]:
+    """เก็บ history ล่าสุดย้อนหลังไปเรื่อย ๆ จนเต็มงบ (ข้อความที่ใหม่กว่าสำคัญกว่า) คืน (history, token ที่ใช้)"""
+    costs = count_many([m.get("content") or "" for m in history])
+    used, start = 0, len(history)
+    for i in range(len(history) - 1, -1, -1):
+        c = costs[i] + MSG_OVERHEAD
+        if used + c > budget:
+            break
+        used += c
+        start = i
+    return list(history[start:]), used
+
+
+def pack_blocks(blocks: Sequence[str], budget: int) -> tuple[List[int], int]:
+    """เลือก block ตามลำดับความเกี่ยวข้องแบบ greedy: ชิ้นไหนไม่พอดีก็ข้ามไปดูชิ้นถัดไป (ไม่หยุดทันที)
+    คืน (index ของ block ที่เลือก, token ที่ใช้)"""
+    chosen: List[int] = []
+    used = 0
+    for i, c in enumerate(count_many(blocks)):
+        c += 2  # "\n\n" ระหว่าง block
+        if used + c <= budget:
+            chosen.append(i)
+            used += c
+    return chosen, used
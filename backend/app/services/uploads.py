@@ -0,0 +1,282 @@
+from __future__ import annotations
+import os, re, json, time, uuid, hashlib, threading
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: ไม่มี flock → กันชนกันได้เฉพาะภายใน process (_busy)
+    fcntl = None
+
+from werkzeug.utils import secure_filename
+
+from ..config import Config
+
+# ---------- Streamed / resumable upload ----------
+# body ถูกเขียนลงดิสก์ทีละก้อน (UPLOAD_CHUNK_BYTES) พร้อม hash sha256 ไปด้วย ไม่ buffer ทั้งไฟล์
+# ไฟล์ระหว่างอัปโหลดอยู่ที่ UPLOAD_DIR/.partial/<id>.part (+ <id>.json ข้อมูล session)
+# offset = ขนาด .part ปัจจุบัน → หลุดกลางทางก็ส่งต่อจาก offset เดิมได้
+# สถานะ hash อยู่ในหน่วยความจำของ process; ถ้าไม่มี (restart/คนละ worker) จะ hash ส่วนที่มีอยู่ใหม่ครั้งเดียว
+# การเขียน/ย้าย .part ถือ flock ของไฟล์นั้น → คำขอเดียวกันที่เข้าคนละ worker ไม่เขียนทับกัน
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_lock = threading.Lock()
+_busy: set[str] = set()
+_hashers: Dict[str, tuple[int, "hashlib._Hash"]] = {}
+
+
+class UploadError(Exception):
+    """คำขออัปโหลดไม่ถูกต้อง → ตอบเป็น JSON {"error": ..., (code), ...extra} พร้อม status"""
+
+    def __init__(self, message: str, status: int = 400, code: str | None = None, **extra):
+        super().__init__(message)
+        self.message, self.status, self.code, self.extra = message, status, code, extra
+
+    def payload(self) -> dict:
+        return {"error": self.message, **({"code": self.code} if self.code else {}), **self.extra}
+
+
+def _chunk_bytes() -> int:
+    return max(64 * 1024, int(getattr(Config, "UPLOAD_CHUNK_BYTES", 1024 * 1024)))
+
+
+def max_bytes() -> int:
+    return int(getattr(Config, "MAX_UPLOAD_MB", 50)) * 1024 * 1024
+
+
+def _dir() -> str:
+    path = os.path.join(Config.UPLOAD_DIR, ".partial")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _paths(upload_id: str) -> tuple[str, str]:
+    base = os.path.join(_dir(), upload_id)
+    return base + ".part", base + ".json"
+
+
+def _write_meta(meta: dict) -> None:
+    _, meta_path = _paths(meta["id"])
+    tmp = meta_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, meta_path)
+
+
+def _discard(upload_id: str) -> None:
+    _hashers.pop(upload_id, None)
+    for p in _paths(upload_id):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def _claim(upload_id: str) -> Iterator[int]:
+    """ล็อก .part แบบ exclusive (flock ข้าม process/worker) ตลอดการเขียนหรือย้ายไฟล์ → yield fd ที่เปิดแบบ append
+    มีคนถืออยู่ → 409 BUSY (ไม่รอ: client ถาม offset แล้วส่งใหม่เอง)"""
+    part, _ = _paths(upload_id)
+    with _lock:
+        if upload_id in _busy:
+            raise UploadError("upload is busy", 409, code="BUSY")
+        _busy.add(upload_id)
+    try:
+        try:
+            fd = os.open(part, os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            raise UploadError("upload not found", 404)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError("upload is busy", 409, code="BUSY")
+            # ระหว่างรอล็อก ผู้ถือก่อนหน้าอาจ finalize/abort ไปแล้ว (fd ชี้ไฟล์ที่ถูกย้าย/ลบ)
+            try:
+                same = os.path.samestat(os.fstat(fd), os.stat(part))
+            except FileNotFoundError:
+                same = False
+            if not same:
+                raise UploadError("upload not found", 404)
+            yield fd
+        finally:
+            os.close(fd)  # ปิด fd = ปล่อย flock
+    finally:
+        with _lock:
+            _busy.discard(upload_id)
+
+
+def sweep() -> int:
+    """ลบ session ที่ไม่มีความเคลื่อนไหวเกิน UPLOAD_SESSION_TTL_HOURS"""
+    cutoff = time.time() - float(getattr(Config, "UPLOAD_SESSION_TTL_HOURS", 24)) * 3600
+    removed = 0
+    for fn in os.listdir(_dir()):
+        upload_id, ext = os.path.splitext(fn)
+        full = os.path.join(_dir(), fn)
+        try:
+            if ext == ".tmp" and os.path.getmtime(full) < cutoff:  # HashedSpool ที่ค้างจาก process ที่ตายไป
+                os.remove(full)
+            elif ext == ".json" and os.path.getmtime(full) < cutoff:
+                try:
+                    with _claim(upload_id):
+                        _discard(upload_id)
+                except UploadError as e:
+                    if e.status != 404:
+                        continue  # มี worker กำลังเขียนอยู่
+                    _discard(upload_id)  # .part หายไปแล้ว เหลือแต่ .json
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def create(filename: str, size: int, collection: str, sha256: str | None = None, uid: int | None = None) -> dict:
+    if size <= 0:
+        raise UploadError("size must be > 0")
+    if size > max_bytes():
+        raise UploadError("file too large", 413, max_mb=Config.MAX_UPLOAD_MB)
+    sweep()
+    meta = {
+        "id": uuid.uuid4().hex,
+        "filename": filename,
+        "stored_name": secure_filename(filename),
+        "size": int(size),
+        "sha256": (sha256 or "").lower() or None,
+        "collection": collection,
+        "uid": uid,
+        "created_at": time.time(),
+    }
+    part, _ = _paths(meta["id"])
+    open(part, "wb").close()
+    _write_meta(meta)
+    return meta
+
+
+def load(upload_id: str, uid: int | None = None) -> dict:
+    if not _ID_RE.match(upload_id or ""):
+        raise UploadError("upload not found", 404)
+    _, meta_path = _paths(upload_id)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        raise UploadError("upload not found", 404)
+    if meta.get("uid") is not None and meta["uid"] != uid:
+        raise UploadError("upload not found", 404)
+    return meta
+
+
+def offset(meta: dict) -> int:
+    part, _ = _paths(meta["id"])
+    try:
+        return os.path.getsize(part)
+    except FileNotFoundError:
+        raise UploadError("upload not found", 404)
+
+
+def status(meta: dict) -> dict:
+    done = offset(meta)
+    return {
+        "id": meta["id"],
+        "filename": meta["filename"],
+        "collection": meta["collection"],
+        "size": meta["size"],
+        "offset": done,
+        "complete": done >= meta["size"],
+        "chunk_size": int(getattr(Config, "UPLOAD_CLIENT_CHUNK_MB", 8)) * 1024 * 1024,
+    }
+
+
+def _hasher(upload_id: str, part: str, at: int):
+    cached = _hashers.get(upload_id)
+    if cached and cached[0] == at:
+        return cached[1]
+    h = hashlib.sha256()
+    with open(part, "rb") as f:
+        for block in iter(lambda: f.read(_chunk_bytes()), b""):
+            h.update(block)
+    return h
+
+
+def append(meta: dict, stream: BinaryIO, at: int, length: int | None = None) -> int:
+    """เขียน body ต่อท้ายที่ offset `at` (ต้องตรงกับขนาดปัจจุบัน) → คืน offset ใหม่"""
+    upload_id = meta["id"]
+    with _claim(upload_id) as fd:
+        part, _ = _paths(upload_id)
+        current = os.fstat(fd).st_size  # อ่านหลังได้ล็อก: ไม่มีใครเขียนเพิ่มจนกว่าจะปล่อย
+        if at != current:
+            raise UploadError("offset mismatch", 409, code="OFFSET_MISMATCH", offset=current)
+        remaining = meta["size"] - current
+        if length is not None and length > remaining:
+            raise UploadError("chunk exceeds declared size", 400, offset=current)
+
+        h = _hasher(upload_id, part, current)
+        size = _chunk_bytes()
+        written = current
+        try:
+            with open(fd, "ab", closefd=False) as f:
+                while remaining > 0:
+                    block = stream.read(min(size, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    h.update(block)
+                    written += len(block)
+                    remaining -= len(block)
+        finally:
+            # หลุดกลางก้อน: ส่วนที่เขียนแล้วยังอยู่ → client ถาม offset แล้วส่งต่อได้
+            _hashers[upload_id] = (written, h)
+        os.utime(_paths(upload_id)[1], None)  # ต่ออายุ session
+        return written
+
+
+def digest(meta: dict) -> str:
+    part, _ = _paths(meta["id"])
+    return _hasher(meta["id"], part, offset(meta)).hexdigest()
+
+
+def finalize(meta: dict, dest: str) -> str:
+    """ครบทุก byte แล้ว: ตรวจ hash กับที่ client แจ้ง (ถ้ามี) แล้วย้ายไปไว้ที่ dest → คืน sha256"""
+    with _claim(meta["id"]):
+        sha = digest(meta)
+        if meta.get("sha256") and meta["sha256"] != sha:
+            _discard(meta["id"])
+            raise UploadError("checksum mismatch", 422, code="CHECKSUM_MISMATCH", sha256=sha)
+        part, _ = _paths(meta["id"])
+        os.replace(part, dest)
+        _discard(meta["id"])
+    return sha
+
+
+def abort(meta: dict) -> None:
+    with _claim(meta["id"]):
+        _discard(meta["id"])
+
+
+class HashedSpool:
+    """ไฟล์ชั่วคราวใน .partial ที่ hash sha256 ไปพร้อมกับการเขียน — ใช้เป็น stream_factory ของ parser multipart
+    (body ของ /upload ถูกเขียนลงไฟล์นี้ตรง ๆ ครั้งเดียว ไม่ผ่าน temp ของ Werkzeug แล้วคัดลอกซ้ำ)
+    ผู้เรียก os.replace(path, ...) หรือ discard() เอง; ที่ค้างจาก process ที่ตายไปถูก sweep ลบ"""
+
+    def __init__(self):
+        self.path = os.path.join(_dir(), f"{uuid.uuid4().hex}.tmp")
+        self._f = open(self.path, "w+b")
+        self._h = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self._h.update(data)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)  # seek/read/close ฯลฯ ของไฟล์จริง
+
+    def hexdigest(self) -> str:
+        return self._h.hexdigest()
+
+    def discard(self) -> None:
+        self._f.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
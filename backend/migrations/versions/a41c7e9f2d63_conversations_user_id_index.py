@@ -0,0 +1,28 @@
+"""conversations(user_id, id) index for keyset pagination by id
+
+Revision ID: a41c7e9f2d63
+Revises: f2a8c6d41b37
+Create Date: 2026-10-17 16:05:12.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41c7e9f2d63'
+down_revision = 'f2a8c6d41b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversations_user_created')
+        batch_op.create_index('ix_conversations_user_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('conversations', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversations_user_id')
+        batch_op.create_index('ix_conversations_user_created', ['user_id', 'created_at'], unique=False)
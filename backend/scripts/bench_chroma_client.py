@@ -0,0 +1,66 @@
+# backend/scripts/bench_chroma_client.py
+# วัด latency ต่อ query: เปิด PersistentClient ใหม่ทุกครั้ง (แบบเดิม) เทียบกับ client/collection ที่ cache ไว้
+import sys, os, time, random, statistics, argparse, tempfile
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from chromadb import PersistentClient
+
+from app.config import Config
+from app.services import rag
+
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[max(0, min(len(xs) - 1, int(round(p * (len(xs) - 1)))))]
+
+
+def _report(label, xs):
+    print(f"{label:<10} n={len(xs):<5} p50={_pct(xs, .5)*1000:8.2f} ms  p95={_pct(xs, .95)*1000:8.2f} ms  "
+          f"mean={statistics.mean(xs)*1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--seed-docs", type=int, default=2000, help="จำนวนชิ้นสุ่มที่ใส่ลงใน store ชั่วคราว (ถ้าไม่ใช้ --use-existing)")
+    ap.add_argument("--use-existing", action="store_true", help="ใช้ CHROMA_DIR จริงแทน store ชั่วคราว")
+    args = ap.parse_args()
+
+    name = "kb_default" if args.use_existing else "bench_client"
+    if not args.use_existing:
+        Config.CHROMA_DIR = tempfile.mkdtemp(prefix="chroma_bench_")
+        col = rag.get_collection(name)
+        rnd = random.Random(0)
+        for i in range(0, args.seed_docs, 500):
+            n = min(500, args.seed_docs - i)
+            col.add(
+                ids=[f"d{i+j}" for j in range(n)],
+                documents=[f"doc {i+j}" for j in range(n)],
+                embeddings=[[rnd.random() for _ in range(args.dim)] for _ in range(n)],
+            )
+        rag.close_client()
+
+    rnd = random.Random(1)
+    qs = [[rnd.random() for _ in range(args.dim)] for _ in range(args.queries)]
+
+    cold = []
+    for q in qs:
+        t = time.perf_counter()
+        c = PersistentClient(path=Config.CHROMA_DIR)
+        c.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"}).query(query_embeddings=[q], n_results=40)
+        cold.append(time.perf_counter() - t)
+
+    warm = []
+    rag.get_collection(name)  # warm-up
+    for q in qs:
+        t = time.perf_counter()
+        rag.get_collection(name).query(query_embeddings=[q], n_results=40)
+        warm.append(time.perf_counter() - t)
+
+    print(f"CHROMA_DIR={Config.CHROMA_DIR} collection={name}")
+    _report("per-query", cold)
+    _report("cached", warm)
+    print(f"speedup p50 x{_pct(cold, .5) / max(_pct(warm, .5), 1e-9):.1f}")
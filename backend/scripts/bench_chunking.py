@@ -0,0 +1,185 @@
+# backend/scripts/bench_chunking.py
+# วัดความเร็ว (MB/s) ของ sanitize_text / chunk_text / ทั้ง pipeline ต่อหน้า แบบเดิมเทียบกับปัจจุบัน
+# และตรวจว่าผลลัพธ์ตรงกันทุกหน้า (ชิ้นเหมือนเดิม → chunk id เดิม → ไม่ต้อง embed ใหม่)
+#
+#   python scripts/bench_chunking.py                       # คลังภาษาไทยสังเคราะห์ ~20MB
+#   python scripts/bench_chunking.py --mb 100
+#   python scripts/bench_chunking.py --file a.pdf --file notes.txt
+import sys, os, re, time, random, argparse, unicodedata
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from app.config import Config
+from app.services import rag
+
+
+# ---------- แบบเดิม (baseline) ----------
+
+_L_SURROGATE_RE = re.compile(r"[\uD800-\uDFFF]")
+_L_NULL_RE = re.compile(r"\x00")
+_L_PARABREAK = re.compile(r"\n{2,}")
+_L_WHITESPACE = re.compile(r"\s+")
+
+
+def legacy_sanitize_text(s: str) -> str:
+    if not s:
+        return ""
+    s = _L_NULL_RE.sub("", s)
+    s = _L_SURROGATE_RE.sub("", s)
+    try:
+        s = unicodedata.normalize("NFC", s)
+    except Exception:
+        pass
+    s = re.sub(r"[ \t]+", " ", s)
+    s = re.sub(r"\s+\n", "\n", s)
+    return s.strip()
+
+
+def legacy_chunk_text(s: str, max_chars: int, overlap: int) -> list:
+    paras = [_L_WHITESPACE.sub(" ", p).strip() for p in (p.strip() for p in _L_PARABREAK.split(s)) if p]
+    chunks, buf = [], ""
+    for p in paras:
+        if not buf:
+            buf = p
+            continue
+        if len(buf) + 2 + len(p) <= max_chars:
+            buf = f"{buf}\n\n{p}"
+        else:
+            chunks.append(buf)
+            if overlap > 0 and len(buf) > overlap:
+                buf = f"{buf[-overlap:]}\n\n{p}"
+            else:
+                buf = p
+    if buf:
+        chunks.append(buf)
+    out = []
+    for c in chunks:
+        if len(c) <= max_chars:
+            out.append(c)
+        else:
+            i, step = 0, max(max_chars - overlap, 1)
+            while i < len(c):
+                out.append(c[i:i+max_chars])
+                i += step
+    return [c for c in out if c.strip()]
+
+
+def legacy_pipeline(page: str, max_chars: int, overlap: int) -> list:
+    # เดิม: sanitize หน้า → chunk → sanitize ทุกชิ้นซ้ำ
+    return [c for c in (legacy_sanitize_text(c) for c in legacy_chunk_text(legacy_sanitize_text(page), max_chars, overlap)) if c]
+
+
+def pipeline(page: str, max_chars: int, overlap: int, sentences: bool = False) -> list:
+    return [c for c in (rag._finish_chunk(c) for c in rag.chunk_text(rag.sanitize_text(page), max_chars, overlap, sentences)) if c]
+
+
+# ---------- คลังทดสอบ ----------
+
+_THAI_WORDS = (
+    "การ ประเทศไทย ข้อมูล ระบบ ผู้ใช้งาน เอกสาร ความรู้ ปัญญาประดิษฐ์ ภาษา ที่ และ ของ ใน มี เป็น ได้ ให้ กับ จะ "
+    "กระทรวง มาตรฐาน การศึกษา โรงเรียน นักเรียน งบประมาณ โครงการ พัฒนา คุณภาพ ชีวิต เศรษฐกิจ สังคม สิ่งแวดล้อม "
+    "ตาม ระเบียบ ว่าด้วย ข้อ วรรค หนึ่ง สอง สาม พ.ศ. ๒๕๖๗ ร้อยละ ผลการดำเนินงาน ตัวชี้วัด เป้าหมาย แผนงาน"
+).split()
+_LATIN_WORDS = "AI RAG API ISO-9001 v2.1 PDF Chroma model embedding section 5.2.1".split()
+
+
+def synthetic_thai(mb: float, seed: int = 0) -> list:
+    """หน้าละ ~3KB หน้าตาเหมือนข้อความที่ดึงจาก PDF: บรรทัดสั้น, ช่องว่างท้ายบรรทัด, tab, บรรทัดว่าง, ปนอังกฤษ"""
+    rnd = random.Random(seed)
+    pages, total, target = [], 0, int(mb * 1_000_000)
+    while total < target:
+        lines = []
+        for _ in range(rnd.randint(25, 45)):
+            words = [rnd.choice(_LATIN_WORDS) if rnd.random() < 0.08 else rnd.choice(_THAI_WORDS)
+                     for _ in range(rnd.randint(3, 12))]
+            # ภาษาไทยเขียนติดกันเป็นวลี แล้วเว้นวรรคระหว่างวลี/ประโยค
+            line = ""
+            for w in words:
+                line += w if rnd.random() < 0.6 else " " + w
+            lines.append(line.strip() + rnd.choice(["", "", " ", "  ", "\t"]))
+            if rnd.random() < 0.08:
+                lines.append(rnd.choice(["", " "]))
+        page = "\n".join(lines)
+        pages.append(page)
+        total += len(page.encode("utf-8"))
+    return pages
+
+
+def load_files(paths: list, page_chars: int) -> list:
+    pages = []
+    for path in paths:
+        if path.lower().endswith(".pdf"):
+            from pypdf import PdfReader
+            pages += [p.extract_text() or "" for p in PdfReader(path).pages]
+        else:
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                text = f.read()
+            pages += [text[i:i+page_chars] for i in range(0, len(text), page_chars)]
+    return pages
+
+
+# ---------- วัด ----------
+
+def _rate(fn, pages, mb: float, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for p in pages:
+            fn(p)
+        best = min(best, time.perf_counter() - t)
+    return mb / best
+
+
+def _row(label: str, before: float, after: float) -> None:
+    print(f"{label:<10} before {before:8.1f} MB/s   after {after:8.1f} MB/s   x{after / before:5.2f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mb", type=float, default=20.0, help="ขนาดคลังสังเคราะห์")
+    ap.add_argument("--file", action="append", help="ใช้ไฟล์จริงแทน (.txt/.md/.pdf ใส่ได้หลายครั้ง)")
+    ap.add_argument("--page-chars", type=int, default=3000, help="แบ่งไฟล์ข้อความเป็นหน้าละกี่ตัวอักษร")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pages = load_files(args.file, args.page_chars) if args.file else synthetic_thai(args.mb)
+    mb = sum(len(p.encode("utf-8", "surrogatepass")) for p in pages) / 1_000_000
+    max_chars, overlap = Config.RAG_CHUNK_CHARS, Config.RAG_CHUNK_OVERLAP
+    print(f"{len(pages)} pages, {mb:.1f} MB  (RAG_CHUNK_CHARS={max_chars}, RAG_CHUNK_OVERLAP={overlap})")
+
+    # ผลต้องเหมือนเดิมทุกหน้า
+    clean = [legacy_sanitize_text(p) for p in pages]
+    for p, c in zip(pages, clean):
+        assert rag.sanitize_text(p) == c, "sanitize_text differs"
+    for c in clean:
+        assert rag.chunk_text(c, max_chars, overlap, False) == legacy_chunk_text(c, max_chars, overlap), "chunk_text differs"
+    n_chunks = 0
+    for p in pages:
+        old = legacy_pipeline(p, max_chars, overlap)
+        assert pipeline(p, max_chars, overlap) == old, "pipeline differs"
+        n_chunks += len(old)
+    print(f"outputs identical ({n_chunks} chunks)")
+
+    _row("sanitize", _rate(legacy_sanitize_text, pages, mb, args.repeat), _rate(rag.sanitize_text, pages, mb, args.repeat))
+    _row("chunk", _rate(lambda c: legacy_chunk_text(c, max_chars, overlap), clean, mb, args.repeat),
+         _rate(lambda c: rag.chunk_text(c, max_chars, overlap, False), clean, mb, args.repeat))
+    _row("pipeline", _rate(lambda p: legacy_pipeline(p, max_chars, overlap), pages, mb, args.repeat),
+         _rate(lambda p: pipeline(p, max_chars, overlap), pages, mb, args.repeat))
+
+    # ตัดที่ท้ายประโยค/ช่องว่าง (RAG_CHUNK_SENTENCES=1): ชิ้นเปลี่ยน จึงวัดแยกและดูว่ามีชิ้นที่ขึ้นต้นกลางคำเท่าไร
+    sent_rate = _rate(lambda p: pipeline(p, max_chars, overlap, True), pages, mb, args.repeat)
+
+    def mid_word(chunks_of_pages):
+        total = cut = 0
+        for text, chunks in chunks_of_pages:
+            for c in chunks[1:]:
+                i = text.find(c)
+                total += 1
+                cut += i > 0 and text[i - 1] != " "
+        return cut / max(total, 1)
+
+    sample = [" ".join(rag.sanitize_text(p).split()) for p in pages[:500]]
+    hard = mid_word((t, rag.chunk_text(t, max_chars, overlap, False)) for t in sample)
+    soft = mid_word((t, rag.chunk_text(t, max_chars, overlap, True)) for t in sample)
+    print(f"sentences  {sent_rate:8.1f} MB/s   chunks starting mid-word: hard wrap {hard:.0%} → sentence-aware {soft:.0%}")
@@ -0,0 +1,36 @@
+# backend/scripts/bench_pdf_extract.py
+# วัดความเร็วดึงข้อความ PDF (pages/sec) แบบ 1 process เทียบกับ N workers
+import sys, os, time, argparse
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from pypdf import PdfReader
+
+from app.config import Config
+from app.services.rag import load_pdf_pages
+
+
+def run(path: str, workers: int) -> tuple[float, int]:
+    t = time.perf_counter()
+    pages = load_pdf_pages(path, workers=workers)
+    return time.perf_counter() - t, len(pages)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdf")
+    ap.add_argument("--workers", type=int, nargs="*", default=None,
+                    help="จำนวน worker ที่จะวัด (ค่าเริ่มต้น: 1 และจำนวน CPU)")
+    args = ap.parse_args()
+
+    Config.RAG_PDF_PARALLEL_MIN_PAGES = 0  # บังคับให้ใช้ process pool ตามจำนวนที่ขอ
+    n_pages = len(PdfReader(args.pdf).pages)
+    counts = args.workers or sorted({1, os.cpu_count() or 1})
+    print(f"{os.path.basename(args.pdf)}: {n_pages} pages")
+    base = None
+    for w in counts:
+        secs, with_text = run(args.pdf, w)
+        rate = n_pages / secs if secs else 0.0
+        base = base or rate
+        print(f"workers={w:<3} {secs:8.2f} s  {rate:8.1f} pages/s  x{rate / base:.2f}  (pages with text: {with_text})")
@@ -0,0 +1,65 @@
+# backend/scripts/bench_rank.py
+# micro-benchmark ขั้นจัดอันดับของ rag.search: โค้ดเดิม (sort ซ้ำหลายรอบ) เทียบกับ _adaptive_cutoff ปัจจุบัน (+ MMR)
+# ใช้หาค่า rag._NUMPY_CUTOFF_MIN: ต่ำกว่านั้นใช้ sort ของ Python, ตั้งแต่นั้นขึ้นไปใช้ NumPy
+import sys, os, time, math, random, argparse
+import numpy as np
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from app.config import Config
+from app.services.rag import _adaptive_cutoff, _mmr
+
+
+def legacy_cutoff(items, k):
+    """สำเนาของขั้นตอนเดิมใน rag.search ก่อนเปลี่ยนเป็น NumPy"""
+    items = sorted(items, key=lambda x: x[0])
+    ds = [it[0] for it in items]
+
+    def pct(arr, p):
+        i = max(0, min(len(arr)-1, int(math.ceil(p * len(arr)) - 1)))
+        return sorted(arr)[i]
+
+    p85 = pct(ds, 0.85)
+    hard = getattr(Config, "RAG_MAX_DISTANCE", None)
+    cutoff = min(p85, hard) if isinstance(hard, (int, float)) and hard > 0 else p85
+    filtered = [it for it in items if it[0] <= cutoff]
+    return filtered if len(filtered) >= max(1, k) else items[:max(1, k)]
+
+
+def make_items(n, dim, rnd):
+    # Chroma คืน embeddings เป็น numpy array อยู่แล้ว → จำลองแบบเดียวกัน
+    embs = np.random.default_rng(rnd.randrange(1 << 30)).standard_normal((n, dim)).astype(np.float32)
+    out = []
+    for i in range(n):
+        emb = embs[i]
+        out.append((rnd.uniform(0.1, 0.6), f"doc {i}", {"page": i}, f"id{i}", emb))
+    return out
+
+
+def timeit(fn, reps):
+    t = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - t) / reps * 1e6  # µs
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="*", default=[40, 200, 1000])
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--reps", type=int, default=200)
+    args = ap.parse_args()
+
+    rnd = random.Random(0)
+    qvec = [rnd.gauss(0, 1) for _ in range(args.dim)]
+    print(f"{'n':>6} {'legacy µs':>12} {'current µs':>12} {'speedup':>8} {'mmr µs':>12}")
+    for n in args.sizes:
+        items = make_items(n, args.dim, rnd)
+        assert [it[3] for it in legacy_cutoff(list(items), args.k)] == [it[3] for it in _adaptive_cutoff(list(items), args.k)]
+        t_old = timeit(lambda: legacy_cutoff(list(items), args.k), args.reps)
+        t_new = timeit(lambda: _adaptive_cutoff(list(items), args.k), args.reps)
+        chosen = _adaptive_cutoff(list(items), args.k)
+        t_mmr = timeit(lambda: _mmr(chosen, qvec, args.k), max(1, args.reps // 10))
+        print(f"{n:>6} {t_old:>12.1f} {t_new:>12.1f} {t_old / t_new:>7.1f}x {t_mmr:>12.1f}")
@@ -0,0 +1,177 @@
+# backend/scripts/load_chat_stream.py
+# load test /api/ai/chat/stream: เปิด stream พร้อมกัน N เส้น แล้ววัด TTFB / เวลาจบ / จำนวนที่ล้ม
+# + thread/RSS ของ server (ถ้าให้ --pid) เพื่อเทียบ Flask (wsgi.py) กับ ASGI (uvicorn asgi:app)
+#
+#   1) Ollama ปลอม (ส่ง token ช้า ๆ ให้ stream ค้างนาน ๆ):
+#        python scripts/load_chat_stream.py mock-ollama --port 11500 --tokens 200 --delay 0.05
+#   2) server ที่จะทดสอบ (ชี้ OLLAMA_HOST ไปที่ตัวปลอม):
+#        OLLAMA_HOST=http://127.0.0.1:11500 python wsgi.py
+#        OLLAMA_HOST=http://127.0.0.1:11500 uvicorn asgi:app --port 8089 --loop uvloop --http httptools
+#   3) ยิง:
+#        python scripts/load_chat_stream.py run --url http://127.0.0.1:8088 --concurrency 50,200,1000 --pid <pid>
+import sys, os, time, json, asyncio, argparse, statistics
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+import httpx
+
+
+def _pct(xs, p):
+    if not xs:
+        return float("nan")
+    xs = sorted(xs)
+    return xs[max(0, min(len(xs) - 1, int(round(p * (len(xs) - 1)))))]
+
+
+# ---------- Ollama ปลอม ----------
+
+def mock_ollama_app(tokens: int, delay: float, ctx: int):
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        path = scope["path"]
+        while (await receive()).get("more_body"):
+            pass
+
+        async def reply(obj, status=200):
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": json.dumps(obj).encode()})
+
+        if path == "/api/tags":
+            return await reply({"models": [{"name": "mock:latest"}]})
+        if path == "/api/show":
+            return await reply({"model_info": {"mock.context_length": ctx}})
+        if path != "/api/chat":
+            return await reply({"error": "not found"}, 404)
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        for _ in range(tokens):
+            await asyncio.sleep(delay)
+            line = json.dumps({"message": {"role": "assistant", "content": "ทดสอบ "}, "done": False}, ensure_ascii=False)
+            await send({"type": "http.response.body", "body": (line + "\n").encode(), "more_body": True})
+        done = {"done": True, "eval_count": tokens, "eval_duration": int(tokens * delay * 1e9), "prompt_eval_count": 10}
+        await send({"type": "http.response.body", "body": (json.dumps(done) + "\n").encode()})
+    return app
+
+
+# ---------- ตัวยิง ----------
+
+def _server_stats(pid: int | None) -> dict:
+    if not pid:
+        return {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            st = dict(line.split(":", 1) for line in f if ":" in line)
+        return {"threads": int(st["Threads"]), "rss_mb": int(st["VmRSS"].split()[0]) / 1024}
+    except OSError:
+        return {}
+
+
+def _mint_token(user_id: int) -> str:
+    # ใช้ JWT_SECRET_KEY เดียวกับ server (อ่านจาก env/.env ผ่าน Config)
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+    from app.config import Config
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    JWTManager(app)
+    with app.app_context():
+        return create_access_token(identity=str(user_id))
+
+
+async def _one(client, url, body, headers, t0, results):
+    ttfb = None
+    try:
+        async with client.stream("POST", url, json=body, headers=headers) as r:
+            if r.status_code != 200:
+                await r.aread()
+                results.append(("fail", f"HTTP {r.status_code}", None, None))
+                return
+            async for _ in r.aiter_bytes():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - t0
+        results.append(("ok", None, ttfb, time.perf_counter() - t0))
+    except Exception as e:
+        results.append(("fail", type(e).__name__, ttfb, None))
+
+
+async def _round(args, n: int, token: str) -> None:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(connect=args.connect_timeout, read=None, write=30, pool=None)
+    body = {"model": args.model, "message": args.message, "stream_format": args.format}
+    headers = {"Authorization": f"Bearer {token}"}
+    results: list = []
+    peak: dict = {}
+
+    async def sample():
+        while True:
+            st = _server_stats(args.pid)
+            for k, v in st.items():
+                peak[k] = max(peak.get(k, 0), v)
+            await asyncio.sleep(0.2)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        sampler = asyncio.create_task(sample())
+        t0 = time.perf_counter()
+        await asyncio.gather(*[_one(client, f"{args.url}/api/ai/chat/stream", body, headers, t0, results)
+                               for _ in range(n)])
+        wall = time.perf_counter() - t0
+        sampler.cancel()
+
+    ok = [r for r in results if r[0] == "ok"]
+    fails: dict = {}
+    for r in results:
+        if r[0] == "fail":
+            fails[r[1]] = fails.get(r[1], 0) + 1
+    ttfb = [r[2] for r in ok if r[2] is not None]
+    total = [r[3] for r in ok]
+    line = (f"n={n:<5} ok={len(ok):<5} fail={n - len(ok):<4} wall={wall:7.2f}s  "
+            f"ttfb p50={_pct(ttfb, .5)*1000:8.1f} p95={_pct(ttfb, .95)*1000:8.1f} ms  "
+            f"done p50={_pct(total, .5):6.2f} p95={_pct(total, .95):6.2f} s")
+    if peak:
+        line += f"  server peak threads={peak.get('threads')} rss={peak.get('rss_mb', 0):.0f}MB"
+    print(line)
+    if fails:
+        print(f"         failures: {fails}")
+
+
+async def _run(args) -> None:
+    token = args.token or _mint_token(args.user_id)
+    print(f"url={args.url} format={args.format} model={args.model}")
+    for n in [int(x) for x in args.concurrency.split(",")]:
+        await _round(args, n, token)
+        await asyncio.sleep(args.pause)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    m = sub.add_parser("mock-ollama", help="Ollama ปลอมที่ stream token ช้า ๆ")
+    m.add_argument("--port", type=int, default=11500)
+    m.add_argument("--tokens", type=int, default=200)
+    m.add_argument("--delay", type=float, default=0.05, help="วินาทีต่อ token")
+    m.add_argument("--ctx", type=int, default=8192)
+
+    r = sub.add_parser("run", help="ยิง stream พร้อมกัน")
+    r.add_argument("--url", default="http://127.0.0.1:8088")
+    r.add_argument("--concurrency", default="10,100,500")
+    r.add_argument("--model", default="mock")
+    r.add_argument("--message", default="สวัสดี")
+    r.add_argument("--format", default="ndjson", choices=["text", "ndjson", "sse"])
+    r.add_argument("--token", help="JWT (ไม่ระบุ = สร้างเองจาก JWT_SECRET_KEY)")
+    r.add_argument("--user-id", type=int, default=1)
+    r.add_argument("--pid", type=int, help="pid ของ server ไว้อ่าน thread/RSS จาก /proc")
+    r.add_argument("--connect-timeout", type=float, default=30)
+    r.add_argument("--pause", type=float, default=2.0)
+    args = ap.parse_args()
+
+    if args.cmd == "mock-ollama":
+        import uvicorn
+        uvicorn.run(mock_ollama_app(args.tokens, args.delay, args.ctx), host="127.0.0.1", port=args.port,
+                    log_level="warning", backlog=4096)
+    else:
+        asyncio.run(_run(args))
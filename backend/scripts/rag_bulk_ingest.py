@@ -0,0 +1,168 @@
+# backend/scripts/rag_bulk_ingest.py
+# ingest ทั้งโฟลเดอร์ (รวมโฟลเดอร์ย่อย) ลงคลังโดยตรง ไม่ผ่าน /api/files/upload
+#
+#   python scripts/rag_bulk_ingest.py /data/docs --collection kb_default --workers 4
+#
+# - หลายไฟล์พร้อมกัน (--workers) และแต่ละไฟล์ embed พร้อมกันได้ RAG_EMBED_WORKERS ก้อน
+#   → คำขอที่ค้างที่ Ollama สูงสุด ≈ workers × RAG_EMBED_WORKERS (ตั้ง OLLAMA_NUM_PARALLEL ให้พอ)
+# - checkpoint ใน SQLite (--state): ไฟล์ที่เสร็จแล้วถูกบันทึกทันที → ล่มกลางทาง รันคำสั่งเดิมซ้ำจะทำต่อจากที่ค้าง
+#   (ไฟล์ที่ทำค้างไว้ครึ่งหนึ่งจะ ingest ใหม่ แต่ชิ้นที่ลง Chroma ไปแล้วมี id เดิม จึงไม่ embed ซ้ำ)
+# - ข้ามไฟล์ที่ ingest แล้วตาม sha256 (ย้ายที่/คัดลอกซ้ำก็ไม่ทำใหม่); path เดิม size/mtime เดิม → ไม่ต้อง hash ใหม่
+# - source ใน metadata = path สัมพัทธ์จากโฟลเดอร์ตั้งต้น (กันชื่อไฟล์ซ้ำกันคนละโฟลเดอร์ทับกัน)
+import sys, os, time, json, hashlib, sqlite3, argparse, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from app.config import Config
+from app.services import rag, embed_cache, ollama_client
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _walk(root: str, exts: set[str]):
+    for d, dirs, files in os.walk(root):
+        dirs[:] = sorted(x for x in dirs if not x.startswith("."))
+        for fn in sorted(files):
+            if fn.startswith(".") or fn.rsplit(".", 1)[-1].lower() not in exts:
+                continue
+            yield os.path.join(d, fn)
+
+
+class Checkpoint:
+    """สถานะต่อไฟล์ (done / duplicate / failed) — เขียนจาก thread หลักเท่านั้น"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT NOT NULL, collection TEXT NOT NULL, size INTEGER, mtime REAL, sha256 TEXT,"
+            " status TEXT NOT NULL, chunks INTEGER DEFAULT 0, error TEXT, updated_at REAL,"
+            " PRIMARY KEY(path, collection))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS ix_files_sha ON files(collection, sha256)")
+
+    def known(self, collection: str) -> dict:
+        rows = self.db.execute("SELECT path, size, mtime, sha256, status FROM files WHERE collection=?", (collection,))
+        return {p: (size, mtime, sha, status) for p, size, mtime, sha, status in rows}
+
+    def done_hashes(self, collection: str) -> set[str]:
+        return {sha for (sha,) in self.db.execute(
+            "SELECT sha256 FROM files WHERE collection=? AND status IN ('done','duplicate')", (collection,))}
+
+    def record(self, path, collection, size, mtime, sha, status, chunks=0, error=None) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files(path, collection, size, mtime, sha256, status, chunks, error, updated_at)"
+                " VALUES (?,?,?,?,?,?,?,?,?)",
+                (path, collection, size, mtime, sha, status, chunks, error, time.time()),
+            )
+
+
+def main(args) -> None:
+    root = os.path.abspath(args.root)
+    collection = rag.validate_collection(args.collection)
+    if args.embed_workers:
+        Config.RAG_EMBED_WORKERS = args.embed_workers
+    state = Checkpoint(args.state or os.path.join(os.path.dirname(Config.CHROMA_DIR), "bulk_ingest.sqlite3"))
+    known = state.known(collection)
+    skip_status = ("done", "duplicate", "failed") if args.skip_failed else ("done", "duplicate")
+
+    # ---- คัดไฟล์: path เดิม + size/mtime เดิม + เสร็จแล้ว → ข้ามโดยไม่ต้องอ่านไฟล์ ----
+    todo, skipped = [], 0
+    for path in _walk(root, {e.lower() for e in Config.ALLOWED_EXTS}):
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        st = os.stat(path)
+        prev = known.get(rel)
+        if prev and prev[0] == st.st_size and prev[1] == st.st_mtime and prev[3] in skip_status:
+            skipped += 1
+            continue
+        todo.append((path, rel, st.st_size, st.st_mtime))
+    print(f"root={root} collection={collection} to process={len(todo)} already done={skipped}")
+    if args.dry_run or not todo:
+        return
+
+    claimed = state.done_hashes(collection)
+    claim_lock = threading.Lock()
+
+    def work(item):
+        path, rel, size, mtime = item
+        sha = _sha256(path)
+        with claim_lock:
+            if sha in claimed:
+                return item, sha, "duplicate", 0, None
+            claimed.add(sha)
+        try:
+            res = rag.ingest_file(path, metadata={"filename": os.path.basename(path), "sha256": sha},
+                                  collection=collection, source=rel)
+            return item, sha, "done", res["chunks"], None
+        except Exception as e:
+            with claim_lock:
+                claimed.discard(sha)
+            return item, sha, "failed", 0, f"{type(e).__name__}: {e}"
+
+    ollama_client.reset_embed_stats()
+    counts = {"done": 0, "duplicate": 0, "failed": 0}
+    chunks = 0
+    t0 = time.perf_counter()
+    last = t0
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk-ingest")
+    try:
+        futures = [pool.submit(work, item) for item in todo]
+        for fut in as_completed(futures):
+            (path, rel, size, mtime), sha, status, n, err = fut.result()
+            state.record(rel, collection, size, mtime, sha, status, n, err)  # checkpoint ทีละไฟล์
+            counts[status] += 1
+            chunks += n
+            if err:
+                print(f"[FAIL] {rel}: {err}")
+            now = time.perf_counter()
+            finished = sum(counts.values())
+            if now - last >= args.report_every or finished == len(todo):
+                el = now - t0
+                print(f"[{finished}/{len(todo)}] {finished / el:.2f} files/s  {chunks / el:.1f} chunks/s  "
+                      f"done={counts['done']} dup={counts['duplicate']} failed={counts['failed']}")
+                last = now
+    except KeyboardInterrupt:
+        print("interrupted — ไฟล์ที่เสร็จแล้วถูกบันทึกไว้ รันคำสั่งเดิมซ้ำเพื่อทำต่อ")
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+    wall = time.perf_counter() - t0
+    es = ollama_client.embed_stats()
+    print("---- summary ----")
+    print(f"files: {counts['done']} ingested, {counts['duplicate']} duplicate, {counts['failed']} failed, "
+          f"{skipped} skipped (checkpoint)")
+    print(f"time {wall:.1f}s  {counts['done'] / wall:.2f} files/s  {chunks} chunks  {chunks / wall:.1f} chunks/s")
+    print(f"embedding server: {es['calls']} requests / {es['texts']} texts  "
+          f"busy {es['busy_sec'] / wall:.0%} of wall time  "
+          f"avg in-flight {es['request_sec'] / wall:.2f} (เทียบ OLLAMA_NUM_PARALLEL)  "
+          f"{es['texts'] / max(es['busy_sec'], 1e-9):.1f} texts/s while busy")
+    cache = embed_cache.stats()
+    if cache:
+        print(f"embed cache: {json.dumps(cache, ensure_ascii=False)}")
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("root", help="โฟลเดอร์ที่จะ ingest (รวมโฟลเดอร์ย่อย)")
+    ap.add_argument("--collection", default=rag.DEFAULT_COLLECTION)
+    ap.add_argument("--workers", type=int, default=4, help="จำนวนไฟล์ที่ทำพร้อมกัน")
+    ap.add_argument("--embed-workers", type=int, default=0, help="override RAG_EMBED_WORKERS (batch ต่อไฟล์ที่ embed พร้อมกัน)")
+    ap.add_argument("--state", help="ไฟล์ checkpoint (ค่าเริ่มต้น: bulk_ingest.sqlite3 ข้าง CHROMA_DIR)")
+    ap.add_argument("--skip-failed", action="store_true", help="ไม่ลองไฟล์ที่เคยล้มซ้ำ")
+    ap.add_argument("--report-every", type=float, default=10.0, help="วินาทีระหว่างรายงานความคืบหน้า")
+    ap.add_argument("--dry-run", action="store_true", help="นับไฟล์ที่จะทำอย่างเดียว")
+    main(ap.parse_args())
@@ -0,0 +1,238 @@
+# backend/scripts/rag_compact.py
+# compaction ของ Chroma: สร้าง collection ใหม่จาก embedding ที่เก็บไว้ (ไม่ embed ซ้ำ) ด้วยค่า HNSW ที่กำหนด
+# → ทิ้ง tombstone ของชิ้นที่ถูกลบ/re-ingest และได้ graph ใหม่ที่ไม่แตกกระจาย แล้วสลับเข้าแทนที่ชื่อเดิม
+#
+#   python scripts/rag_compact.py --collection kb_default --M 32 --ef-construction 200 --ef-search 64
+#   python scripts/rag_compact.py --all --dry-run          # สร้าง + วัดผลอย่างเดียว ไม่สลับ
+#   python scripts/rag_compact.py --vacuum                 # VACUUM อย่างเดียว (ไม่ rebuild)
+#
+# - รายงานขนาด index (HNSW segment + ทั้ง CHROMA_DIR) และ p50/p95 ของ query ก่อน/หลัง
+# - การสลับ: rename เดิม → <name>__old, rename ใหม่ → <name> แล้วแตะ marker ให้ server ทุก process เปิด handle ใหม่
+#   (ระหว่าง rebuild server ยังค้นจาก collection เดิมตามปกติ)
+# - ถ้ามีการเขียนลง collection ระหว่าง rebuild (seq_id ใน write log ของ Chroma ขยับ) จะยกเลิก — ควรรันตอนไม่มีงาน ingest
+# - ถ้ามีการเขียนลง collection เดิมหลังสลับ (process อื่นยังถือ handle เก่า) จะไม่ลบ collection เดิม แต่เก็บไว้ให้ตรวจ
+# - รันเป็นงานประจำได้ เช่น cron: 0 3 * * 0  cd backend && python scripts/rag_compact.py --all
+import sys, os, re, time, random, shutil, sqlite3, argparse
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+from app.config import Config
+from app.services import rag
+
+
+def _pct(xs, p):
+    if not xs:
+        return float("nan")
+    xs = sorted(xs)
+    return xs[max(0, min(len(xs) - 1, int(round(p * (len(xs) - 1)))))]
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fn))
+            except OSError:
+                pass
+    return total
+
+
+def _segment_size(col) -> int:
+    """ขนาดไฟล์ HNSW ของ collection (โฟลเดอร์ชื่อ = id ของ vector segment ใน chroma.sqlite3)"""
+    db = sqlite3.connect(f"file:{os.path.join(Config.CHROMA_DIR, 'chroma.sqlite3')}?mode=ro", uri=True)
+    try:
+        row = db.execute("SELECT id FROM segments WHERE collection=? AND scope='VECTOR'", (str(col.id),)).fetchone()
+    finally:
+        db.close()
+    return _dir_size(os.path.join(Config.CHROMA_DIR, row[0])) if row else 0
+
+
+def _watermark(col) -> tuple:
+    """ตำแหน่งล่าสุดใน write log ของ collection: seq_id ใน embeddings_queue + max_seq_id ของ segment
+    ทุก add/upsert/update/delete ขยับค่านี้ (count() ไม่พอ: ลบ 1 เพิ่ม 1 ได้จำนวนเท่าเดิม); rename ไม่ขยับ"""
+    db = sqlite3.connect(f"file:{os.path.join(Config.CHROMA_DIR, 'chroma.sqlite3')}?mode=ro", uri=True)
+    try:
+        queued = db.execute("SELECT MAX(seq_id), COUNT(*) FROM embeddings_queue WHERE topic LIKE ?",
+                            (f"%/{col.id}",)).fetchone()
+        applied = db.execute("SELECT MAX(m.seq_id) FROM max_seq_id m JOIN segments s ON s.id = m.segment_id "
+                             "WHERE s.collection=?", (str(col.id),)).fetchone()
+    finally:
+        db.close()
+    return (*queued, applied[0], col.count())
+
+
+def _mb(n: int) -> str:
+    return f"{n / 1024 / 1024:.1f}MB"
+
+
+def _side_name(name: str, suffix: str) -> str:
+    return f"{name[:63 - len(suffix)]}{suffix}"  # ชื่อ collection ยาวได้ไม่เกิน 63
+
+
+def _copy(src, dst, page: int, samples: int) -> tuple[int, list]:
+    """คัดลอก ids/embeddings/documents/metadatas ทีละหน้า + สุ่มเวกเตอร์ไว้เป็น query (reservoir)"""
+    rnd = random.Random(0)
+    queries: list = []
+    copied, offset = 0, 0
+    while True:
+        got = src.get(include=["embeddings", "documents", "metadatas"], limit=page, offset=offset)
+        ids = got.get("ids") or []
+        if not ids:
+            break
+        embs = got["embeddings"]
+        dst.add(ids=ids, embeddings=embs, documents=got.get("documents"), metadatas=got.get("metadatas"))
+        for v in embs:
+            copied += 1
+            if len(queries) < samples:
+                queries.append(list(v))
+            else:
+                j = rnd.randrange(copied)
+                if j < samples:
+                    queries[j] = list(v)
+        offset += len(ids)
+        print(f"  copied {copied}", end="\r", flush=True)
+    print()
+    return copied, queries
+
+
+def _latency(col, queries: list, k: int) -> tuple[list, list]:
+    for q in queries[:5]:  # warm-up (โหลด index เข้าหน่วยความจำ)
+        col.query(query_embeddings=[q], n_results=k, include=[])
+    times, results = [], []
+    for q in queries:
+        t = time.perf_counter()
+        res = col.query(query_embeddings=[q], n_results=k, include=[])
+        times.append(time.perf_counter() - t)
+        results.append(set(res["ids"][0]))
+    return times, results
+
+
+def compact(name: str, args) -> bool:
+    client = rag.get_client()
+    col = rag.get_collection(name, create=False)
+    before = col.count()
+    print(f"== {name}: {before} chunks, hnsw={ {k: v for k, v in (col.metadata or {}).items() if k.startswith('hnsw:')} }")
+    if not before:
+        print("  empty → skip")
+        return False
+
+    seg_before, dir_before = _segment_size(col), _dir_size(Config.CHROMA_DIR)
+    mark = _watermark(col)
+
+    tmp_name = _side_name(name, "__rebuild")
+    try:
+        client.delete_collection(tmp_name)  # ของค้างจากรอบที่ล้มเหลว
+    except Exception:
+        pass
+    meta = dict(col.metadata or {"hnsw:space": "cosine"})
+    meta.update({"hnsw:M": args.M, "hnsw:construction_ef": args.ef_construction, "hnsw:search_ef": args.ef_search})
+    new = client.create_collection(name=tmp_name, metadata=meta)
+
+    t0 = time.perf_counter()
+    copied, queries = _copy(col, new, args.page, args.queries)
+    build_sec = time.perf_counter() - t0
+
+    if new.count() != copied or _watermark(col) != mark:
+        print(f"  ABORT: collection changed during rebuild ({before} → {col.count()} chunks, copied {copied});"
+              " try again when idle")
+        client.delete_collection(tmp_name)
+        return False
+
+    t_old, r_old = _latency(col, queries, args.k)
+    t_new, r_new = _latency(new, queries, args.k)
+    overlap = sum(len(a & b) / max(len(a), 1) for a, b in zip(r_old, r_new)) / max(len(queries), 1)
+    seg_new = _segment_size(new)
+
+    print(f"  rebuilt {copied} chunks in {build_sec:.1f}s  M={args.M} ef_construction={args.ef_construction} ef_search={args.ef_search}")
+    print(f"  query k={args.k} n={len(queries)}  before p50={_pct(t_old, .5)*1000:7.2f} p95={_pct(t_old, .95)*1000:7.2f} ms"
+          f"  after p50={_pct(t_new, .5)*1000:7.2f} p95={_pct(t_new, .95)*1000:7.2f} ms  top-{args.k} overlap={overlap:.1%}")
+    print(f"  hnsw segment  before {_mb(seg_before)}  after {_mb(seg_new)}")
+
+    if args.dry_run:
+        client.delete_collection(tmp_name)
+        print("  dry-run → dropped rebuilt collection")
+        return False
+
+    # ---- สลับ: เดิม → __old, ใหม่ → ชื่อจริง (พังกลางทาง → ย้อนชื่อเดิมกลับ) ----
+    old_name = _side_name(name, f"__old{int(time.time())}")
+    col.modify(name=old_name)
+    try:
+        new.modify(name=name)
+    except Exception:
+        col.modify(name=name)
+        client.delete_collection(tmp_name)
+        raise
+    rag.forget_collection(name)
+    rag.mark_collections_swapped()
+    time.sleep(args.drain)  # ให้คำขอที่ยังใช้ handle เก่าใน process อื่นทำงานจบก่อน
+    # ตรวจซ้ำหลังสลับ: มีการเขียนลงตัวเดิมระหว่างตรวจครั้งก่อน → สลับ → drain ไหม (ชิ้นนั้นไม่อยู่ในตัวใหม่)
+    if _watermark(col) != mark:
+        print(f"  WARNING: {old_name} was written to during the swap; kept it — "
+              "re-ingest the affected files or re-run compaction when idle")
+    elif args.keep_old:
+        print(f"  swapped; previous collection kept as {old_name}")
+    else:
+        client.delete_collection(old_name)
+        print("  swapped; previous collection dropped")
+
+    print(f"  CHROMA_DIR    before {_mb(dir_before)}  after {_mb(_dir_size(Config.CHROMA_DIR))}"
+          " (sqlite จะไม่หดจนกว่าจะ --vacuum)")
+    return True
+
+
+_UUID_RE = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def vacuum() -> None:
+    # ต้องไม่มี process อื่นเปิด store อยู่ (ปิด server ก่อน)
+    rag.close_client()
+    path = os.path.join(Config.CHROMA_DIR, "chroma.sqlite3")
+    size = os.path.getsize(path)
+    db = sqlite3.connect(path, timeout=60)
+    try:
+        live = {sid for (sid,) in db.execute("SELECT id FROM segments")}
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    print(f"VACUUM chroma.sqlite3 {_mb(size)} → {_mb(os.path.getsize(path))}")
+
+    # Chroma ไม่ลบโฟลเดอร์ HNSW ของ collection ที่ถูกลบ → ลบโฟลเดอร์ segment ที่ไม่มีใน sqlite แล้ว
+    freed = 0
+    for fn in os.listdir(Config.CHROMA_DIR):
+        full = os.path.join(Config.CHROMA_DIR, fn)
+        if _UUID_RE.match(fn) and fn not in live and os.path.isdir(full):
+            freed += _dir_size(full)
+            shutil.rmtree(full)
+    if freed:
+        print(f"removed orphan segment dirs: {_mb(freed)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--collection", help=f"ค่าเริ่มต้น {rag.DEFAULT_COLLECTION} (ถ้าไม่ได้สั่ง --vacuum อย่างเดียว)")
+    ap.add_argument("--all", action="store_true", help="ทุก collection (ยกเว้นของค้าง __rebuild/__old)")
+    ap.add_argument("--M", type=int, default=16, help="hnsw:M — เพื่อนบ้านต่อโหนด (มาก = recall ดี แต่ index ใหญ่)")
+    ap.add_argument("--ef-construction", type=int, default=200, help="hnsw:construction_ef")
+    ap.add_argument("--ef-search", type=int, default=100, help="hnsw:search_ef")
+    ap.add_argument("--page", type=int, default=1000, help="จำนวนชิ้นต่อรอบคัดลอก")
+    ap.add_argument("--queries", type=int, default=200, help="จำนวน query ที่ใช้วัด latency (สุ่มจากเวกเตอร์ที่เก็บไว้)")
+    ap.add_argument("--k", type=int, default=Config.RAG_TOPK_DEFAULT)
+    ap.add_argument("--dry-run", action="store_true", help="สร้าง + วัดผล แต่ไม่สลับ")
+    ap.add_argument("--keep-old", action="store_true", help="เก็บ collection เดิมไว้เป็น <name>__old<ts>")
+    ap.add_argument("--drain", type=float, default=2.0, help="วินาทีที่รอหลังสลับ ก่อนตรวจซ้ำ/ลบ collection เดิม")
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM chroma.sqlite3 + ลบโฟลเดอร์ segment ที่ค้าง (ปิด server ก่อน)")
+    args = ap.parse_args()
+
+    if args.all:
+        names = [n for n in rag.list_collection_names() if "__rebuild" not in n and "__old" not in n]
+    elif args.collection or not args.vacuum:
+        names = [rag.validate_collection(args.collection or rag.DEFAULT_COLLECTION)]
+    else:
+        names = []  # --vacuum อย่างเดียว
+    print(f"CHROMA_DIR={Config.CHROMA_DIR}")
+    for n in names:
+        compact(n, args)
+    if args.vacuum:
+        vacuum()
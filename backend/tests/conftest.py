@@ -0,0 +1,41 @@
+import os, sys, tempfile
+
+import pytest
+
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE not in sys.path:
+    sys.path.insert(0, BASE)
+
+# ต้องตั้งก่อน import app (Config อ่าน env ตอน import)
+_tmp = tempfile.mkdtemp(prefix="aiapp-test-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp, 'app.db')}")
+os.environ.setdefault("UPLOAD_DIR", os.path.join(_tmp, "uploads"))
+os.environ.setdefault("CHROMA_DIR", os.path.join(_tmp, "chroma"))
+
+
+@pytest.fixture
+def app():
+    from app import create_app
+    from app.extensions import db
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_header(app):
+    from flask_jwt_extended import create_access_token
+
+    def make(uid: int) -> dict:
+        return {"Authorization": f"Bearer {create_access_token(identity=str(uid))}"}
+    return make
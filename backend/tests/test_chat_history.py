@@ -0,0 +1,31 @@
+from app.config import Config
+from app.extensions import db
+from app.models.conversation import Conversation, Message
+from app.services import chat_history
+
+
+def test_unsummarized_aged_messages_stay_in_prompt(app, monkeypatch):
+    monkeypatch.setattr(Config, "CHAT_SUMMARY_ENABLED", True)
+    conv = Conversation(user_id="1", title="t")
+    db.session.add(conv)
+    db.session.commit()
+    msgs = [Message(conversation_id=conv.id, role="user", content=f"m{i}") for i in range(12)]
+    db.session.add_all(msgs)
+    db.session.commit()
+    conv.summary, conv.summary_upto_id = "สรุป m0-m3", msgs[3].id
+    db.session.commit()
+
+    # หน้าต่าง 4 ข้อความล่าสุด (m8-m11); m4-m7 หลุดหน้าต่างแต่ยังไม่ถูกสรุป → ต้องยังอยู่
+    history = chat_history.load_history(conv, n=4)
+    assert history[0]["role"] == "system" and "m0-m3" in history[0]["content"]
+    assert [m["content"] for m in history[1:]] == [f"m{i}" for i in range(4, 12)]
+
+
+def test_summary_disabled_keeps_plain_window(app, monkeypatch):
+    monkeypatch.setattr(Config, "CHAT_SUMMARY_ENABLED", False)
+    conv = Conversation(user_id="1", title="t")
+    db.session.add(conv)
+    db.session.commit()
+    db.session.add_all([Message(conversation_id=conv.id, role="user", content=f"m{i}") for i in range(6)])
+    db.session.commit()
+    assert [m["content"] for m in chat_history.load_history(conv, n=3)] == ["m3", "m4", "m5"]
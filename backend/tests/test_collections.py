@@ -0,0 +1,28 @@
+import pytest
+
+from app.config import Config
+from app.services import rag
+
+
+def test_resolve_collections_own_and_default():
+    assert rag.resolve_collections("kb_u5", 5) == ["kb_u5"]
+    assert rag.resolve_collections(["kb_default"], None) == ["kb_default"]
+
+
+def test_resolve_collections_rejects_other_users():
+    with pytest.raises(rag.CollectionAccessError):
+        rag.resolve_collections(["kb_u5"], 7)
+    with pytest.raises(rag.CollectionAccessError):
+        rag.resolve_collections("kb_u5", None)
+
+
+def test_resolve_collections_shared(monkeypatch):
+    monkeypatch.setattr(Config, "RAG_SHARED_COLLECTIONS", ["team_docs"])
+    assert rag.resolve_collections("team_docs,kb_u1", 1) == ["team_docs", "kb_u1"]
+
+
+def test_search_other_users_collection_forbidden(client, auth_header):
+    res = client.post("/api/files/search", json={"query": "x", "collections": ["kb_u5"]}, headers=auth_header(7))
+    assert res.status_code == 403
+    res = client.post("/api/files/uploads", json={"filename": "a.txt", "size": 1, "collection": "kb_u5"})
+    assert res.status_code == 403
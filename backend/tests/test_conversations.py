@@ -0,0 +1,32 @@
+from app.extensions import db
+from app.models.conversation import Conversation
+
+
+def _walk(client, headers, limit):
+    seen, cursor = [], None
+    for _ in range(20):
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        res = client.get("/api/ai/conversations", query_string=params, headers=headers)
+        assert res.status_code == 200
+        body = res.get_json()
+        seen += [c["id"] for c in body["items"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            return seen
+    raise AssertionError("pagination did not terminate")
+
+
+def test_conversation_pages_walk_all_rows(client, auth_header):
+    # created_at จาก server_default ได้ค่าวินาทีเดียวกันทั้งหมด → ลำดับต้องมาจาก id
+    convs = [Conversation(user_id="1", title=f"c{i}") for i in range(5)]
+    db.session.add_all(convs + [Conversation(user_id="2", title="other")])
+    db.session.commit()
+
+    expected = sorted((c.id for c in convs), reverse=True)
+    assert _walk(client, auth_header(1), limit=1) == expected
+    assert _walk(client, auth_header(1), limit=2) == expected
+
+
+def test_invalid_cursor(client, auth_header):
+    res = client.get("/api/ai/conversations", query_string={"cursor": "!!"}, headers=auth_header(1))
+    assert res.status_code == 400
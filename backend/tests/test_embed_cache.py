@@ -0,0 +1,22 @@
+import threading
+
+from app.services.embed_cache import EmbeddingCache
+
+
+def test_counters_exact_under_threads(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embed.sqlite3"), max_items=0, mem_items=100)
+    cache.put_many("m", ["hit"], [[1.0, 2.0]])
+
+    def work():
+        for _ in range(200):
+            cache.get_many("m", ["hit", "miss"])
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    st = cache.stats()
+    assert st["mem_hits"] == 1600
+    assert st["misses"] == 1600
+    assert st["writes"] == 1
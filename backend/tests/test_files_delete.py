@@ -0,0 +1,21 @@
+def test_delete_bulk_requires_auth(client):
+    res = client.post("/api/files/delete-bulk", json={"names": ["a.txt"]})
+    assert res.status_code == 401
+
+
+def test_delete_bulk_rejects_other_users_collection(client, auth_header):
+    res = client.post("/api/files/delete-bulk", json={"names": ["a.txt"], "collections": ["kb_u5"]},
+                      headers=auth_header(7))
+    assert res.status_code == 403
+
+
+def test_delete_bulk_defaults_to_own_collections(client, auth_header, monkeypatch):
+    from app.services import rag
+    seen = {}
+    monkeypatch.setattr(rag, "list_collection_names", lambda: ["kb_default", "kb_u5", "kb_u7"])
+    monkeypatch.setattr(rag, "delete_sources",
+                        lambda names, collections: seen.update(collections=collections)
+                        or {"removed": 0, "files": {}, "collections": {}})
+    res = client.post("/api/files/delete-bulk", json={"names": ["a.txt"]}, headers=auth_header(7))
+    assert res.status_code == 200
+    assert seen["collections"] == ["kb_default", "kb_u7"]
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.config import Config
+from app.extensions import db
+from app.models.ingest_job import IngestJob
+from app.services import ingest_jobs, rag
+
+
+def _job(**kw):
+    kw.setdefault("path", "/nonexistent/a.txt")
+    job = IngestJob(filename="a.txt", stored_name="a.txt", **kw)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_resume_skips_live_owner_and_reclaims_dead(app, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(ingest_jobs._executor(), "submit", lambda fn, job_id: submitted.append(job_id))
+    now = datetime.utcnow()
+    live = _job(status="running", owner=ingest_jobs._owner(), updated_at=now)
+    dead = _job(status="running", owner=f"{ingest_jobs._HOST}:{os.getpid()}:deadbeef", updated_at=now)
+    stale = _job(status="running", owner="otherhost:1:abc", updated_at=now - timedelta(hours=1))
+
+    ingest_jobs.resume_pending()
+    db.session.expire_all()
+    assert db.session.get(IngestJob, live.id).status == "running"
+    assert db.session.get(IngestJob, dead.id).status == "queued"
+    assert db.session.get(IngestJob, stale.id).status == "queued"
+    assert submitted == [dead.id, stale.id]
+
+
+def test_done_does_not_overwrite_cancelling(app):
+    job = _job(status="cancelling", owner=ingest_jobs._owner())
+    assert not ingest_jobs._finish(job.id, "done")
+    db.session.expire_all()
+    assert db.session.get(IngestJob, job.id).status == "cancelling"
+
+
+def test_heartbeat_runs_while_ingest_is_silent(app, monkeypatch):
+    monkeypatch.setattr(Config, "INGEST_HEARTBEAT_SEC", 1)
+    release = threading.Event()
+    beats = []
+
+    def slow_ingest(path, progress=None, should_cancel=None, **kw):
+        # เหมือนอ่าน PDF ใหญ่: ยังไม่เรียก progress เลย
+        for _ in range(30):
+            if release.wait(0.1):
+                break
+            beats.append(IngestJob.query.with_entities(IngestJob.updated_at).filter_by(id=job.id).scalar())
+        return {"chunks": 0}
+
+    monkeypatch.setattr(rag, "ingest_file", slow_ingest)
+    job = _job(status="queued")
+    ingest_jobs._run_in_context(job.id)
+    db.session.expire_all()
+    assert db.session.get(IngestJob, job.id).status == "done"
+    assert len(set(b for b in beats if b is not None)) >= 2  # updated_at ขยับระหว่าง ingest
+
+
+def test_overwritten_upload_is_not_a_duplicate(app, tmp_path):
+    # a.txt v1 → a.txt v2 (ชื่อเดิม เขียนทับไฟล์เดิม) → อัปโหลด v1 ซ้ำต้องได้ ไม่ใช่ DUPLICATE
+    path = tmp_path / "a.txt"
+    path.write_text("v2")
+    _job(status="done", sha256="sha_v1", collection="kb_default", path=str(path))
+    v2 = _job(status="done", sha256="sha_v2", collection="kb_default", path=str(path))
+    assert ingest_jobs.find_by_hash("sha_v1", "kb_default") is None
+    assert ingest_jobs.find_by_hash("sha_v2", "kb_default").id == v2.id
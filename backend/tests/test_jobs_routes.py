@@ -0,0 +1,31 @@
+from app.extensions import db
+from app.models.ingest_job import IngestJob
+
+
+def _job(uid, status="queued"):
+    job = IngestJob(filename="secret.pdf", stored_name="secret.pdf", path="/nonexistent/secret.pdf",
+                    collection=f"kb_u{uid}", status=status, uid=uid)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_jobs_scoped_to_owner(client, auth_header):
+    job = _job(5)
+    assert [j["id"] for j in client.get("/api/files/jobs", headers=auth_header(5)).get_json()["items"]] == [job.id]
+    assert client.get(f"/api/files/jobs/{job.id}", headers=auth_header(5)).status_code == 200
+
+    assert client.get("/api/files/jobs", headers=auth_header(7)).get_json()["items"] == []
+    assert client.get("/api/files/jobs").get_json()["items"] == []
+    assert client.get(f"/api/files/jobs/{job.id}", headers=auth_header(7)).status_code == 404
+    assert client.get(f"/api/files/jobs/{job.id}").status_code == 404
+
+
+def test_other_user_cannot_cancel(client, auth_header):
+    job = _job(5)
+    assert client.post(f"/api/files/jobs/{job.id}/cancel", headers=auth_header(7)).status_code == 404
+    assert client.post(f"/api/files/jobs/{job.id}/cancel").status_code == 404
+    db.session.expire_all()
+    assert db.session.get(IngestJob, job.id).status == "queued"
+    res = client.post(f"/api/files/jobs/{job.id}/cancel", headers=auth_header(5))
+    assert res.status_code == 202 and res.get_json()["job"]["status"] == "cancelled"
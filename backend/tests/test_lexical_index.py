@@ -0,0 +1,78 @@
+import time
+
+from app.services import lexical_index, rag
+
+
+class FakeCollection:
+    def __init__(self, name, docs):
+        self.name = name
+        self.docs = docs
+
+    def get(self, include=None, limit=None, offset=0):
+        part = self.docs[offset:offset + limit]
+        return {"ids": [f"id{i}" for i in range(offset, offset + len(part))],
+                "documents": part, "metadatas": [{"source": "a.txt"}] * len(part)}
+
+
+DOCS = [
+    "งบประมาณโครงการพัฒนาคุณภาพชีวิตของประชาชน",
+    "การประชุมคณะกรรมการการศึกษา",
+    "การรายงานผลการดำเนินงานประจำปี",
+    "รหัสสินค้า AB-1200 สำหรับการสั่งซื้อ",
+]
+
+
+def test_thai_query_is_phrase_not_bigram_or():
+    expr = lexical_index._match_expr(lexical_index._query_terms("งบประมาณ"))
+    # 4 ตัวอักษรต่อ phrase (bigram 3 ตัวติดกัน) และคำค้นสั้นต้องเจอครบทุก phrase
+    assert expr == '"งบ บป ปร" AND "ปร ระ ะม" AND "ะม มา าณ"'
+
+
+def test_scores_separate_on_and_off_topic(tmp_path):
+    idx = lexical_index.LexicalIndex(str(tmp_path / "lex.sqlite3"))
+    idx.add("c", [f"id{i}" for i in range(len(DOCS))], DOCS, [{}] * len(DOCS))
+    on = idx.search("งบประมาณโครงการ", ["c"], 10)
+    assert on and on[0][1] == "id0" and on[0][2] >= rag.Config.RAG_LEXICAL_MIN_SCORE
+    off = idx.search("นโยบายการลาพักร้อนของบริษัทคืออะไร", ["c"], 10)
+    assert all(score < rag.Config.RAG_LEXICAL_MIN_SCORE for _, _, score in off)
+
+
+def test_fuse_drops_weak_lexical_only_hits():
+    dense = [(0.1, "doc", {"collection": "c"}, "d1", None)]
+    lex = [("c", "weak", 0.05), ("c", "d1", 0.01)]
+    fused = rag._fuse(dense, lex)
+    assert [it[3] for it in fused] == ["d1"]
+
+
+def test_backfill_on_first_search():
+    idx = lexical_index.get_index()
+    col = FakeCollection("kb_backfill", DOCS)
+    assert lexical_index.ensure_backfilled([col.name], lambda name, create=False: col) == []
+    for _ in range(100):
+        if idx.is_complete(col.name):
+            break
+        time.sleep(0.02)
+    assert idx.count(col.name) == len(DOCS)
+    assert lexical_index.ensure_backfilled([col.name], lambda name, create=False: col) == [col.name]
+
+
+def test_idf_stats_without_full_scans(tmp_path):
+    idx = lexical_index.LexicalIndex(str(tmp_path / "lex.sqlite3"))
+    idx.add("c", [f"id{i}" for i in range(len(DOCS))], DOCS, [{}] * len(DOCS))
+    idx.add("d", ["x"], [DOCS[0]], [{}])
+    idx.add("c", ["id0"], [DOCS[0]], [{}])  # เขียนทับ id เดิม: จำนวนไม่เพิ่ม
+    idx.delete("c", ["id1"])
+    idx.drop_collection("d")
+    conn = idx._conn()
+    assert dict(conn.execute("SELECT key, value FROM stats"))["docs"] == conn.execute(
+        "SELECT COUNT(*) FROM chunks").fetchone()[0] == len(DOCS) - 1
+
+    first = idx.search("งบประมาณโครงการ", ["c"], 10)
+    sql = []
+    conn.set_trace_callback(sql.append)
+    assert idx.search("งบประมาณโครงการ", ["c"], 10) == first
+    conn.set_trace_callback(None)
+    assert not [q for q in sql if "COUNT(*)" in q]  # df จำไว้แล้ว, จำนวนแถวอ่านจาก stats
+
+    idx.add("c", ["new"], ["งบประมาณโครงการใหม่"], [{}])  # index เปลี่ยน → df คำนวณใหม่
+    assert idx.search("งบประมาณโครงการ", ["c"], 10)[0][2] != first[0][2]
@@ -0,0 +1,57 @@
+import pytest
+
+from app.services import model_registry, ollama_client, token_budget
+
+
+class _Resp:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def ollama(monkeypatch):
+    """Ollama ปลอม: /api/tags มีโมเดล "m:latest", /api/show ตอบตาม show["data"] และนับจำนวนครั้งที่ถูกถาม"""
+    show = {"data": {}, "calls": 0}
+
+    def post(path, endpoint, **kw):
+        show["calls"] += 1
+        return _Resp(show["data"])
+
+    monkeypatch.setattr(ollama_client, "_post", post)
+    monkeypatch.setattr(model_registry, "_get",
+                        lambda path, endpoint, **kw: _Resp({"models": [{"name": "m:latest", "digest": "d1"}]}))
+    monkeypatch.setattr(model_registry, "_models", {})
+    monkeypatch.setattr(model_registry, "_loaded_at", 0.0)
+    monkeypatch.setattr(model_registry, "_attempted_at", 0.0)
+    return show
+
+
+def test_num_ctx_not_sent_unless_configured(ollama, monkeypatch):
+    ollama["data"] = {"model_info": {"llama.context_length": 131072}, "parameters": "num_ctx 16384"}
+    monkeypatch.setattr(ollama_client, "OLLAMA_NUM_CTX", 0)
+    assert ollama_client.chat_options("m") == {}
+    assert model_registry.context_length("m") == 16384  # งบ token ตาม Modelfile
+
+
+def test_configured_num_ctx_capped_by_model(ollama, monkeypatch):
+    ollama["data"] = {"model_info": {"llama.context_length": 2048}}
+    monkeypatch.setattr(ollama_client, "OLLAMA_NUM_CTX", 8192)
+    assert ollama_client.chat_options("m") == {"num_ctx": 2048}
+
+
+def test_budget_reads_registry_once(ollama, monkeypatch):
+    ollama["data"] = {"model_info": {"llama.context_length": 8192}}
+    monkeypatch.setattr(ollama_client, "OLLAMA_NUM_CTX", 0)
+    monkeypatch.setattr(ollama_client, "OLLAMA_DEFAULT_NUM_CTX", 4096)
+    first = token_budget.prompt_budget("m")
+    assert token_budget.prompt_budget("m") == first
+    assert ollama["calls"] == 1  # /api/show ถามครั้งเดียว แล้วจำไว้ใน registry
+    assert model_registry.get("m")["context_length"] == 8192
+    # โมเดลที่ registry ไม่รู้จัก → ค่าเริ่มต้นของ server
+    assert model_registry.context_length("other") == 4096
@@ -0,0 +1,40 @@
+import io
+
+import requests
+
+from app.services import ollama_client
+
+
+def _session(monkeypatch):
+    pool = ollama_client._OllamaSession(pool_size=2)
+
+    def fake_request(method, url, **kw):
+        r = requests.Response()
+        r.status_code = 200
+        r.raw = io.BytesIO(b'{"done": true}\n')
+        return r
+
+    monkeypatch.setattr(pool.session(), "request", fake_request)
+    return pool
+
+
+def test_stream_counted_until_closed(monkeypatch):
+    pool = _session(monkeypatch)
+    with pool.request("POST", "http://ollama/api/chat", "stream", stream=True) as r:
+        assert pool.stats()["in_flight"] == 1
+        list(r.iter_lines())
+    assert pool.stats()["in_flight"] == 0
+    r.close()  # ปิดซ้ำไม่ลดซ้ำ
+    assert pool.stats()["in_flight"] == 0
+    assert pool.stats()["peak_in_flight"] == 1
+
+
+def test_plain_request_released_on_return(monkeypatch):
+    pool = _session(monkeypatch)
+    pool.request("GET", "http://ollama/api/tags", "tags")
+    assert pool.stats()["in_flight"] == 0
+
+
+def test_pool_route_requires_auth(client, auth_header):
+    assert client.get("/api/ai/ollama/pool").status_code == 401
+    assert client.get("/api/ai/ollama/pool", headers=auth_header(1)).status_code == 200
@@ -0,0 +1,36 @@
+import random
+
+import numpy as np
+
+from app.config import Config
+from app.services import rag
+
+
+def _items(n, seed=0):
+    rnd = random.Random(seed)
+    return [(round(rnd.uniform(0.1, 0.6), 2), f"doc {i}", {}, f"id{i}", None) for i in range(n)]
+
+
+def test_cutoff_paths_agree(monkeypatch):
+    monkeypatch.setattr(Config, "RAG_MAX_DISTANCE", 0.5, raising=False)
+    for n in (1, 5, 40, 300):
+        items = _items(n, seed=n)
+        plain = rag._adaptive_cutoff(list(items), 6)
+        monkeypatch.setattr(rag, "_NUMPY_CUTOFF_MIN", 0)
+        vector = rag._adaptive_cutoff(list(items), 6)
+        monkeypatch.undo()
+        monkeypatch.setattr(Config, "RAG_MAX_DISTANCE", 0.5, raising=False)
+        assert [it[3] for it in plain] == [it[3] for it in vector]
+        assert len(plain) >= min(n, 6)
+
+
+def test_mmr_keeps_items_without_embedding_last():
+    e = np.eye(3, dtype=np.float32)
+    items = [
+        (0.1, "a", {}, "a", e[0]),
+        (0.2, "no-emb", {}, "x", None),
+        (0.3, "a-dup", {}, "a2", e[0]),
+        (0.4, "b", {}, "b", e[1]),
+    ]
+    out = [it[3] for it in rag._mmr(items, [1.0, 0.5, 0.0], 6)]
+    assert out == ["a", "b", "x"]  # a2 ซ้ำกับ a จึงถูกทิ้ง, x ไม่มี embedding อยู่ท้าย
@@ -0,0 +1,28 @@
+from app.config import Config
+from app.services import token_budget
+
+
+def _reset(monkeypatch, path):
+    monkeypatch.setattr(Config, "RAG_TOKENIZER", path, raising=False)
+    monkeypatch.setattr(token_budget, "_tok", None)
+    monkeypatch.setattr(token_budget, "_tok_loaded", False)
+
+
+def test_local_tokenizer_json(tmp_path, monkeypatch):
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    tok = Tokenizer(models.WordLevel({"a": 0, "b": 1, "[UNK]": 2}, unk_token="[UNK]"))
+    tok.pre_tokenizer = pre_tokenizers.Whitespace()
+    path = tmp_path / "tokenizer.json"
+    tok.save(str(path))
+    _reset(monkeypatch, str(path))
+    assert token_budget.count_tokens("a b c a") == 4
+
+
+def test_missing_tokenizer_warns_once_and_estimates(tmp_path, monkeypatch, caplog):
+    # ชื่อที่ไม่ใช่ไฟล์ต้องไม่ถูกตีความเป็น repo บน hub
+    _reset(monkeypatch, "bert-base-uncased")
+    with caplog.at_level("WARNING", logger=token_budget.__name__):
+        assert token_budget.count_tokens("abcdefgh") == 2
+        assert token_budget.count_tokens("abcd") == 1
+    assert token_budget._tok is None
+    assert sum("RAG_TOKENIZER" in r.getMessage() for r in caplog.records) == 1
@@ -0,0 +1,38 @@
+import hashlib
+import io
+import os
+
+from flask import Request
+
+from app.config import Config
+from app.services import ingest_jobs, uploads
+
+
+def _post(client, body: bytes, name="notes.txt"):
+    return client.post("/api/files/upload", data={"file": (io.BytesIO(body), name)},
+                       content_type="multipart/form-data")
+
+
+def test_upload_streams_into_spool_once(client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(ingest_jobs._executor(), "submit", lambda fn, job_id: submitted.append(job_id))
+
+    def no_werkzeug_spool(*a, **kw):
+        raise AssertionError("body must not be spooled by Werkzeug")
+
+    monkeypatch.setattr(Request, "_get_file_stream", no_werkzeug_spool)
+    body = b"hello world\n" * 1000
+    res = _post(client, body)
+    assert res.status_code == 202, res.get_json()
+    with open(os.path.join(Config.UPLOAD_DIR, "notes.txt"), "rb") as f:
+        assert f.read() == body
+    assert res.get_json()["job"]["sha256"] == hashlib.sha256(body).hexdigest()
+    assert not [fn for fn in os.listdir(uploads._dir()) if fn.endswith(".tmp")]
+
+    assert _post(client, body).status_code == 409  # เนื้อหาเดิม → DUPLICATE
+    assert not [fn for fn in os.listdir(uploads._dir()) if fn.endswith(".tmp")]
+
+
+def test_upload_without_file(client):
+    res = client.post("/api/files/upload", data={"collection": "kb_default"}, content_type="multipart/form-data")
+    assert res.status_code == 400
@@ -0,0 +1,46 @@
+import fcntl
+import io
+import os
+
+import pytest
+
+from app.services import uploads
+
+
+@pytest.fixture
+def meta(app):
+    return uploads.create("doc.txt", 10, "kb_default")
+
+
+def test_append_resumes_at_offset(meta):
+    assert uploads.append(meta, io.BytesIO(b"hello"), 0, 5) == 5
+    with pytest.raises(uploads.UploadError) as e:
+        uploads.append(meta, io.BytesIO(b"world"), 0, 5)
+    assert e.value.code == "OFFSET_MISMATCH" and e.value.extra["offset"] == 5
+    assert uploads.append(meta, io.BytesIO(b"world"), 5, 5) == 10
+
+
+def test_append_busy_while_other_worker_holds_lock(meta):
+    # จำลอง worker อื่น: เปิด .part แยกแล้วถือ flock ไว้
+    part, _ = uploads._paths(meta["id"])
+    fd = os.open(part, os.O_WRONLY | os.O_APPEND)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        with pytest.raises(uploads.UploadError) as e:
+            uploads.append(meta, io.BytesIO(b"hello"), 0, 5)
+        assert e.value.code == "BUSY"
+        with pytest.raises(uploads.UploadError):
+            uploads.abort(meta)
+    finally:
+        os.close(fd)
+    assert uploads.append(meta, io.BytesIO(b"hello"), 0, 5) == 5
+
+
+def test_finalized_upload_not_appended(meta, tmp_path):
+    uploads.append(meta, io.BytesIO(b"0123456789"), 0, 10)
+    dest = tmp_path / "doc.txt"
+    uploads.finalize(meta, str(dest))
+    with pytest.raises(uploads.UploadError) as e:
+        uploads.append(meta, io.BytesIO(b""), 10, 0)
+    assert e.value.status == 404
+    assert dest.read_bytes() == b"0123456789"
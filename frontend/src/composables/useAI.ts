@@ -2,7 +2,7 @@
 import { ref } from 'vue'
 import { api, getAuthHeader } from '@/services/api'
 import axios from 'axios'
-import type { ApiMsgDTO } from '@/types/chat'
+import type { ApiMsgDTO, MessagesPage } from '@/types/chat'
 
 type StreamOpts = { model: string; useKnowledge: boolean; topk: number }
 
@@ -11,6 +11,7 @@ const error = ref<string | null>(null)
 
 const conversationId = ref<number | null>(null)
 const knowledgeSources = ref<string[]>([])
+const lastUsage = ref<Record<string, any> | null>(null)   // eval_count / tokens_per_sec ของคำตอบล่าสุด
 
 let controller: AbortController | null = null
 
@@ -36,6 +37,35 @@ async function readTextStream(res: Response, onDelta: (s: string) => void) {
   }
 }
 
+// โหมด NDJSON ของ /ai/chat/stream: หนึ่งบรรทัดต่อ event
+// meta → sources → delta … → usage → done  (error: fatal=false คือ RAG ล่มแต่ยังตอบต่อ)
+type StreamEvent =
+  | { type: 'meta'; conversation_id: number; model: string; stage: string }
+  | { type: 'sources'; items: string[] }
+  | { type: 'delta'; content: string }
+  | { type: 'usage'; eval_count?: number; eval_duration?: number; prompt_eval_count?: number; tokens_per_sec?: number }
+  | { type: 'done'; conversation_id: number }
+  | { type: 'error'; stage: string; fatal: boolean; message: string }
+
+async function readNdjsonStream(res: Response, onEvent: (ev: StreamEvent) => void) {
+  const reader = res.body?.getReader()
+  if (!reader) return
+  const decoder = new TextDecoder()
+  let buf = ''
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buf += decoder.decode(value, { stream: true })   // stream: true กันอักษรไทยขาดกลาง byte
+    let nl: number
+    while ((nl = buf.indexOf('\n')) >= 0) {
+      const line = buf.slice(0, nl).trim()
+      buf = buf.slice(nl + 1)
+      if (!line) continue
+      try { onEvent(JSON.parse(line)) } catch { /* ข้ามบรรทัดเสีย */ }
+    }
+  }
+}
+
 async function streamChat(
   message: string,
   opts: StreamOpts,
@@ -45,6 +75,7 @@ async function streamChat(
   loading.value = true
   error.value = null
   knowledgeSources.value = [] // reset รอบใหม่
+  lastUsage.value = null
 
   controller?.abort()
   controller = new AbortController()
@@ -64,6 +95,7 @@ async function streamChat(
         conversation_id: conversationId.value,
         use_knowledge: opts.useKnowledge,
         topk: opts.topk,
+        stream_format: 'ndjson',
       }),
       credentials: 'include',
       signal: controller.signal,
@@ -88,7 +120,32 @@ async function streamChat(
     const ragErr = res.headers.get('X-RAG-Error')
     if (ragErr) console.warn('RAG error:', ragErr)
 
-    await readTextStream(res, onDelta)
+    // server รุ่นเก่าที่ยังตอบเป็น text/plain
+    if (!(res.headers.get('Content-Type') || '').includes('ndjson')) {
+      await readTextStream(res, onDelta)
+      return
+    }
+
+    await readNdjsonStream(res, ev => {
+      switch (ev.type) {
+        case 'meta':
+          conversationId.value = ev.conversation_id
+          break
+        case 'sources':
+          knowledgeSources.value = ev.items
+          break
+        case 'delta':
+          onDelta(ev.content)
+          break
+        case 'usage':
+          lastUsage.value = ev
+          break
+        case 'error':
+          if (ev.fatal) error.value = ev.message
+          else console.warn('RAG error:', ev.message)
+          break
+      }
+    })
   } catch (e: any) {
     if (e?.name !== 'AbortError') {
       console.error(e)
@@ -110,20 +167,27 @@ async function newConversation() {
   conversationId.value = null
 }
 
-async function listConversations() {
-  const { data } = await api.get('/ai/conversations')
+// ทีละหน้า: { items, next_cursor } — ส่ง cursor ที่ได้กลับไปเพื่อดึงหน้าถัดไป
+async function listConversations(params: { limit?: number; cursor?: string | null } = {}) {
+  const { data } = await api.get('/ai/conversations', {
+    params: { limit: params.limit, cursor: params.cursor || undefined },
+  })
   return data
 }
 
-async function loadMessages(convId: number): Promise<ApiMsgDTO[]> {
+// ทีละหน้า (เรียงเก่า → ใหม่): ไม่ระบุ = หน้าล่าสุด, before = หน้าที่เก่ากว่า, since_id = เฉพาะข้อความใหม่
+async function loadMessages(
+  convId: number,
+  params: { limit?: number; before?: number; since_id?: number } = {},
+): Promise<MessagesPage> {
   try {
     const { data, status } = await api.get('/ai/messages', {
-      params: { conversation_id: convId },
+      params: { conversation_id: convId, ...params },
     })
 
     //  ต้องเป็น 200 และ data.items เป็น Array
     if (status === 200 && Array.isArray(data?.items)) {
-      return data.items as ApiMsgDTO[]
+      return { items: data.items as ApiMsgDTO[], has_more: !!data.has_more }
     }
 
     // รูปแบบไม่ถูกต้อง
@@ -167,7 +231,7 @@ export function useAI() {
   return {
     // state
     loading, error,
-    conversationId, knowledgeSources,
+    conversationId, knowledgeSources, lastUsage,
 
     // actions
     streamChat, stop,
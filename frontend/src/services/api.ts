@@ -43,12 +43,60 @@ export const uploadFile = (file: File) => {
   })
 }
 
+/** ---------- อัปโหลดแบบ stream + ต่อได้ (ส่งเป็นก้อนไบต์ดิบ, หลุดแล้วส่งต่อจาก offset เดิม) ---------- */
+async function sha256Hex(file: File): Promise<string | undefined> {
+  // crypto.subtle ต้องอ่านทั้งไฟล์เข้าหน่วยความจำ → ใช้เฉพาะไฟล์ไม่ใหญ่มาก (และต้องเป็น secure context)
+  if (!globalThis.crypto?.subtle || file.size > 64 * 1024 * 1024) return undefined
+  const buf = await crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+  return Array.from(new Uint8Array(buf), (b) => b.toString(16).padStart(2, '0')).join('')
+}
+
+export async function uploadFileResumable(
+  file: File,
+  onProgress?: (sent: number, total: number) => void,
+  collection?: string,
+) {
+  // ส่ง sha256 ไปก่อน → ไฟล์ที่มีอยู่แล้วถูกปฏิเสธ (409 DUPLICATE) โดยไม่ต้องส่งเนื้อไฟล์
+  const sha256 = await sha256Hex(file)
+  const { data } = await api.post('/files/uploads', { filename: file.name, size: file.size, sha256, collection })
+  const { id, chunk_size } = data.upload
+  let offset: number = data.upload.offset
+  let retries = 0
+  for (;;) {
+    try {
+      const res = await api.put(`/files/uploads/${id}`, file.slice(offset, offset + chunk_size), {
+        headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': String(offset) },
+      })
+      if (res.data.job) return res // ก้อนสุดท้าย → { job, upload }
+      offset = res.data.upload.offset
+      retries = 0
+      onProgress?.(offset, file.size)
+    } catch (e: any) {
+      const status = e?.response?.status
+      const code = e?.response?.data?.code
+      // เน็ตหลุด/5xx/offset ไม่ตรง → ถาม offset ล่าสุดแล้วส่งต่อ; error อื่นโยนต่อ
+      if ((status && status < 500 && code !== 'OFFSET_MISMATCH') || ++retries > 5) throw e
+      await new Promise((r) => setTimeout(r, 1000 * retries))
+      offset = (await api.get(`/files/uploads/${id}`)).data.upload.offset
+    }
+  }
+}
+
+/** ---------- Ingest jobs (upload คืน { job } แล้ว ingest ต่อเบื้องหลัง) ---------- */
+export const getIngestJob = (id: number) => api.get(`/files/jobs/${id}`)
+export const listIngestJobs = (status?: string) =>
+  api.get('/files/jobs', { params: status ? { status } : {} })
+export const cancelIngestJob = (id: number) => api.post(`/files/jobs/${id}/cancel`)
+
 /** ---------- Delete Files / Knowledge Base ---------- */
 export function deleteFile(name: string) {
   // ถ้าชื่อไฟล์มีช่องว่าง/อักขระพิเศษ ควรเข้ารหัส
   return api.delete('/files/delete', { params: { name } });
   // หรือถ้าเป็น path: return api.delete(`/ai/files/${encodeURIComponent(name)}`);
 }
+// ลบหลายไฟล์พร้อมกัน (รวมชิ้นในคลัง) → { deleted, missing, removed_vectors, files }
+export const deleteFiles = (names: string[], collections?: string[]) =>
+  api.post('/files/delete-bulk', { names, ...(collections ? { collections } : {}) })
 export const listFiles = () => api.get('/files/list')
 
 export const searchKB = (query: string, k = 5) =>
@@ -11,6 +11,12 @@ export interface ApiMsgDTO {
   created_at: string
 }
 
+// หน้าหนึ่งของ GET /ai/messages (items เรียงเก่า → ใหม่)
+export interface MessagesPage {
+  items: ApiMsgDTO[]
+  has_more: boolean      // ยังมีข้อความต่อในทิศที่ดึง
+}
+
 // รูปแบบที่ UI ใช้จริง (View model)
 export interface ChatMsg {
   id: number